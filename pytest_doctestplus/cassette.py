@@ -0,0 +1,213 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+Recording of the HTTP(S) traffic of doctests into cassettes, and replay of the
+recorded responses, so that doctests using remote data can run offline.
+
+The traffic is intercepted at the level of `http.client.HTTPConnection`, which
+is used by `urllib.request`, and by ``urllib3`` and ``requests``.
+"""
+import base64
+import contextlib
+import hashlib
+import http.client
+import importlib
+import io
+import json
+import os
+import re
+
+__all__ = ['Cassette', 'CassetteError', 'cassette_path']
+
+
+class CassetteError(Exception):
+    """A request that was not recorded in the cassette was made in replay mode."""
+
+
+def cassette_path(directory, nodeid):
+    """Return the path of the cassette of the test with the given node id."""
+    return os.path.join(directory, re.sub(r'[^\w.-]+', '_', nodeid).strip('_') + '.json')
+
+
+def _as_bytes(data):
+    # The data given to `http.client.HTTPConnection.send`
+    if hasattr(data, 'read'):
+        data = data.read()
+    if isinstance(data, str):
+        return data.encode('iso-8859-1')
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data)
+    return b''.join(_as_bytes(chunk) for chunk in data)
+
+
+class _RecordedSocket:
+    """A stand-in for the socket of a connection, holding a recorded response."""
+
+    def __init__(self, response=b''):
+        self.response = response
+
+    def makefile(self, mode='rb', *args, **kwargs):
+        return io.BytesIO(self.response)
+
+    def sendall(self, data):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        pass
+
+
+def _raw_response(response, body, method):
+    # The raw bytes of a response, whose body was read (and de-chunked)
+    version = 'HTTP/1.0' if response.version == 10 else 'HTTP/1.1'
+    lines = [f'{version} {response.status} {response.reason}']
+    for name, value in response.msg.items():
+        if method != 'HEAD' and name.lower() in ('transfer-encoding', 'content-length'):
+            continue
+        lines.append(f'{name}: {value}')
+    if method != 'HEAD':
+        lines.append(f'Content-Length: {len(body)}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1') + body
+
+
+class Cassette:
+    """
+    The recorded HTTP(S) interactions of a test, stored as a JSON file.
+
+    In ``'record'`` mode, the requests are sent as usual, and the responses
+    are recorded.  In ``'replay'`` mode, no connection is made, and the
+    responses are served from the recorded interactions, matching the method,
+    URL and body of the requests.  The cassette is active within a ``with``
+    block.
+    """
+
+    def __init__(self, path, mode):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"invalid cassette mode: {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.interactions = []
+        self._played = set()
+        self._patched = []
+        if mode == 'replay' and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as f:
+            self.interactions = json.load(f)['interactions']
+
+    def save(self):
+        """Write the recorded interactions, if there are any."""
+        if not self.interactions:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'interactions': self.interactions}, f, indent=1)
+            f.write('\n')
+
+    @staticmethod
+    def request_key(connection, data):
+        """Return the method, URL and body hash of the request sent as ``data``."""
+        head, _, body = data.partition(b'\r\n\r\n')
+        lines = head.decode('iso-8859-1').split('\r\n')
+        method, target = lines[0].split()[:2]
+        if not target.startswith(('http://', 'https://')):
+            host = f'{connection.host}:{connection.port}'
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'host':
+                    host = value.strip()
+            scheme = 'https' if connection.default_port == 443 else 'http'
+            target = f'{scheme}://{host}{target}'
+        return {'method': method, 'url': target,
+                'body_sha1': hashlib.sha1(body).hexdigest()}
+
+    def record(self, request, response):
+        interaction = {'request': request}
+        try:
+            interaction['response'] = response.decode('utf-8')
+        except UnicodeDecodeError:
+            interaction['response_base64'] = base64.b64encode(response).decode('ascii')
+        self.interactions.append(interaction)
+
+    def play(self, request):
+        """
+        Return the recorded response to the request: the first one that was
+        not played yet, or else the last one.
+        """
+        matches = [i for i, interaction in enumerate(self.interactions)
+                   if interaction['request'] == request]
+        if not matches:
+            raise CassetteError(
+                f"no recorded response to {request['method']} {request['url']} in "
+                f"{self.path}; record it with --doctest-plus-cassette=record")
+        index = next((i for i in matches if i not in self._played), matches[-1])
+        self._played.add(index)
+        interaction = self.interactions[index]
+        if 'response' in interaction:
+            return interaction['response'].encode('utf-8')
+        return base64.b64decode(interaction['response_base64'])
+
+    def _patch(self, cls, name, function):
+        self._patched.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, function)
+
+    def __enter__(self):
+        cassette = self
+        send = http.client.HTTPConnection.send
+        getresponse = http.client.HTTPConnection.getresponse
+
+        def patched_send(self, data):
+            data = _as_bytes(data)
+            self._doctestplus_sent = getattr(self, '_doctestplus_sent', b'') + data
+            if cassette.mode == 'record':
+                send(self, data)
+            elif self.sock is None:
+                self.connect()
+
+        def patched_getresponse(self):
+            request = cassette.request_key(self, getattr(self, '_doctestplus_sent', b''))
+            self._doctestplus_sent = b''
+            if cassette.mode == 'replay':
+                self.sock = _RecordedSocket(cassette.play(request))
+                response = getresponse(self)
+                # Let the next request connect again, as if the server had
+                # closed the connection.
+                self.sock = None
+                return response
+
+            response = getresponse(self)
+            raw = _raw_response(response, response.read(), self._method)
+            cassette.record(request, raw)
+            recorded = self.response_class(_RecordedSocket(raw), method=self._method)
+            recorded.begin()
+            return recorded
+
+        def connect(self):
+            self.sock = _RecordedSocket()
+            # The recorded responses were received over verified connections
+            if hasattr(self, 'is_verified'):
+                self.is_verified = True
+
+        self._patch(http.client.HTTPConnection, 'send', patched_send)
+        self._patch(http.client.HTTPConnection, 'getresponse', patched_getresponse)
+
+        if self.mode == 'replay':
+            # Import urllib3, if available, so that its connections are
+            # patched too
+            with contextlib.suppress(ImportError):
+                importlib.import_module('urllib3.connection')
+            classes = [http.client.HTTPConnection]
+            while classes:
+                cls = classes.pop()
+                classes.extend(cls.__subclasses__())
+                if 'connect' in cls.__dict__:
+                    self._patch(cls, 'connect', connect)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._patched:
+            cls, name, function = self._patched.pop()
+            setattr(cls, name, function)
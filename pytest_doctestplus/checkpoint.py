@@ -0,0 +1,118 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+Checkpoints of the namespace of long doctests, from which a later run can
+resume them, as long as the examples before the checkpoint did not change.
+"""
+import hashlib
+import importlib
+import io
+import os
+import pickle
+import tempfile
+import types
+
+# The directory of the pytest cache holding the checkpoints
+CHECKPOINTS_DIR = "doctestplus-checkpoints"
+
+
+class _Pickler(pickle.Pickler):
+    # Modules are pickled by name, and imported again when unpickled
+    def reducer_override(self, obj):
+        if isinstance(obj, types.ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        return NotImplemented
+
+
+def _dumps(obj):
+    f = io.BytesIO()
+    _Pickler(f, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return f.getvalue()
+
+
+def dump_namespace(globs):
+    """
+    Pickle the values of the namespace that can be pickled, and return the
+    pickle and the names of the other values.
+    """
+    values = {name: value for name, value in globs.items() if name != '__builtins__'}
+    try:
+        return _dumps(values), []
+    except Exception:
+        pass
+
+    missing = []
+    for name, value in list(values.items()):
+        try:
+            _dumps(value)
+        except Exception:
+            missing.append(name)
+            del values[name]
+    return _dumps(values), missing
+
+
+def examples_digests(examples):
+    """
+    Return the digests of the examples before each of the examples, and of
+    all of them, which change whenever an example or its output changes.
+    """
+    digest = hashlib.sha1()
+    digests = [digest.hexdigest()]
+    for example in examples:
+        key = (example.source, example.want, example.exc_msg, sorted(example.options.items()))
+        digest.update(repr(key).encode('utf-8'))
+        digests.append(digest.hexdigest())
+    return digests
+
+
+class CheckpointStore:
+    """
+    The checkpoints of a doctest, in a directory holding one pickle per
+    checkpoint, named after the index of the example it precedes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, index):
+        return os.path.join(self.directory, f'{index}.pickle')
+
+    def save(self, index, digest, globs):
+        """
+        Save the namespace before the example with the given index, along with
+        the digest of the examples before it.
+        """
+        data, missing = dump_namespace(globs)
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with open(fd, 'wb') as f:
+                pickle.dump((digest, missing, data), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, self._path(index))
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+    def restore(self, indices, digests):
+        """
+        Return the index, the values and the names of the values that could
+        not be saved of the latest of the checkpoints before the examples with
+        the given indices whose digest matches, or `None`.  The checkpoints
+        whose digest does not match are removed.
+        """
+        for index in sorted(indices, reverse=True):
+            path = self._path(index)
+            try:
+                with open(path, 'rb') as f:
+                    digest, missing, data = pickle.load(f)
+            except Exception:
+                continue
+            if digest != digests[index]:
+                os.remove(path)
+                continue
+            try:
+                values = pickle.loads(data)
+            except Exception:
+                continue
+            return index, values, missing
+        return None
@@ -0,0 +1,87 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The client of the daemon of ``--doctest-plus-serve``, which runs the doctests
+of the given paths and node ids in the daemon, and prints their output::
+
+    doctestplus-client docs/index.rst pkg/module.py::pkg.module.func
+
+It exits with the exit status of the run, like pytest.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+from .daemon import SOCKET_NAME
+
+# The exit status of pytest for a usage error
+USAGE_ERROR = 4
+
+
+def find_socket(directory):
+    """Return the socket of a daemon in the directory or its parents, or None."""
+    directory = Path(directory).absolute()
+    for parent in (directory, *directory.parents):
+        path = parent / SOCKET_NAME
+        if path.exists():
+            return path
+    return None
+
+
+def run(path, args, cwd=None, out=None):
+    """
+    Run the doctests of the paths and node ids ``args`` (relative to ``cwd``)
+    in the daemon listening on ``path``, write their output to ``out``, and
+    return the exit status.
+    """
+    out = sys.stdout if out is None else out
+    request = {"cwd": os.fspath(cwd or os.getcwd()), "args": list(args),
+               "markup": out.isatty()}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(os.fspath(path))
+        connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with connection.makefile("rb") as f:
+            for line in f:
+                message = json.loads(line)
+                if "output" in message:
+                    out.write(message["output"])
+                    out.flush()
+                elif "error" in message:
+                    print(f"doctestplus-client: {message['error']}", file=sys.stderr)
+                    return USAGE_ERROR
+                else:
+                    return message["exitstatus"]
+    print("doctestplus-client: the daemon closed the connection", file=sys.stderr)
+    return USAGE_ERROR
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="doctestplus-client",
+        description="Run doctests in the daemon started by pytest --doctest-plus-serve.")
+    parser.add_argument("--socket", metavar="path",
+                        help=f"socket of the daemon (by default, {SOCKET_NAME} in the "
+                             "current directory or its parents)")
+    parser.add_argument("args", nargs="*", metavar="path[::name]",
+                        help="files, directories and node ids of the doctests to run "
+                             "(by default, all the doctests collected by the daemon)")
+    options = parser.parse_args(argv)
+
+    path = options.socket or find_socket(os.getcwd())
+    if path is None:
+        print(f"doctestplus-client: no {SOCKET_NAME} found, start a daemon with "
+              "pytest --doctest-plus --doctest-plus-serve", file=sys.stderr)
+        return USAGE_ERROR
+    try:
+        return run(path, options.args)
+    except OSError as exc:
+        print(f"doctestplus-client: cannot connect to the daemon on {path}: {exc}",
+              file=sys.stderr)
+        return USAGE_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
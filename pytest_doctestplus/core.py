@@ -0,0 +1,1606 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The implementation of the doctestplus plugin.  This is only imported by
+`pytest_doctestplus.plugin.pytest_configure` once doctestplus is enabled,
+to keep the startup of pytest fast when it is not.
+"""
+import ast
+import contextlib
+import copy
+import doctest
+import fnmatch
+import hashlib
+import inspect
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+from textwrap import indent
+from unittest import SkipTest
+
+import pytest
+from _pytest.outcomes import OutcomeException, Skipped  # Private API, but been around since 3.7
+from _pytest.doctest import _get_continue_on_failure  # Since 3.5, still in 7.3
+
+from pytest_doctestplus.utils import ModuleChecker
+
+from .diff import (ChangesetSpool, apply_changes, atomic_write, process_changesets,
+                   read_lines)
+from .output_checker import (CHECKPOINT, FIX, IGNORE_WARNINGS, REMOTE_DATA, SHOW_WARNINGS,
+                             OutputChecker)
+from .parser import FileDocTest, IncrementalDocTestParser, TextChunk
+from .cassette import Cassette, cassette_path
+from .checkpoint import CHECKPOINTS_DIR, CheckpointStore, examples_digests
+from .replay import (FAILED_EXAMPLES_KEY, dependencies, example_key, example_names,
+                     replay_examples)
+from .manifest import Manifest
+from .report import DoctestReport, doctest_record, skip_reason
+
+PYTEST_GE_8_0 = pytest.version_tuple >= (8, 0)
+PYTEST_GE_8_1_1 = pytest.version_tuple >= (8, 1, 1)
+
+comment_characters = {
+    '.txt': '#',
+    '.tex': '%',
+    '.rst': r'\.\.',
+    '.md': '<!--'
+}
+
+
+# For the IGNORE_WARNINGS and SHOW_WARNINGS option, we create a context manager
+# that doesn't require us to add any imports to the example list and contains
+# everything that is needed to silence or print warnings.
+
+IGNORE_WARNINGS_CONTEXT = """
+class _doctestplus_ignore_all_warnings:
+
+    def __init__(self):
+        import warnings
+        self._cw = warnings.catch_warnings()
+
+    def __enter__(self, *args, **kwargs):
+        result = self._cw.__enter__(*args, **kwargs)
+        import warnings
+        warnings.simplefilter('ignore')
+        return result
+
+    def __exit__(self, *args, **kwargs):
+        return self._cw.__exit__(*args, **kwargs)
+""".lstrip()
+
+
+SHOW_WARNINGS_CONTEXT = """
+class _doctestplus_show_all_warnings:
+
+    def __init__(self):
+        import warnings
+        self._cw = warnings.catch_warnings(record=True)
+
+    def __enter__(self, *args, **kwargs):
+        self.result = self._cw.__enter__(*args, **kwargs)
+        import warnings
+        warnings.simplefilter('always')
+        return self.result
+
+    def __exit__(self, *args, **kwargs):
+        self._cw.__exit__(*args, **kwargs)
+        for warn in self.result:
+            print(f'{warn._category_name}: {warn.message}')
+""".lstrip()
+
+
+def _helper_example(source):
+    """
+    Return an example inserted by doctestplus, which is not counted as an
+    example of the doctest.
+    """
+    example = doctest.Example(source=source, want='')
+    example._doctestplus_helper = True
+    return example
+
+
+@contextlib.contextmanager
+def _timed(hook, **info):
+    """
+    Time the block, and store its ``wall`` duration in ``info``.  If the given
+    hook is implemented, it is then called with ``info``, which also holds the
+    ``start`` time and ``cpu`` duration of the block.
+    """
+    if not hook.get_hookimpls():
+        start = time.perf_counter()
+        yield info
+        info["wall"] = time.perf_counter() - start
+        return
+
+    start = time.time()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield info
+    finally:
+        info.update(start=start, wall=time.perf_counter() - wall,
+                    cpu=time.process_time() - cpu)
+        hook(info=info)
+
+
+def get_optionflags(parent):
+    optionflags_str = parent.config.getini('doctest_optionflags')
+    flag_int = 0
+    for flag_str in optionflags_str:
+        flag_int |= doctest.OPTIONFLAGS_BY_NAME[flag_str]
+    return flag_int
+
+
+def _is_numpy_ufunc(method):
+    try:
+        import numpy as np
+    except ModuleNotFoundError:
+        # If Numpy is not installed, then there can't be any ufuncs!
+        return False
+    while True:
+        try:
+            method = method.__wrapped__
+        except AttributeError:
+            break
+    return isinstance(method, np.ufunc)
+
+
+def configure(config, doctest_plugin, use_doctest_ufunc):
+    """
+    Replace the doctest plugin of pytest with doctestplus.
+    """
+    # We monkey-patch in our replacement doctest OutputChecker.  Not
+    # great, but there isn't really an API to replace the checker when
+    # using doctest.testfile, unfortunately.
+    doctest.OutputChecker = OutputChecker
+    # Likewise, `doctest` runs the examples with `exec`, which does not run
+    # the examples using top-level ``await``.  The `exec` of `doctest`, if
+    # something else replaced it too, is restored by `DoctestPlus`.
+    previous_exec = vars(doctest).get("exec")
+    doctest.exec = exec_example
+    OutputChecker.rtol = max(float(config.getini("doctest_plus_rtol")),
+                             float(config.getoption("doctest_plus_rtol")))
+    OutputChecker.atol = max(float(config.getini("doctest_plus_atol")),
+                             float(config.getoption("doctest_plus_atol")))
+    OutputChecker.fix = True
+    OutputChecker.cache_size = int(config.getini("doctest_plus_cache_size"))
+    OutputChecker.cache_clear()
+
+    use_rst = config.getini('doctest_rst') or config.option.doctest_rst
+    file_ext = config.option.text_file_format or config.getini('text_file_format') or 'rst'
+    if use_rst:
+        config.option.doctestglob.append(f'*.{file_ext}')
+
+    # override default comment characters
+    ext_comment_pairs = [pair.split('=') for pair in config.getini('text_file_comment_chars')]
+    for ext, chars in ext_comment_pairs:
+        comment_characters[ext] = chars
+
+    # Fetch the global hook function:
+    global doctestplus_diffhook
+    doctestplus_diffhook = config.hook.pytest_doctestplus_diffhook
+    DocTestFinderPlus._requirement_hook = config.hook.pytest_doctestplus_requirement
+
+    trace_path = config.getoption("doctest_plus_trace")
+    if trace_path:
+        from .trace import Tracer
+        config.pluginmanager.register(Tracer(config, trace_path), "doctestplus-trace")
+
+    profile_pattern = config.getoption("doctest_plus_profile")
+    if profile_pattern is not None:
+        from .profiling import Profiler
+        directory = os.path.join(config.rootpath, config.getini("doctest_plus_profile_dir"))
+        config.pluginmanager.register(Profiler(config, profile_pattern, directory),
+                                      "doctestplus-profile")
+
+    importtime_path = config.getoption("doctest_plus_importtime")
+    if importtime_path is not None:
+        from .importtime import ImportTimer
+        config.pluginmanager.register(ImportTimer(config, importtime_path),
+                                      "doctestplus-importtime")
+
+    gc_strategies = config.getini("doctest_plus_gc")
+    if gc_strategies:
+        from .gcstrategy import GarbageCollection
+        config.pluginmanager.register(GarbageCollection(config, gc_strategies),
+                                      "doctestplus-gc")
+
+    preload_modules = config.getini("doctest_plus_preload")
+    processes = config.getoption("doctest_plus_fork")
+    if preload_modules or processes:
+        from .zygote import Zygote, preload
+        preload(preload_modules)
+        if processes:
+            if not hasattr(os, "fork"):
+                raise pytest.UsageError("--doctest-plus-fork requires os.fork")
+            config.pluginmanager.register(Zygote(config, processes), "doctestplus-zygote")
+
+    threads = config.getoption("doctest_plus_threads")
+    if threads:
+        if processes:
+            raise pytest.UsageError(
+                "--doctest-plus-threads cannot be used with --doctest-plus-fork")
+        from .threadpool import SERIAL_MARKER, ThreadPool
+        config.addinivalue_line(
+            "markers", f"{SERIAL_MARKER}: run the doctest in the main thread, "
+                       "with --doctest-plus-threads")
+        config.pluginmanager.register(ThreadPool(config, threads), "doctestplus-threads")
+
+    watch = config.getoption("doctest_plus_watch")
+    socket_path = config.getoption("doctest_plus_serve")
+    for option, enabled in (("--doctest-plus-watch", watch),
+                            ("--doctest-plus-serve", socket_path is not None)):
+        if not enabled:
+            continue
+        if not hasattr(os, "fork"):
+            raise pytest.UsageError(f"{option} requires os.fork")
+        if getattr(config.option, "dist", "no") != "no":
+            raise pytest.UsageError(f"{option} cannot be used with pytest-xdist")
+    # Registered last, to run their runtestloop before those of the other plugins
+    if watch:
+        if socket_path is not None:
+            raise pytest.UsageError(
+                "--doctest-plus-watch cannot be used with --doctest-plus-serve")
+        from .watch import Watch
+        config.pluginmanager.register(Watch(config), "doctestplus-watch")
+    elif socket_path is not None:
+        from .daemon import Daemon
+        config.pluginmanager.register(Daemon(config, socket_path), "doctestplus-daemon")
+
+    if config.option.doctest_plus_generate_diff:
+        # The changes are spilled to disk, in a directory that is shared with
+        # the pytest-xdist workers (see `pytest_configure_node`).
+        workerinput = getattr(config, "workerinput", None)
+        if workerinput is None:
+            DebugRunnerPlus._spool = ChangesetSpool(tempfile.mkdtemp(prefix="doctestplus-"))
+        else:
+            DebugRunnerPlus._spool = ChangesetSpool(workerinput["doctestplus_spool_dir"],
+                                                    workerinput["workerid"])
+
+    # The doctests that use remote data run when it is allowed, or when the
+    # responses are replayed from cassettes.
+    run_remote_data = (config.getoption('remote_data', 'none') == 'any'
+                       or config.getoption('doctest_plus_cassette') == 'replay')
+    if config.getoption('doctest_plus_cassette') == 'record' and not run_remote_data:
+        raise pytest.UsageError("--doctest-plus-cassette=record requires --remote-data=any "
+                                "(from pytest-remotedata)")
+
+    class DocTestModulePlus(doctest_plugin.DoctestModule):
+        # pytest 2.4.0 defines "collect".  Prior to that, it defined
+        # "runtest".  The "collect" approach is better, because we can
+        # skip modules altogether that have no doctests.  However, we
+        # need to continue to override "runtest" so that the built-in
+        # behavior (which doesn't do whitespace normalization or
+        # handling __doctest_skip__) doesn't happen.
+        def collect(self):
+            # When running directly from pytest we need to make sure that we
+            # don't accidentally import setup.py!
+            fspath = self.path
+            filepath = self.path.name
+
+            if filepath in ("setup.py", "__main__.py"):
+                return
+            # The time taken by each phase of the collection, for the report
+            self._doctestplus_timings = timings = {}
+            with _timed(self.ihook.pytest_doctestplus_import, path=fspath, module=None) as info:
+                try:
+                    from _pytest.pathlib import import_path
+                    mode = self.config.getoption("importmode")
+
+                    if PYTEST_GE_8_1_1:
+                        consider_namespace_packages = self.config.getini(
+                            "consider_namespace_packages")
+                        module = import_path(
+                            fspath, mode=mode, root=self.config.rootpath,
+                            consider_namespace_packages=consider_namespace_packages)
+                    else:
+                        module = import_path(fspath, mode=mode, root=self.config.rootpath)
+                except ImportError:
+                    if self.config.getvalue("doctest_ignore_import_errors"):
+                        pytest.skip("unable to import module %r" % fspath)
+                    else:
+                        raise
+                info["module"] = module
+            timings["import"] = info["wall"]
+
+            options = get_optionflags(self) | FIX
+
+            # uses internal doctest module parsing mechanism
+            finder = DocTestFinderPlus(doctest_ufunc=use_doctest_ufunc)
+            runner = DebugRunnerPlus(
+                verbose=False,
+                optionflags=options,
+                checker=OutputChecker(),
+                # Helper disables continue-on-failure when debugging is enabled
+                continue_on_failure=_get_continue_on_failure(config),
+                generate_diff=config.option.doctest_plus_generate_diff,
+                example_hook=self.ihook.pytest_doctestplus_example,
+            )
+
+            with _timed(self.ihook.pytest_doctestplus_find, path=fspath, module=module) as info:
+                tests = info["tests"] = finder.find(module)
+            timings["find"] = info["wall"]
+
+            for test in tests:
+                if test.examples:  # skip empty doctests
+                    ignore_warnings_context_needed = False
+                    show_warnings_context_needed = False
+
+                    for example in test.examples:
+                        if not run_remote_data and example.options.get(REMOTE_DATA):
+                            example.options[doctest.SKIP] = True
+                            example._doctestplus_skip_reason = 'remote data'
+
+                        # If warnings are to be ignored we need to catch them by
+                        # wrapping the source in a context manager.
+                        elif example.options.get(IGNORE_WARNINGS, False):
+                            example.source = ("with _doctestplus_ignore_all_warnings():\n"
+                                              + indent(example.source, '    '))
+                            ignore_warnings_context_needed = True
+
+                        # Same for SHOW_WARNINGS
+                        elif example.options.get(SHOW_WARNINGS, False):
+                            example.source = ("with _doctestplus_show_all_warnings():\n"
+                                              + indent(example.source, '    '))
+                            show_warnings_context_needed = True
+
+                    # We insert the definition of the context manager to ignore
+                    # warnings at the start of the file if needed.
+                    if ignore_warnings_context_needed:
+                        test.examples.insert(0, _helper_example(IGNORE_WARNINGS_CONTEXT))
+
+                    if show_warnings_context_needed:
+                        test.examples.insert(0, _helper_example(SHOW_WARNINGS_CONTEXT))
+
+                    try:
+                        yield doctest_plugin.DoctestItem.from_parent(
+                            self, name=test.name, runner=runner, dtest=test
+                        )
+                    except AttributeError:
+                        # pytest < 5.4
+                        yield doctest_plugin.DoctestItem(
+                            test.name, self, runner, test)
+
+    manifest_path = config.getini("doctest_plus_manifest")
+    manifest = Manifest.load(config.rootpath / manifest_path) if manifest_path else None
+
+    class DocTestTextfilePlus(pytest.Module):
+        obj = None
+
+        def collect(self):
+            fspath = self.path
+            filepath = self.path.name
+
+            encoding = self.config.getini("doctest_encoding")
+            filename = str(fspath)
+            globs = {"__name__": "__main__"}
+
+            optionflags = get_optionflags(self) | FIX
+
+            runner = DebugRunnerPlus(
+                verbose=False, optionflags=optionflags, checker=OutputChecker(),
+                continue_on_failure=_get_continue_on_failure(self.config),
+                generate_diff=self.config.option.doctest_plus_generate_diff,
+                example_hook=self.ihook.pytest_doctestplus_example,
+            )
+
+            # The file is read line by line (twice), to avoid holding large
+            # files in memory.
+            parser = DocTestParserPlus()
+            with _timed(self.ihook.pytest_doctestplus_parse, path=fspath) as info:
+                # The files that did not change since the manifest written by
+                # the Sphinx extension are not parsed again
+                entries = None if manifest is None else manifest.entries(fspath, encoding)
+                if entries is not None:
+                    examples = list(parser.apply_directives(entries, filepath))
+                else:
+                    with open(fspath, encoding=encoding) as f:
+                        min_indent = parser.min_indent(f)
+                    with open(fspath, encoding=encoding) as f:
+                        examples = list(parser.iter_examples(f, filepath, min_indent))
+                info["examples"] = examples
+            # The time taken by each phase of the collection, for the report
+            self._doctestplus_timings = {"parse": info["wall"]}
+            test = FileDocTest(examples, globs, filepath, filename, 0, encoding)
+            if test.examples:
+                try:
+                    yield doctest_plugin.DoctestItem.from_parent(
+                        self, name=test.name, runner=runner, dtest=test
+                    )
+                except AttributeError:
+                    # pytest < 5.4
+                    yield doctest_plugin.DoctestItem(test.name, self, runner, test)
+
+    class DocTestParserPlus(IncrementalDocTestParser):
+        """
+        An extension to the builtin DocTestParser that handles the
+        special directives for skipping tests.
+
+        The directives are:
+
+           - ``.. doctest-skip::``: Skip the next doctest chunk.
+
+           - ``.. doctest-requires:: module1, module2``: Skip the next
+             doctest chunk if the given modules/packages are not
+             installed.
+
+           - ``.. doctest-requires-all:: module1, module2``: Skip all subsequent
+             doctest chunks if the given modules/packages are not
+             installed.
+
+           - ``.. doctest-skip-all``: Skip all subsequent doctests.
+
+           - ``.. doctest-remote-data::``: Skip the next doctest chunk if
+             --remote-data is not passed.
+
+           - ``.. doctest-remote-data-all::``: Skip all subsequent doctest
+             chunks if --remote-data is not passed.
+        """
+
+        def parse(self, s, name=None):
+            # Unlike `doctest.DocTestParser.parse`, this only returns the
+            # examples, and not the text between them.
+            s = s.expandtabs()
+            lines = io.StringIO(s, newline='\n')
+            return list(self.iter_examples(lines, name, self._min_indent(s)))
+
+        def iter_examples(self, text_lines, name=None, min_indent=0):
+            """
+            Parse the examples from an iterable of lines (see
+            `IncrementalDocTestParser.iter_parse`), and apply the directives
+            to them as they are yielded.
+            """
+            return self.apply_directives(self.iter_parse(text_lines, name or '<string>',
+                                                         min_indent), name)
+
+        def apply_directives(self, entries, name=None):
+            """
+            Apply the directives to the examples of the entries of
+            `IncrementalDocTestParser.iter_parse`, as they are yielded.
+            """
+            required = []
+            skip_next = False
+            skip_all = False
+            # Whether `skip_next` and `skip_all` come from a directive, a
+            # requirement, or remote data
+            skip_next_reason = None
+            skip_all_reason = None
+
+            ext = os.path.splitext(name)[1] if name else '.rst'
+            if ext not in comment_characters:
+                warnings.warn("file format '{}' is not recognized, assuming "
+                              "'{}' as the comment character."
+                              .format(ext, comment_characters['.rst']))
+                ext = '.rst'
+            comment_char = comment_characters[ext]
+
+            ignore_warnings_context_defined = False
+            show_warnings_context_defined = False
+
+            remote_data_next = False
+            remote_data_all = False
+            checkpoint_next = False
+            checkpoint_sections = config.getoption('doctest_plus_checkpoint') == 'sections'
+
+            for entry in entries:
+
+                if isinstance(entry, TextChunk) and not entry.empty:
+                    required = []
+                    required_all = []
+                    skip_next = False
+                    remote_data_next = False
+                    lines = entry.directive_lines
+
+                    checkpoint_next = (
+                        checkpoint_sections and entry.section
+                        or any(re.match(fr'{comment_char}\s+doctest-checkpoint\s*::', x.strip())
+                               for x in lines))
+
+                    requires_all_match = [re.match(
+                        fr'{comment_char}\s+doctest-requires-all\s*::\s+(.*)', x) for x in lines]
+                    if any(requires_all_match):
+                        required_all = [re.split(r'\s*[,\s]\s*', match.group(1))
+                                        for match in requires_all_match if match][0]
+                    required_modules_all = DocTestFinderPlus.check_required_modules(required_all)
+                    if not required_modules_all:
+                        skip_all = True
+                        skip_all_reason = 'requirement'
+                        continue
+
+                    if any(re.match(fr'{comment_char}\s+doctest-remote-data-all\s*::', x.strip())
+                           for x in lines):
+                        if not run_remote_data:
+                            skip_all = True
+                            skip_all_reason = 'remote data'
+                            continue
+                        # Flagged, for the cassettes
+                        remote_data_all = True
+
+                    if any(re.match(f'{comment_char} doctest-skip-all', x.strip()) for x in lines):
+                        skip_all = True
+                        skip_all_reason = 'directive'
+                        continue
+
+                    if entry.blank:
+                        continue
+
+                    # We allow last and second to last lines to match to allow
+                    # special environment to be in between, e.g. \begin{python}
+                    last_lines = entry.last_lines
+                    matches = [re.match(
+                        fr'{comment_char}\s+doctest-skip\s*::(\s+.*)?',
+                        last_line) for last_line in last_lines]
+
+                    if len(matches) > 1:
+                        match = matches[0] or matches[1]
+                    else:
+                        match = matches[0]
+
+                    if match:
+                        marker = match.group(1)
+                        if (marker is None or
+                                (marker.strip() == 'win32' and
+                                 sys.platform == 'win32')):
+                            skip_next = True
+                            skip_next_reason = 'directive'
+                            continue
+
+                    matches = (re.match(
+                        fr'{comment_char}\s+doctest-remote-data\s*::',
+                        last_line) for last_line in last_lines)
+
+                    if any(matches):
+                        if not run_remote_data:
+                            skip_next = True
+                            skip_next_reason = 'remote data'
+                            continue
+                        # Flagged, for the cassettes
+                        remote_data_next = True
+
+                    matches = [re.match(
+                        fr'{comment_char}\s+doctest-requires\s*::\s+(.*)',
+                        last_line) for last_line in last_lines]
+
+                    if len(matches) > 1:
+                        match = matches[0] or matches[1]
+                    else:
+                        match = matches[0]
+
+                    if match:
+                        # 'a a' or 'a,a' or 'a, a'-> [a, a]
+                        required = re.split(r'\s*[,\s]\s*', match.group(1))
+                elif isinstance(entry, doctest.Example):
+
+                    if checkpoint_next:
+                        entry.options[CHECKPOINT] = True
+                        checkpoint_next = False
+
+                    if remote_data_next or remote_data_all:
+                        entry.options[REMOTE_DATA] = True
+
+                    has_required_modules = DocTestFinderPlus.check_required_modules(required)
+                    if skip_all or skip_next or not has_required_modules:
+                        entry.options[doctest.SKIP] = True
+                        entry._doctestplus_skip_reason = (
+                            skip_all_reason if skip_all
+                            else skip_next_reason if skip_next else 'requirement')
+
+                    elif not run_remote_data and entry.options.get(REMOTE_DATA):
+                        entry.options[doctest.SKIP] = True
+                        entry._doctestplus_skip_reason = 'remote data'
+
+                    # If warnings are to be ignored we need to catch them by
+                    # wrapping the source in a context manager, which is
+                    # defined before the first example that needs it.
+                    elif entry.options.get(IGNORE_WARNINGS, False):
+                        entry.source = ("with _doctestplus_ignore_all_warnings():\n"
+                                        + indent(entry.source, '    '))
+                        if not ignore_warnings_context_defined:
+                            yield _helper_example(IGNORE_WARNINGS_CONTEXT)
+                            ignore_warnings_context_defined = True
+
+                    # Same to show warnings
+                    elif entry.options.get(SHOW_WARNINGS, False):
+                        entry.source = ("with _doctestplus_show_all_warnings():\n"
+                                        + indent(entry.source, '    '))
+                        if not show_warnings_context_defined:
+                            yield _helper_example(SHOW_WARNINGS_CONTEXT)
+                            show_warnings_context_defined = True
+
+                    yield entry
+
+    config.pluginmanager.register(
+        DoctestPlus(
+            DocTestModulePlus,
+            DocTestTextfilePlus,
+            config.option.doctestglob,
+            previous_exec,
+        ),
+        'doctestplus',
+    )
+    # Remove the doctest_plugin, or we'll end up testing the .rst files twice.
+    config.pluginmanager.unregister(doctest_plugin)
+
+
+class DoctestPlus:
+    def __init__(self, doctest_module_item_cls, doctest_textfile_item_cls, file_globs,
+                 previous_exec=None):
+        """
+        doctest_module_item_cls should be a class inheriting
+        `pytest.doctest.DoctestItem` and `pytest.File`.  This class handles
+        running of a single doctest found in a Python module.  This is passed
+        in as an argument because the actual class to be used may not be
+        available at import time, depending on whether or not the doctest
+        plugin for py.test is available.
+
+        previous_exec is the ``exec`` of `doctest` before `configure`
+        replaced it, if something else had already replaced it (e.g. the
+        doctestplus of an outer pytest session, in tests using pytester).
+        """
+        self._doctest_module_item_cls = doctest_module_item_cls
+        self._doctest_textfile_item_cls = doctest_textfile_item_cls
+        self._file_globs = file_globs
+        self._previous_exec = previous_exec
+        # Directories to ignore when adding doctests
+        self._ignore_paths = []
+        # The durations of the tests run in this session, by node id
+        self._durations = {}
+        # The node ids of the tests collected in this session, here or by the
+        # pytest-xdist workers, and whether only some of the tests of their
+        # files were selected (by node ids, ``-k``, etc.)
+        self._collected = set()
+        self._selected = False
+        # The failed examples of the tests run in this session, by node id,
+        # with `None` for the tests that passed
+        self._failed_examples = {}
+        # The records of the doctests for ``--doctest-plus-report``
+        self._report = DoctestReport()
+
+    if PYTEST_GE_8_0:
+
+        def pytest_ignore_collect(self, collection_path, config):
+            """
+            Skip paths that match any of the doctest_norecursedirs patterns or
+            if doctest_only is True then skip all regular test files (eg test_*.py).
+            """
+            from _pytest.pathlib import fnmatch_ex
+
+            collect_ignore = config._getconftest_pathlist("collect_ignore",
+                                                          path=collection_path.parent)
+
+            # The collect_ignore conftest.py variable should cause all test
+            # runners to ignore this file and all subfiles and subdirectories
+            if collect_ignore is not None and collection_path in collect_ignore:
+                return True
+
+            if config.option.doctest_only:
+                for pattern in config.getini('python_files'):
+                    if fnmatch_ex(pattern, collection_path):
+                        return True
+
+            def get_list_opt(name):
+                return getattr(config.option, name, None) or []
+
+            for ignore_path in get_list_opt('ignore'):
+                ignore_path = os.path.abspath(ignore_path)
+                if str(collection_path).startswith(ignore_path):
+                    return True
+
+            for pattern in get_list_opt('ignore_glob'):
+                if fnmatch_ex(pattern, collection_path):
+                    return True
+
+            for pattern in config.getini("doctest_norecursedirs"):
+                if fnmatch_ex(pattern, collection_path):
+                    # Apparently pytest_ignore_collect causes files not to be
+                    # collected by any test runner; for DoctestPlus we only want to
+                    # avoid creating doctest nodes for them
+                    self._ignore_paths.append(collection_path)
+                    break
+
+            for option in config.getini("doctest_subpackage_requires"):
+                subpackage_pattern, required = option.split('=', 1)
+                if fnmatch_ex(subpackage_pattern.strip(), collection_path):
+                    required = required.strip().split(';')
+                    if not DocTestFinderPlus.check_required_modules(required):
+                        self._ignore_paths.append(collection_path)
+                        break
+
+            # Let other plugins decide the outcome.
+            return None
+
+        def pytest_collect_file(self, file_path, parent):
+            """Implements an enhanced version of the doctest module from py.test
+            (specifically, as enabled by the --doctest-modules option) which
+            supports skipping all doctests in a specific docstring by way of a
+            special ``__doctest_skip__`` module-level variable.  It can also skip
+            tests that have special requirements by way of
+            ``__doctest_requires__``.
+
+            ``__doctest_skip__`` should be a list of functions, classes, or class
+            methods whose docstrings should be ignored when collecting doctests.
+
+            This also supports wildcard patterns.  For example, to run doctests in
+            a class's docstring, but skip all doctests in its modules use, at the
+            module level::
+
+                __doctest_skip__ = ['ClassName.*']
+
+            You may also use the string ``'.'`` in ``__doctest_skip__`` to refer
+            to the module itself, in case its module-level docstring contains
+            doctests.
+
+            ``__doctest_requires__`` should be a dictionary mapping wildcard
+            patterns (in the same format as ``__doctest_skip__``) to a list of one
+            or more modules that should be *importable* in order for the tests to
+            run.  For example, if some tests require the scipy module to work they
+            will be skipped unless ``import scipy`` is possible.  It is also
+            possible to use a tuple of wildcard patterns as a key in this dict::
+
+                __doctest_requires__ = {('func1', 'func2'): ['scipy']}
+
+            """
+            from _pytest.pathlib import commonpath, fnmatch_ex
+
+            for ignore_path in self._ignore_paths:
+                if commonpath(ignore_path, file_path) == ignore_path:
+                    return None
+
+            if file_path.suffix == '.py':
+                if file_path.name == 'conf.py':
+                    return None
+
+                # Don't override the built-in doctest plugin
+                return self._doctest_module_item_cls.from_parent(parent, path=file_path)
+
+            elif any([fnmatch_ex(pat, file_path) for pat in self._file_globs]):
+                # Ignore generated .rst files
+                parts = str(file_path).split(os.path.sep)
+
+                # Don't test files that start with a _
+                if file_path.name.startswith('_'):
+                    return None
+
+                # Don't test files in directories that start with a '_' if those
+                # directories are inside docs. Note that we *should* allow for
+                # example /tmp/_q/docs/file.rst but not /tmp/docs/_build/file.rst
+                # If we don't find 'docs' in the path, we should just skip this
+                # check to be safe. We also want to skip any api sub-directory
+                # of docs.
+                if 'docs' in parts:
+                    # We index from the end on the off chance that the temporary
+                    # directory includes 'docs' in the path, e.g.
+                    # /tmp/docs/371j/docs/index.rst You laugh, but who knows! :)
+                    # Also, it turns out lists don't have an rindex method. Huh??!!
+                    docs_index = len(parts) - 1 - parts[::-1].index('docs')
+                    if any(x.startswith('_') or x == 'api' for x in parts[docs_index:]):
+                        return None
+
+                # TODO: Get better names on these items when they are
+                # displayed in py.test output
+                return self._doctest_textfile_item_cls.from_parent(parent, path=file_path)
+
+    else:  # PYTEST_LT_8
+
+        def pytest_ignore_collect(self, path, config):
+            """
+            Skip paths that match any of the doctest_norecursedirs patterns or
+            if doctest_only is True then skip all regular test files (eg test_*.py).
+            """
+            dirpath = Path(path).parent
+            collect_ignore = config._getconftest_pathlist("collect_ignore",
+                                                          path=dirpath,
+                                                          rootpath=config.rootpath)
+
+            # The collect_ignore conftest.py variable should cause all test
+            # runners to ignore this file and all subfiles and subdirectories
+            if collect_ignore is not None and path in collect_ignore:
+                return True
+
+            if config.option.doctest_only:
+                for pattern in config.getini('python_files'):
+                    if path.check(fnmatch=pattern):
+                        return True
+
+            def get_list_opt(name):
+                return getattr(config.option, name, None) or []
+
+            for ignore_path in get_list_opt('ignore'):
+                ignore_path = os.path.abspath(ignore_path)
+                if str(path).startswith(ignore_path):
+                    return True
+
+            for pattern in get_list_opt('ignore_glob'):
+                if path.check(fnmatch=pattern):
+                    return True
+
+            for pattern in config.getini("doctest_norecursedirs"):
+                if path.check(fnmatch=pattern):
+                    # Apparently pytest_ignore_collect causes files not to be
+                    # collected by any test runner; for DoctestPlus we only want to
+                    # avoid creating doctest nodes for them
+                    self._ignore_paths.append(path)
+                    break
+
+            for option in config.getini("doctest_subpackage_requires"):
+                subpackage_pattern, required = option.split('=', 1)
+                if path.check(fnmatch=subpackage_pattern.strip()):
+                    required = required.strip().split(';')
+                    if not DocTestFinderPlus.check_required_modules(required):
+                        self._ignore_paths.append(path)
+                        break
+
+            # Let other plugins decide the outcome.
+            return None
+
+        def pytest_collect_file(self, path, parent):
+            """Implements an enhanced version of the doctest module from py.test
+            (specifically, as enabled by the --doctest-modules option) which
+            supports skipping all doctests in a specific docstring by way of a
+            special ``__doctest_skip__`` module-level variable.  It can also skip
+            tests that have special requirements by way of
+            ``__doctest_requires__``.
+
+            ``__doctest_skip__`` should be a list of functions, classes, or class
+            methods whose docstrings should be ignored when collecting doctests.
+
+            This also supports wildcard patterns.  For example, to run doctests in
+            a class's docstring, but skip all doctests in its modules use, at the
+            module level::
+
+                __doctest_skip__ = ['ClassName.*']
+
+            You may also use the string ``'.'`` in ``__doctest_skip__`` to refer
+            to the module itself, in case its module-level docstring contains
+            doctests.
+
+            ``__doctest_requires__`` should be a dictionary mapping wildcard
+            patterns (in the same format as ``__doctest_skip__``) to a list of one
+            or more modules that should be *importable* in order for the tests to
+            run.  For example, if some tests require the scipy module to work they
+            will be skipped unless ``import scipy`` is possible.  It is also
+            possible to use a tuple of wildcard patterns as a key in this dict::
+
+                __doctest_requires__ = {('func1', 'func2'): ['scipy']}
+
+            """
+            for ignore_path in self._ignore_paths:
+                if ignore_path.common(path) == ignore_path:
+                    return None
+
+            if path.ext == '.py':
+                if path.basename == 'conf.py':
+                    return None
+
+                # Don't override the built-in doctest plugin
+                return self._doctest_module_item_cls.from_parent(parent, path=Path(path))
+
+            elif any([path.check(fnmatch=pat) for pat in self._file_globs]):
+                # Ignore generated .rst files
+                parts = str(path).split(os.path.sep)
+
+                # Don't test files that start with a _
+                if path.basename.startswith('_'):
+                    return None
+
+                # Don't test files in directories that start with a '_' if those
+                # directories are inside docs. Note that we *should* allow for
+                # example /tmp/_q/docs/file.rst but not /tmp/docs/_build/file.rst
+                # If we don't find 'docs' in the path, we should just skip this
+                # check to be safe. We also want to skip any api sub-directory
+                # of docs.
+                if 'docs' in parts:
+                    # We index from the end on the off chance that the temporary
+                    # directory includes 'docs' in the path, e.g.
+                    # /tmp/docs/371j/docs/index.rst You laugh, but who knows! :)
+                    # Also, it turns out lists don't have an rindex method. Huh??!!
+                    docs_index = len(parts) - 1 - parts[::-1].index('docs')
+                    if any(x.startswith('_') or x == 'api' for x in parts[docs_index:]):
+                        return None
+
+                # TODO: Get better names on these items when they are
+                # displayed in py.test output
+                return self._doctest_textfile_item_cls.from_parent(parent, path=Path(path))
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_xdist_make_scheduler(self, config, log):
+        if config.getoption("doctest_plus_schedule") and config.getvalue("dist") == "load":
+            from .scheduler import DurationScheduling
+            return DurationScheduling(config, log)
+        return None
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_xdist_node_collection_finished(self, node, ids):
+        self._collected.update(ids)
+
+    def pytest_collection_modifyitems(self, session, config, items):
+        self._collected.update(item.nodeid for item in items)
+        self._selected = self._selected or any("::" in arg for arg in config.args)
+        if config.getoption("doctest_plus_report"):
+            for item in items:
+                if hasattr(item, "dtest"):
+                    self._report.collect(doctest_record(item))
+
+        # See `DebugRunnerPlus.run` for the use of the attributes set here
+        cache = getattr(config, "cache", None)
+        if config.getoption("doctest_plus_checkpoint") and cache is not None:
+            directory = cache.mkdir(CHECKPOINTS_DIR)
+            for item in items:
+                if hasattr(item, "dtest"):
+                    name = hashlib.sha1(item.nodeid.encode("utf-8")).hexdigest()
+                    item.dtest._doctestplus_checkpoints = CheckpointStore(directory / name)
+
+        if config.getoption("doctest_plus_failed_first"):
+            failed = load_cache(config, FAILED_EXAMPLES_KEY)
+            for item in items:
+                if item.nodeid in failed and hasattr(item, "dtest"):
+                    item.dtest._doctestplus_failed_examples = failed[item.nodeid]
+            items.sort(key=lambda item: item.nodeid not in failed)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        # The HTTP(S) traffic of the doctests that use remote data is recorded
+        # in, or replayed from, a cassette.
+        if not uses_cassette(item):
+            yield
+            return
+
+        mode = item.config.getoption("doctest_plus_cassette")
+        directory = os.path.join(item.config.rootpath,
+                                 item.config.getini("doctest_plus_cassette_dir"))
+        cassette = Cassette(cassette_path(directory, item.nodeid), mode)
+        with cassette:
+            yield
+        if mode == "record":
+            cassette.save()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        if hasattr(item, "dtest") and item.config.getoption("doctest_plus_report"):
+            # Like the failed examples below, these are sent back by the
+            # pytest-xdist workers with the reports.
+            if call.when == "setup":
+                report.doctestplus_record = doctest_record(item)
+            if report.skipped and isinstance(report.longrepr, tuple):
+                report.doctestplus_skip_reason = skip_reason(item.dtest, report.longrepr[2])
+        if call.when == "call" and hasattr(item, "dtest") and not report.skipped:
+            failures = []
+            if call.excinfo is not None:
+                exception = call.excinfo.value
+                failures = getattr(exception, "failures", [exception])
+            # This is sent back by the pytest-xdist workers with the report
+            report.doctestplus_failed_examples = [
+                example_key(failure.example) for failure in failures
+                if isinstance(failure, (doctest.DocTestFailure, doctest.UnexpectedException))]
+
+    def pytest_deselected(self, items):
+        self._selected = True
+        for item in items:
+            self._report.deselect(item.nodeid)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        workeroutput = getattr(node, "workeroutput", {})
+        self._selected = self._selected or workeroutput.get("doctestplus_selected", False)
+        # The records of the doctests collected by the workers, including
+        # those that did not run
+        for record in workeroutput.get("doctestplus_records", []):
+            self._report.collect(record)
+            if record["outcome"] == "deselected":
+                self._report.deselect(record["nodeid"])
+
+    def pytest_runtest_logreport(self, report):
+        self._durations[report.nodeid] = (self._durations.get(report.nodeid, 0)
+                                          + report.duration)
+        failed_examples = getattr(report, "doctestplus_failed_examples", None)
+        if failed_examples is not None:
+            self._failed_examples[report.nodeid] = failed_examples or None
+        self._report.add(report)
+
+    def pytest_sessionfinish(self, session):
+        # The controller records what the pytest-xdist workers report
+        workeroutput = getattr(session.config, "workeroutput", None)
+        if workeroutput is not None:
+            workeroutput["doctestplus_selected"] = self._selected
+        if workeroutput is not None and session.config.getoption("doctest_plus_report"):
+            workeroutput["doctestplus_records"] = [
+                {**record, "duration": 0.0, "skip_reason": None,
+                 "outcome": "deselected" if record["outcome"] == "deselected" else None}
+                for record in self._report.records.values()]
+        if not hasattr(session.config, "workerinput"):
+            stale = stale_nodeids(load_durations(session.config), self._collected,
+                                  session.config.rootpath, self._selected)
+            update_cache(session.config, DURATIONS_KEY,
+                         {**dict.fromkeys(stale), **self._durations})
+            update_cache(session.config, FAILED_EXAMPLES_KEY, self._failed_examples)
+            path = session.config.getoption("doctest_plus_report")
+            if path:
+                self._report.write(path)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_configure_node(self, node):
+        # Let the pytest-xdist workers spool their changes where the controller
+        # will pick them up.
+        if DebugRunnerPlus._spool is not None:
+            node.workerinput["doctestplus_spool_dir"] = DebugRunnerPlus._spool.directory
+
+    def pytest_unconfigure(self, config):
+        DocTestFinderPlus._requirement_hook = None
+        if self._previous_exec is None:
+            vars(doctest).pop("exec", None)
+        else:
+            doctest.exec = self._previous_exec
+        spool = DebugRunnerPlus._spool
+        if spool is None:
+            return
+        DebugRunnerPlus._spool = None
+        DebugRunnerPlus._generate_diff = None
+        spool.close()
+        if not hasattr(config, "workerinput"):
+            shutil.rmtree(spool.directory, ignore_errors=True)
+
+    def pytest_terminal_summary(self, terminalreporter, exitstatus, config):
+        if config.getoption("verbose") > 0:
+            _report_checker_cache(terminalreporter)
+
+        spool = DebugRunnerPlus._spool
+        diff_mode = config.getoption("doctest_plus_generate_diff", False)
+        all_bad_tests = []
+        modified_files = []
+        if not diff_mode or spool is None or hasattr(config, "workerinput"):
+            return  # we do not report or apply diffs
+
+        encoding = config.getini("doctest_encoding")
+        changesets = spool.changesets()
+
+        if diff_mode != "overwrite":
+            # In this mode, we only render the diffs of the corrected files
+            # (rather than modifying the files).
+            terminalreporter.section("Reporting DoctestPlus Diffs")
+
+            for fname, diff, bad_tests in process_changesets(changesets, encoding):
+                all_bad_tests.extend(bad_tests)
+                modified_files.append(fname)
+                terminalreporter.write(diff)
+
+            if not modified_files:
+                terminalreporter.write_line("No doc changes to show")
+                return
+
+            terminalreporter.section("Files with modifications", "-")
+            terminalreporter.write_line(
+                "The following files would be overwritten with "
+                "`--doctest-plus-generate-diff=overwrite`:")
+            for fname in modified_files:
+                terminalreporter.write_line(f"    {fname}")
+            terminalreporter.write_line(
+                "make sure these file paths are correct before calling it!")
+        else:
+            # We are in overwrite mode so will write the modified version directly
+            # back into the same file and only report which files were changed.
+            terminalreporter.section("DoctestPlus Fixing File Docs")
+            for fname, _, bad_tests in process_changesets(changesets, encoding,
+                                                          overwrite=True):
+                if not modified_files:
+                    terminalreporter.write_line("Applied fix to the following files:")
+                all_bad_tests.extend(bad_tests)
+                modified_files.append(fname)
+                terminalreporter.write_line(f"    {fname}")
+
+            if not modified_files:
+                terminalreporter.write_line("No doc changes to apply")
+                return
+
+        if all_bad_tests:
+            terminalreporter.section("Broken Linenumbers", "-")
+            terminalreporter.write_line(
+                "Doctestplus was unable to fix the following tests "
+                "(their source is hidden or `__module__` overridden?)")
+            for bad_test in all_bad_tests:
+                terminalreporter.write_line(f"    {bad_test}")
+            terminalreporter.write_line(
+                "You can implementing a hook function to fix this (see README).")
+
+
+def _report_checker_cache(terminalreporter):
+    hits, misses, maxsize, currsize = OutputChecker.cache_info()
+    if hits + misses:
+        terminalreporter.write_line(
+            f"doctestplus output checker cache: {hits} hits, {misses} misses "
+            f"({hits / (hits + misses):.1%} hit rate), {currsize}/{maxsize} entries")
+
+
+# The key of the pytest cache holding the durations of the tests, in seconds
+DURATIONS_KEY = "doctestplus/durations"
+
+
+def load_cache(config, key):
+    """Return the mapping stored under the given key of the pytest cache."""
+    cache = getattr(config, "cache", None)
+    if cache is None:
+        return {}
+    return cache.get(key, {})
+
+
+def update_cache(config, key, values):
+    """
+    Update the mapping stored under the given key of the pytest cache with the
+    given values, where `None` values remove the corresponding entries.
+    """
+    cache = getattr(config, "cache", None)
+    if cache is None or not values:
+        return
+    recorded = cache.get(key, {})
+    for name, value in values.items():
+        if value is None:
+            recorded.pop(name, None)
+        else:
+            recorded[name] = value
+    cache.set(key, recorded)
+
+
+def stale_nodeids(recorded, collected, rootpath, selected=False):
+    """
+    Return the recorded node ids of the tests that no longer exist: those of
+    the files whose tests were collected, but not these node ids, and those of
+    the files that were deleted.  When only some of the tests were
+    ``selected`` (by node ids, ``-k``, etc.), only those of the deleted files.
+    """
+    collected_files = set()
+    if not selected:
+        collected_files = {nodeid.split("::", 1)[0] for nodeid in collected}
+    stale = []
+    for nodeid in recorded:
+        path = nodeid.split("::", 1)[0]
+        if path in collected_files:
+            if nodeid not in collected:
+                stale.append(nodeid)
+        elif not os.path.exists(os.path.join(rootpath, path)):
+            stale.append(nodeid)
+    return stale
+
+
+def load_durations(config):
+    """Return the durations of the tests recorded in the pytest cache."""
+    return load_cache(config, DURATIONS_KEY)
+
+
+class DocTestFinderPlus(doctest.DocTestFinder):
+    """Extension to the default `doctest.DoctestFinder` that supports
+    ``__doctest_skip__`` magic.  See `pytest_collect_file` for more details.
+    """
+
+    # Caches the results of import attempts
+    _import_cache = {}
+    _module_checker = ModuleChecker()
+    # The `pytest_doctestplus_requirement` hook, while doctestplus is enabled
+    _requirement_hook = None
+
+    def __init__(self, *args, doctest_ufunc=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._doctest_ufunc = doctest_ufunc
+
+    @classmethod
+    def check_required_modules(cls, mods):
+        """Check that modules in `mods` list are available.
+
+        Parameters
+        ----------
+        mods : list of str
+            List of modules. Modules can have specified versions (eg 'numpy>=1.15')
+
+        Returns
+        -------
+        bool
+            True if all modules in list are available.
+        """
+        for mod in mods:
+            if mod in cls._import_cache:
+                if not cls._import_cache[mod]:
+                    return False
+                continue
+
+            if cls._requirement_hook is None:
+                available = cls._module_checker.check(mod)
+            else:
+                with _timed(cls._requirement_hook, requirement=mod) as info:
+                    available = info["available"] = cls._module_checker.check(mod)
+            cls._import_cache[mod] = available
+            if not available:
+                return False
+        return True
+
+    def find(self, obj, name=None, module=None, globs=None, extraglobs=None):
+        tests = doctest.DocTestFinder.find(self, obj, name, module, globs, extraglobs)
+
+        if name is None and hasattr(obj, '__name__'):
+            name = obj.__name__
+        else:
+            raise ValueError(
+                "DocTestFinder.find: name must be given when obj.__name__ doesn't exist: "
+                f"{type(obj)!r}"
+            )
+
+        if self._doctest_ufunc:
+            for ufunc_name, ufunc_method in obj.__dict__.items():
+                if _is_numpy_ufunc(ufunc_method):
+                    tests += doctest.DocTestFinder.find(
+                        self, ufunc_method, f'{name}.{ufunc_name}',
+                        module=obj, globs=globs, extraglobs=extraglobs)
+
+        if hasattr(obj, '__doctest_skip__') or hasattr(obj, '__doctest_requires__'):
+
+            def conditionally_insert_skip(test):
+                """
+                Insert skip statement if `test` matches `__doctest_(skip|requires)__`.
+                """
+                for pat in getattr(obj, '__doctest_skip__', []):
+                    if pat == '*':
+                        self._prepend_skip(test)
+                    elif pat == '.' and test.name == name:
+                        self._prepend_skip(test)
+                    elif fnmatch.fnmatch(test.name, '.'.join((name, pat))):
+                        self._prepend_skip(test)
+
+                reqs = getattr(obj, '__doctest_requires__', {})
+                for pats, mods in reqs.items():
+                    if not isinstance(pats, tuple):
+                        pats = (pats,)
+
+                    for pat in pats:
+                        if pat == '*':
+                            pass
+                        elif pat == '.' and test.name == name:
+                            pass
+                        elif fnmatch.fnmatch(test.name, '.'.join((name, pat))):
+                            pass
+                        else:
+                            continue  # The pattern does not apply
+
+                        for mod in mods:
+                            self._prepend_module_check(test, module=mod)
+                return True
+
+            for _test in tests:
+                conditionally_insert_skip(_test)
+
+        return tests
+
+    def _prepend_skip(self, test):
+        """Prepends `pytest.skip` before the doctest."""
+        source = (
+            "import pytest; "
+            "pytest.skip('listed in `__doctest_skip__`'); "
+            # Don't impact what's available in the namespace
+            "del pytest"
+        )
+        test.examples.insert(0, _helper_example(source))
+
+    def _prepend_module_check(self, test, *, module):
+        """Prepends module checker before the doctest."""
+        escaped_module = module.replace("'", "\\'")
+        source = (
+            "from pytest_doctestplus.utils import ModuleChecker; "
+            "import pytest; "
+            # Hide output of this statement in `___`, otherwise doctests fail
+            f"___ = ModuleChecker().check('{escaped_module}') or "
+            f"pytest.skip('could not import {escaped_module}'); "
+            # Don't impact what's available in the namespace
+            "del ModuleChecker, pytest, ___"
+        )
+        test.examples.insert(0, _helper_example(source))
+
+
+def write_modified_file(fname, new_fname, changes, encoding=None):
+    _, text = read_lines(fname, encoding)
+    text, _, bad_tests = apply_changes(text, changes)
+
+    if new_fname == fname:
+        atomic_write(fname, "".join(text), encoding)
+    else:
+        with open(new_fname, "w", encoding=encoding) as f:
+            f.write("".join(text))
+
+    return bad_tests
+
+
+# The event loop of the doctest run by each thread, once one of its examples
+# used top-level ``await``, and the event loop of the thread before it
+_event_loops = threading.local()
+
+
+def _thread_event_loop():
+    # The event loop set for the current thread, if any, without creating one
+    # like `asyncio.get_event_loop`
+    import asyncio
+    with warnings.catch_warnings():
+        # The event loop policies are deprecated since Python 3.14
+        warnings.simplefilter("ignore", DeprecationWarning)
+        policy = asyncio.get_event_loop_policy()
+    return getattr(getattr(policy, "_local", None), "_loop", None)  # Private API
+
+
+def exec_example(code, globs=None, locals=None):
+    """
+    Execute the code of an example like `exec`, or if it uses top-level
+    ``await``, run it on the event loop shared by the examples of the doctest.
+    """
+    if not code.co_flags & inspect.CO_COROUTINE:
+        return exec(code, globs, locals)
+    import asyncio
+    loop = getattr(_event_loops, "loop", None)
+    if loop is None:
+        _event_loops.previous = _thread_event_loop()
+        loop = _event_loops.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    loop.run_until_complete(eval(code, globs, locals))
+
+
+def hide_exec_example(traceback):
+    """
+    Remove the frames of `exec_example` from the traceback of an example,
+    which would otherwise be in the tracebacks of the unexpected exceptions,
+    and return it.
+    """
+    head = previous = None
+    while traceback is not None:
+        if traceback.tb_frame.f_code is not exec_example.__code__:
+            if previous is None:
+                head = traceback
+            else:
+                previous.tb_next = traceback
+            previous = traceback
+        traceback = traceback.tb_next
+    if previous is not None:
+        previous.tb_next = None
+    return head
+
+
+def close_event_loop():
+    """
+    Cancel the remaining tasks of the event loop of the doctest, close it,
+    and set the previous event loop of the thread again.
+    """
+    loop = getattr(_event_loops, "loop", None)
+    if loop is None:
+        return
+    import asyncio
+    _event_loops.loop = None
+    try:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            # Without tasks, `asyncio.gather` would need the current event
+            # loop, which an example may have unset (e.g. with `asyncio.run`)
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+    finally:
+        asyncio.set_event_loop(_event_loops.previous)
+        _event_loops.previous = None
+        loop.close()
+
+
+def uses_cassette(item):
+    """
+    Return whether the HTTP(S) traffic of a test is recorded in, or replayed
+    from, a cassette, with ``--doctest-plus-cassette``.
+    """
+    dtest = getattr(item, "dtest", None)
+    return bool(item.config.getoption("doctest_plus_cassette")) and dtest is not None and any(
+        example.options.get(REMOTE_DATA) and not example.options.get(doctest.SKIP)
+        for example in dtest.examples)
+
+
+class DebugRunnerPlus(doctest.DebugRunner):
+    _spool = None
+    _generate_diff = False
+    # Called with the test and the example before running each example, in
+    # the processes of --doctest-plus-fork
+    _example_started = None
+
+    def __init__(self, checker=None, verbose=None, optionflags=0,
+                 continue_on_failure=True, generate_diff=False, example_hook=None):
+        # generated_diff is False, "diff", or "overwrite" (only need truthiness)
+        DebugRunnerPlus._generate_diff = generate_diff
+
+        super().__init__(checker=checker, verbose=verbose, optionflags=optionflags)
+        self.continue_on_failure = continue_on_failure
+        # The `pytest_doctestplus_example` hook, whether it is implemented,
+        # and the start times of the current example
+        self._example_hook = example_hook
+        self._time_examples = False
+        self._example_start = None
+
+    def run(self, test, compileflags=None, out=None, clear_globs=True):
+        # The examples may use top-level ``await``, and run on an event loop
+        # shared by all the examples of the test
+        if compileflags is None:
+            compileflags = doctest._extract_future_flags(test.globs)
+        compileflags |= ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+        try:
+            return self._run_test(test, compileflags, out, clear_globs)
+        finally:
+            close_event_loop()
+
+    def _run_test(self, test, compileflags, out, clear_globs):
+        # Whether the hook is implemented is only checked once per test
+        self._time_examples = (self._example_hook is not None
+                               and bool(self._example_hook.get_hookimpls()))
+
+        # With --doctest-plus-failed-first, the examples that failed in the
+        # previous run are first replayed, with only the examples they depend
+        # on, in a copy of the globals.  The whole test is only run if they
+        # now pass.  As the replay may change the objects of the globals (or
+        # of the modules), it first runs in a child process, and only runs
+        # again here, instead of the whole test, if it still fails.
+        failed_examples = getattr(test, "_doctestplus_failed_examples", None)
+        if failed_examples and isinstance(out, list) and not self._generate_diff:
+            test._doctestplus_failed_examples = None
+            examples = replay_examples(test.examples, failed_examples)
+            if (examples is not None and len(examples) < len(test.examples)
+                    and self._replay_fails(test, examples, compileflags)):
+                replay = copy.copy(test)
+                replay.examples = examples
+                replay.globs = test.globs.copy()
+                replay_out = []
+                results = super().run(replay, compileflags, replay_out, clear_globs)
+                if replay_out:
+                    out.extend(replay_out)
+                    if clear_globs:
+                        test.globs.clear()
+                    return results
+
+        # With --doctest-plus-checkpoint, the namespace is saved before the
+        # examples marked with CHECKPOINT, and the test resumes from the
+        # latest checkpoint whose previous examples did not change.
+        checkpoints = getattr(test, "_doctestplus_checkpoints", None)
+        if checkpoints is not None and isinstance(out, list) and not self._generate_diff:
+            indices = [i for i, example in enumerate(test.examples)
+                       if example.options.get(CHECKPOINT)]
+            if indices:
+                results = self._run_checkpoints(test, checkpoints, indices, compileflags, out)
+                if clear_globs:
+                    test.globs.clear()
+                return results
+        return super().run(test, compileflags, out, clear_globs)
+
+    def _replay_fails(self, test, examples, compileflags):
+        # Whether the examples of the replay still fail, when they run in a
+        # child process forked from this one.  Without `os.fork`, or in the
+        # threads of --doctest-plus-threads, the whole test runs instead.
+        if not hasattr(os, "fork") or threading.current_thread() is not threading.main_thread():
+            return False
+        replay = copy.copy(test)
+        replay.examples = examples
+        replay.globs = test.globs.copy()
+        result_read, result_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(result_read)
+            failed = True
+            try:
+                # The examples of the child are not reported
+                DebugRunnerPlus._example_started = None
+                self._time_examples = False
+                replay_out = []
+                doctest.DebugRunner.run(self, replay, compileflags, replay_out)
+                failed = bool(replay_out)
+            finally:
+                os.write(result_write, b"1" if failed else b"0")
+                os._exit(0)
+        os.close(result_write)
+        with open(result_read, "rb") as f:
+            result = f.read()
+        os.waitpid(pid, 0)
+        return result != b"0"
+
+    def _run_checkpoints(self, test, checkpoints, indices, compileflags, out):
+        examples = test.examples
+        digests = examples_digests(examples)
+        parts = []
+        start = 0
+        restored = checkpoints.restore(indices, digests)
+        if restored is not None:
+            start, values, missing = restored
+            # The values that could not be saved are defined again by
+            # replaying the examples that define them, if they are needed.
+            used = set()
+            for example in examples[start:]:
+                names = example_names(example.source)
+                if names is None:
+                    used = set(missing)
+                    break
+                used |= names[1]
+            parts.append((None, [examples[i] for i in
+                                 dependencies(examples[:start], names=used & set(missing))]))
+            parts.append((None, values))
+        bounds = [start] + [i for i in indices if i > start] + [len(examples)]
+        parts.extend((begin, examples[begin:end]) for begin, end in zip(bounds, bounds[1:]))
+
+        failed = attempted = 0
+        for begin, part in parts:
+            if isinstance(part, dict):
+                test.globs.update(part)
+                continue
+            if begin is not None and begin > start and not failed:
+                checkpoints.save(begin, digests[begin], test.globs)
+            part_test = copy.copy(test)
+            part_test.examples = part
+            results = super().run(part_test, compileflags, out, clear_globs=False)
+            failed += results.failed
+            attempted += results.attempted
+        return doctest.TestResults(failed, attempted)
+
+    def report_start(self, out, test, example):
+        if DebugRunnerPlus._example_started is not None:
+            DebugRunnerPlus._example_started(test, example)
+        if self._time_examples:
+            self._example_start = (time.time(), time.perf_counter(), time.process_time())
+        return super().report_start(out, test, example)
+
+    def _report_example(self, test, example, outcome):
+        if self._example_start is None:
+            return
+        start, wall, cpu = self._example_start
+        self._example_start = None
+        self._example_hook(info=dict(
+            name=test.name, filename=test.filename, test_lineno=test.lineno,
+            example_lineno=example.lineno, source=example.source, want=example.want,
+            outcome=outcome, start=start, wall=time.perf_counter() - wall,
+            cpu=time.process_time() - cpu))
+
+    def report_success(self, out, test, example, got):
+        self._report_example(test, example, "passed")
+        if self._generate_diff:
+            self.track_diff(False, out, test, example, got)
+            return
+
+        return super().report_success(out, test, example, got)
+
+    def report_failure(self, out, test, example, got):
+        self._report_example(test, example, "failed")
+        if self._generate_diff:
+            self.track_diff(True, out, test, example, got)
+            return
+
+        failure = doctest.DocTestFailure(test, example, got)
+        if self.continue_on_failure:
+            out.append(failure)
+        else:
+            raise failure
+
+    def report_unexpected_exception(self, out, test, example, exc_info):
+        cls, exception, traceback = exc_info
+        self._report_example(test, example, "skipped" if isinstance(exception, (Skipped, SkipTest))
+                             else "error")
+        if isinstance(exception, (OutcomeException, SkipTest)):
+            raise exception
+        exc_info = (cls, exception, hide_exec_example(traceback))
+        failure = doctest.UnexpectedException(test, example, exc_info)
+        if self.continue_on_failure:
+            out.append(failure)
+        else:
+            raise failure
+
+    def track_diff(self, use, out, test, example, got):
+        if example.want == got:
+            return
+
+        info = dict(use=use, name=test.name, filename=test.filename,
+                    source=example.source, nindent=example.indent,
+                    want=example.want, got=got, test_lineno=test.lineno,
+                    example_lineno=example.lineno)
+        doctestplus_diffhook(info=info)
+        if not info["use"]:
+            return
+
+        self._spool.append(info)
@@ -0,0 +1,202 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The daemon of ``--doctest-plus-serve``, which collects the tests once, and
+then runs the doctests requested by `pytest_doctestplus.client` on a Unix
+socket, until it is interrupted.
+
+Like with ``--doctest-plus-watch``, the pytest process never runs the tests:
+each request runs in a child process forked from it, which starts with the
+modules imported by the collection, collects the requested files again, and
+sends its output to the client, through the pytest process.
+
+The client sends a request as a line of JSON, ``{"cwd": directory, "args":
+[path or node id, ...], "markup": bool}``, and the daemon replies with lines
+of JSON: ``{"output": text}`` while the doctests run, and then
+``{"exitstatus": status}``, or ``{"error": message}`` for an invalid request.
+"""
+import codecs
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+from pathlib import Path
+
+import pytest
+
+from .watch import collect_again, run_session
+
+SOCKET_NAME = ".doctestplus.sock"
+
+
+def send(connection, message):
+    """Send a message, as a line of JSON."""
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def select_files(known, cwd, args):
+    """
+    Return the files to collect for the paths and node ids of a request,
+    relative to ``cwd``, with the names of the doctests selected in each of
+    them (or None for all).  A directory selects the ``known`` files, those
+    collected by the daemon, that it contains, and no arguments select them
+    all.
+    """
+    if not args:
+        return dict.fromkeys(known)
+    files = {}
+    for arg in args:
+        path, _, name = arg.partition("::")
+        path = Path(os.path.normpath(Path(cwd, path)))
+        if path.is_dir():
+            for file_path in known:
+                if path in file_path.parents:
+                    files[file_path] = None
+        elif not name:
+            files[path] = None
+        elif files.get(path, set()) is not None:
+            files.setdefault(path, set()).add(name)
+    return files
+
+
+def is_selected(item, names):
+    """
+    Return whether an item is one of the doctests named (by its name, or the
+    name of the object whose doctests it holds, e.g. a class), if any.
+    """
+    return names is None or any(item.name == name or item.name.startswith(name + ".")
+                                for name in names)
+
+
+class Daemon:
+    """
+    A plugin serving the requests to run doctests on the Unix socket at
+    ``path``, one at a time, each in a child process forked from this one.
+    """
+
+    def __init__(self, config, path):
+        self.config = config
+        self.path = Path(path) if path else config.rootpath / SOCKET_NAME
+        self._child = False
+
+    def _listen(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.path.exists():
+            # A socket left by a daemon that did not exit cleanly
+            try:
+                listener.connect(os.fspath(self.path))
+            except OSError:
+                self.path.unlink()
+            else:
+                listener.close()
+                raise pytest.UsageError(f"a doctestplus daemon is already listening on "
+                                        f"{self.path}")
+            listener.close()
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(os.fspath(self.path))
+        listener.listen()
+        return listener
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if self._child or session.config.option.collectonly:
+            return None
+
+        known = {Path(item.path) for item in session.items if hasattr(item, "dtest")}
+        terminal = self.config.pluginmanager.getplugin("terminalreporter")
+        listener = self._listen()
+        try:
+            if terminal is not None:
+                terminal.write_line(
+                    f"doctestplus: serving the doctests of {len(known)} "
+                    f"file{'s' if len(known) != 1 else ''} on {self.path} (Ctrl-C to stop)")
+            while True:
+                connection, _ = listener.accept()
+                with connection:
+                    self._serve(session, listener, connection, known)
+        except KeyboardInterrupt:
+            raise session.Interrupted("stopped serving") from None
+        finally:
+            listener.close()
+            self.path.unlink(missing_ok=True)
+
+    def _serve(self, session, listener, connection, known):
+        # Run a request in a child, whose output goes through a pipe
+        try:
+            with connection.makefile("rb") as f:
+                request = json.loads(f.readline())
+            files = select_files(known, request["cwd"], request.get("args", []))
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            try:
+                send(connection, {"error": f"invalid request: {exc}"})
+            except OSError:
+                pass
+            return
+
+        output_read, output_write = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._child = True
+            listener.close()
+            connection.close()
+            os.close(output_read)
+            capman = self.config.pluginmanager.getplugin("capturemanager")
+            if capman is not None:
+                # Before replacing the standard output, which stopping the
+                # capture restores
+                capman.stop_global_capturing()
+            os.dup2(output_write, 1)
+            os.dup2(output_write, 2)
+            os.close(output_write)
+            self._run(session, files, bool(request.get("markup")))
+        os.close(output_write)
+
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        try:
+            with open(output_read, "rb") as output:
+                for chunk in iter(lambda: output.read1(1 << 16), b""):
+                    send(connection, {"output": decoder.decode(chunk)})
+        except OSError:
+            # The client went away
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            return
+        except KeyboardInterrupt:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            raise
+        _, status = os.waitpid(pid, 0)
+        code = os.waitstatus_to_exitcode(status)
+        try:
+            send(connection, {"exitstatus": code if code >= 0
+                              else int(pytest.ExitCode.INTERNAL_ERROR)})
+        except OSError:
+            pass
+
+    def _run(self, session, files, markup):
+        # In the child, with its standard output and error sent to the client
+        status = pytest.ExitCode.INTERNAL_ERROR
+        try:
+            config = session.config
+            capman = config.pluginmanager.getplugin("capturemanager")
+            if capman is not None:
+                # The output is captured from the new standard output
+                capman.start_global_capturing()
+                capman.suspend_global_capture()
+            terminal = config.pluginmanager.getplugin("terminalreporter")
+            if terminal is not None:
+                terminal._tw.hasmarkup = markup
+
+            collect_again(session, files,
+                          lambda item: is_selected(item, files.get(Path(item.path))))
+            status = run_session(session)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(int(status))
@@ -0,0 +1,421 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+In-process support for ``--doctest-plus-generate-diff``.
+
+This module applies the changes recorded by ``DebugRunnerPlus`` to the
+in-memory lines of a file and renders them as a patch in the same format as
+``git diff -p --no-index``, without writing temporary files or spawning any
+subprocesses.
+"""
+import contextlib
+import difflib
+import glob
+import hashlib
+import io
+import json
+import locale
+import os
+import re
+import stat
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from textwrap import indent
+
+__all__ = ['apply_changes', 'read_lines', 'unified_diff', 'atomic_write',
+           'process_changesets', 'ChangesetSpool']
+
+# Number of context lines, as used by ``git diff`` by default.
+CONTEXT = 3
+
+# ``git diff`` shows the closest preceding line starting with a letter, an
+# underscore or a dollar sign in the hunk header (truncated to 80 bytes).
+_funcname_re = re.compile(r'[A-Za-z_$]')
+_FUNCNAME_MAX_BYTES = 80
+
+
+def _get_encoding(encoding):
+    return encoding or locale.getpreferredencoding(False)
+
+
+def read_lines(fname, encoding=None):
+    """
+    Read ``fname`` once, returning its raw bytes and its lines.
+
+    The lines are split with universal newlines, exactly as `open` would do
+    in text mode.
+    """
+    with open(fname, 'rb') as f:
+        data = f.read()
+    text = data.decode(_get_encoding(encoding))
+    return data, io.StringIO(text, newline=None).readlines()
+
+
+def apply_changes(lines, changes):
+    """
+    Apply the changes recorded for a single file to its lines.
+
+    Parameters
+    ----------
+    lines : list of str
+        The original lines of the file (including line endings).
+    changes : list of dict
+        The ``info`` dictionaries recorded by ``DebugRunnerPlus.track_diff``.
+
+    Returns
+    -------
+    new_lines : list of str
+        The modified lines.
+    edits : list of tuple
+        ``(start, stop, new_lines)`` for each replaced block, in the
+        coordinates of the original file and in ascending order.
+    bad_tests : list of str
+        The names of the tests that could not be located in the file.
+    """
+    bad_tests = []
+    edits = []
+    new_lines = list(lines)
+
+    # Sort in reversed order to edit the lines from the bottom up, so that
+    # line numbers of the changes still to be applied stay valid.
+    changes = sorted(changes, key=lambda x: (x["test_lineno"], x["example_lineno"]),
+                     reverse=True)
+
+    for change in changes:
+        if change["test_lineno"] is None:
+            bad_tests.append(change["name"])
+            continue
+        # Find the first line of the output:
+        lineno = change["test_lineno"] + change["example_lineno"]
+        lineno += change["source"].count("\n")
+
+        indentation = len(lines[lineno-1]) - len(lines[lineno-1].lstrip())
+        indentation = lines[lineno-1][:indentation]
+        want = indent(change["want"], indentation, lambda x: True)
+        # Replace fully blank lines with the required `<BLANKLINE>`
+        # (May need to do this also if line contains only whitespace)
+        got = change["got"].replace("\n\n", "\n<BLANKLINE>\n")
+        got = indent(got, indentation, lambda x: True)
+
+        got_lines = got.splitlines(keepends=True)
+        stop = lineno + want.count("\n")
+        new_lines[lineno:stop] = got_lines
+        edits.append((lineno, stop, got_lines))
+
+    edits.reverse()
+    return new_lines, edits, bad_tests
+
+
+def _get_opcodes(old_lines, new_lines, edits):
+    """
+    Build `difflib.SequenceMatcher`-style opcodes for the whole file.
+
+    Only the replaced blocks are matched line by line, the rest of the file
+    is known to be unchanged, which keeps this linear in the size of the file.
+    """
+    opcodes = []
+    i = j = 0
+    for start, stop, block in edits:
+        if start < i:
+            # Overlapping edits; fall back to matching the whole file.
+            matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+            return matcher.get_opcodes()
+        if start > i:
+            opcodes.append(('equal', i, start, j, j + start - i))
+            j += start - i
+        matcher = difflib.SequenceMatcher(None, old_lines[start:stop], block, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            opcodes.append((tag, start + i1, start + i2, j + j1, j + j2))
+        i = stop
+        j += len(block)
+    if i < len(old_lines):
+        opcodes.append(('equal', i, len(old_lines), j, len(new_lines)))
+
+    # Merge neighbouring runs of unchanged lines, so that hunks are split
+    # exactly as they would be when comparing the whole files.
+    merged = []
+    for code in opcodes:
+        if merged and code[0] == merged[-1][0] == 'equal':
+            tag, i1, _, j1, _ = merged[-1]
+            code = (tag, i1, code[2], j1, code[4])
+            merged[-1] = code
+        else:
+            merged.append(code)
+    return merged
+
+
+def _group_opcodes(opcodes, n=CONTEXT):
+    """Group opcodes into hunks with ``n`` lines of context."""
+    codes = [code for code in opcodes if code[0] != 'equal' or code[1] != code[2]]
+    if not any(code[0] != 'equal' for code in codes):
+        return
+    # Trim the context at the start and the end of the file.
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # Split the hunk at large stretches of unchanged lines.
+        if tag == 'equal' and i2 - i1 > 2 * n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _format_range(start, stop):
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f'{beginning}'
+    if not length:
+        beginning -= 1
+    return f'{beginning},{length}'
+
+
+def _funcname(lines, before, encoding):
+    for i in range(before - 1, -1, -1):
+        line = lines[i]
+        if _funcname_re.match(line):
+            line = line.encode(encoding)[:_FUNCNAME_MAX_BYTES]
+            return ' ' + line.decode(encoding, 'ignore').rstrip()
+    return ''
+
+
+def _blob_id(data):
+    """The abbreviated object name git would assign to ``data``."""
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()[:7]
+
+
+def _diff_lines(prefix, lines):
+    for line in lines:
+        if line.endswith('\n'):
+            yield prefix + line
+        else:
+            yield prefix + line + '\n\\ No newline at end of file\n'
+
+
+def unified_diff(fname, old_data, old_lines, new_lines, edits=None, encoding=None):
+    """
+    Render the difference between two versions of ``fname`` in the format
+    of ``git diff -p --no-index``.
+
+    Parameters
+    ----------
+    fname : str
+        The name of the file, used in the headers.
+    old_data : bytes
+        The original contents of the file, used for the ``index`` line.
+    old_lines, new_lines : list of str
+        The original and the modified lines of the file.
+    edits : list of tuple, optional
+        The replaced blocks as returned by `apply_changes`.  If not given,
+        the complete files are compared.
+    encoding : str, optional
+        The encoding of the file.
+
+    Returns
+    -------
+    diff : str
+        The patch, or an empty string if the files are identical.
+    """
+    encoding = _get_encoding(encoding)
+    if edits is None:
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        opcodes = matcher.get_opcodes()
+    else:
+        opcodes = _get_opcodes(old_lines, new_lines, edits)
+
+    hunks = list(_group_opcodes(opcodes))
+    if not hunks:
+        return ''
+
+    new_data = ''.join(new_lines).replace('\n', os.linesep).encode(encoding)
+    try:
+        mode = '100755' if os.stat(fname).st_mode & stat.S_IXUSR else '100644'
+    except OSError:
+        mode = '100644'
+
+    path = fname.replace(os.sep, '/').lstrip('/')
+    out = [f'diff --git a/{path} b/{path}\n',
+           f'index {_blob_id(old_data)}..{_blob_id(new_data)} {mode}\n',
+           f'--- a/{path}\n',
+           f'+++ b/{path}\n']
+
+    for group in hunks:
+        first, last = group[0], group[-1]
+        old_range = _format_range(first[1], last[2])
+        new_range = _format_range(first[3], last[4])
+        funcname = _funcname(old_lines, first[1], encoding)
+        out.append(f'@@ -{old_range} +{new_range} @@{funcname}\n')
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                out.extend(_diff_lines(' ', old_lines[i1:i2]))
+                continue
+            if tag in ('replace', 'delete'):
+                out.extend(_diff_lines('-', old_lines[i1:i2]))
+            if tag in ('replace', 'insert'):
+                out.extend(_diff_lines('+', new_lines[j1:j2]))
+
+    return ''.join(out)
+
+
+def atomic_write(fname, text, encoding=None):
+    """
+    Replace the contents of ``fname`` with ``text`` atomically.
+
+    The text is written to a temporary file in the same directory, which is
+    then moved over the original, so that readers never see a partially
+    written file.  The permissions of the original file are preserved.
+    """
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    fd, tmpname = tempfile.mkstemp(prefix=f'.{basename}.', suffix='.tmp', dir=dirname)
+    try:
+        with open(fd, 'w', encoding=encoding) as f:
+            f.write(text)
+        try:
+            os.chmod(tmpname, stat.S_IMODE(os.stat(fname).st_mode))
+        except OSError:
+            pass
+        os.replace(tmpname, fname)
+    except BaseException:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise
+
+
+def _process_changeset(fname, changes, encoding, overwrite):
+    data, lines = read_lines(fname, encoding)
+    new_lines, edits, bad_tests = apply_changes(lines, changes)
+    if overwrite:
+        atomic_write(fname, ''.join(new_lines), encoding)
+        diff = None
+    else:
+        diff = unified_diff(fname, data, lines, new_lines, edits, encoding)
+    return fname, diff, bad_tests
+
+
+def process_changesets(changesets, encoding=None, overwrite=False, max_workers=None):
+    """
+    Apply the changes for each file, in parallel across files.
+
+    Parameters
+    ----------
+    changesets : iterable of tuple
+        ``(filename, changes)`` pairs.
+    encoding : str, optional
+        The encoding of the files.
+    overwrite : bool, optional
+        If `True`, write the modified files back in place.  Otherwise,
+        only compute the diffs.
+    max_workers : int, optional
+        The number of threads to use.
+
+    Yields
+    ------
+    fname : str
+        The name of the file.
+    diff : str or None
+        The diff of the file, or `None` if ``overwrite`` is `True`.
+    bad_tests : list of str
+        The names of the tests that could not be located in the file.
+    """
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Only keep a bounded number of files in flight, so that the changes
+        # of all files never need to be held in memory at once.
+        window = 2 * max_workers
+        futures = deque()
+        for fname, changes in changesets:
+            futures.append(executor.submit(_process_changeset, fname, changes,
+                                           encoding, overwrite))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+class ChangesetSpool:
+    """
+    Spill the changes recorded by ``DebugRunnerPlus`` to disk.
+
+    Every process (e.g. each ``pytest-xdist`` worker) appends its records to
+    its own JSON-lines file in a shared directory, so that the changes of very
+    large runs do not need to be kept in memory.  The process that applies the
+    changes then indexes where the records of each source file are, and reads
+    them back one source file at a time.
+
+    Parameters
+    ----------
+    directory : str
+        The directory shared by all the processes.
+    name : str, optional
+        The name of the spool file of this process.
+    """
+
+    def __init__(self, directory, name='main'):
+        self.directory = directory
+        self.name = name
+        self._file = None
+
+    def append(self, info):
+        """Record the changes ``info`` of a single example."""
+        if self._file is None:
+            path = os.path.join(self.directory, f'{self.name}.jsonl')
+            self._file = open(path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(info) + '\n')
+        # Records must be visible to other processes as soon as the example
+        # has finished running.
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def changesets(self):
+        """
+        Iterate over the recorded changes of all processes.
+
+        Yields
+        ------
+        fname : str
+            The name of the file to change, in sorted order.
+        changes : list of dict
+            All the changes recorded for this file.
+        """
+        self.close()
+
+        # First pass: only remember where the records of each file are.
+        index = {}
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.jsonl')))
+        for path in paths:
+            with open(path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    fname = json.loads(line)['filename']
+                    index.setdefault(fname, []).append((path, offset))
+                    offset += len(line)
+
+        # Then read back the records of one file at a time, with a single
+        # handle on each spool file.
+        with contextlib.ExitStack() as stack:
+            spools = {path: stack.enter_context(open(path, 'rb')) for path in paths}
+            for fname in sorted(index):
+                changes = []
+                for path, offset in index.pop(fname):
+                    spool = spools[path]
+                    spool.seek(offset)
+                    changes.append(json.loads(spool.readline()))
+                yield fname, changes
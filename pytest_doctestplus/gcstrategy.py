@@ -0,0 +1,164 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The strategies of the ``doctest_plus_gc`` setting, which configure the cyclic
+garbage collector while the tests run, and the measure of the time it takes.
+"""
+import gc
+import time
+
+import pytest
+
+from .core import load_cache, update_cache
+
+# The key of the pytest cache holding the garbage collection statistics of the
+# latest run with each strategy
+GC_KEY = "doctestplus/gc"
+
+STRATEGIES = ("none", "freeze", "items", "thresholds")
+
+# The thresholds of the ``thresholds`` strategy, which make the collections
+# of the youngest generation, and of the oldest one, much less frequent
+DEFAULT_THRESHOLDS = (50000, 20, 100)
+
+
+def parse_strategies(values):
+    """
+    Return the names of the strategies given by the values of the
+    ``doctest_plus_gc`` setting, and the thresholds to set, if any.
+    """
+    names = []
+    thresholds = None
+    for value in values:
+        name, _, arg = value.partition("=")
+        try:
+            if name not in STRATEGIES or (arg and name != "thresholds"):
+                raise ValueError
+            if name == "thresholds":
+                thresholds = (tuple(int(threshold) for threshold in arg.split(","))
+                              if arg else DEFAULT_THRESHOLDS)
+        except ValueError:
+            raise pytest.UsageError(
+                f"invalid doctest_plus_gc strategy: {value!r} (expected one of "
+                f"{', '.join(STRATEGIES)}, or thresholds=N[,N[,N]])") from None
+        names.append(name)
+    return names, thresholds
+
+
+class GCStats:
+    """The number of collections of the garbage collector and their time."""
+
+    def __init__(self):
+        self.collections = 0
+        self.time = 0.0
+        self._start = None
+
+    def callback(self, phase, info):
+        if phase == "start":
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            self.time += time.perf_counter() - self._start
+            self.collections += 1
+            self._start = None
+
+
+class GarbageCollection:
+    """
+    A plugin applying the ``doctest_plus_gc`` strategies while the tests run,
+    and recording the time taken by the garbage collector (in all the
+    pytest-xdist workers) in the pytest cache, to compare the strategies.
+    """
+
+    def __init__(self, config, values):
+        self.config = config
+        self.name = " ".join(values)
+        self.strategies, self.thresholds = parse_strategies(values)
+        self.stats = GCStats()
+        self.duration = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtestloop(self, session):
+        if "freeze" in self.strategies:
+            # The objects that exist once the tests are collected, e.g. the
+            # imported modules, are no longer scanned
+            gc.collect()
+            gc.freeze()
+        previous_thresholds = gc.get_threshold()
+        if self.thresholds:
+            gc.set_threshold(*self.thresholds)
+        gc.callbacks.append(self.stats.callback)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.duration = time.perf_counter() - start
+            gc.callbacks.remove(self.stats.callback)
+            gc.set_threshold(*previous_thresholds)
+            if "freeze" in self.strategies:
+                gc.unfreeze()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        if "items" not in self.strategies or not gc.isenabled():
+            yield
+            return
+        gc.disable()
+        try:
+            yield
+        finally:
+            gc.enable()
+            # Without automatic collections, all the objects allocated by
+            # the test are still in the youngest generation
+            gc.collect(0)
+
+    def child_output(self):
+        """
+        Return the number of collections, and their time, since the last
+        call, in a child process of ``--doctest-plus-fork``, and forget them.
+        """
+        output = (self.stats.collections, self.stats.time)
+        self.stats.collections = 0
+        self.stats.time = 0.0
+        return output if output[0] else None
+
+    def merge_child_output(self, output):
+        collections, seconds = output
+        self.stats.collections += collections
+        self.stats.time += seconds
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        collections, seconds = getattr(node, "workeroutput", {}).get("doctestplus_gc", (0, 0))
+        self.stats.collections += collections
+        self.stats.time += seconds
+
+    def pytest_sessionfinish(self, session):
+        workeroutput = getattr(session.config, "workeroutput", None)
+        if workeroutput is not None:
+            workeroutput["doctestplus_gc"] = (self.stats.collections, self.stats.time)
+        elif self.duration is not None:
+            update_cache(session.config, GC_KEY, {self.name: {
+                "collections": self.stats.collections, "gc_time": self.stats.time,
+                "duration": self.duration}})
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if hasattr(self.config, "workerinput") or self.duration is None:
+            return
+        recorded = load_cache(self.config, GC_KEY)
+        recorded[self.name] = {"collections": self.stats.collections,
+                               "gc_time": self.stats.time, "duration": self.duration}
+
+        terminalreporter.section("doctestplus garbage collection")
+        terminalreporter.write_line(
+            f"  {'strategy (latest run)':<24} {'GC time':>10} {'collections':>12} "
+            f"{'run time':>10}")
+        for name, stats in sorted(recorded.items(), key=lambda item: item[1]["gc_time"]):
+            marker = "*" if name == self.name else " "
+            terminalreporter.write_line(
+                f"{marker} {name:<24} {stats['gc_time']:9.2f}s {stats['collections']:12d} "
+                f"{stats['duration']:9.2f}s")
+        baseline = recorded.get("none")
+        if baseline is not None and self.name != "none":
+            terminalreporter.write_line(
+                f"GC time saved by {self.name!r} compared to 'none': "
+                f"{baseline['gc_time'] - self.stats.time:.2f}s")
@@ -0,0 +1,181 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The times taken by the imports of modules during the collection, reported with
+``--doctest-plus-importtime``, by the file (or directory) being collected when
+they were imported.
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+
+import pytest
+
+# The number of imports shown in the terminal summary
+TOP_IMPORTS = 10
+
+
+class ImportTimes:
+    """
+    The trees of the imports of modules, by the node id of the collector that
+    imported them, with the cumulative time taken by each import, i.e.
+    including the time of the imports it triggered.
+    """
+
+    def __init__(self):
+        self.roots = {}
+        # The node id of the collector being collected
+        self.collector = ''
+        self._nodes = {}
+        self._stack = []
+
+    @contextlib.contextmanager
+    def timing(self, name):
+        """Time a part of the import of a module (finding, creating or executing it)."""
+        node = self._nodes.get(name)
+        if node is None:
+            node = self._nodes[name] = {'module': name, 'cumulative': 0.0, 'imports': []}
+            if self._stack:
+                self._stack[-1]['imports'].append(node)
+            else:
+                self.roots.setdefault(self.collector, []).append(node)
+        self._stack.append(node)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            node['cumulative'] += time.perf_counter() - start
+            self._stack.pop()
+
+
+def with_self_times(nodes):
+    """
+    Return a copy of trees of imports, with the ``self`` time of each import,
+    excluding the imports it triggered.
+    """
+    return [dict(node, self=node['cumulative'] - sum(child['cumulative']
+                                                     for child in node['imports']),
+                 imports=with_self_times(node['imports']))
+            for node in nodes]
+
+
+def _flatten(nodes, collector):
+    for node in nodes:
+        yield node, collector
+        yield from _flatten(node['imports'], collector)
+
+
+class _TimedLoader:
+    """A loader timing the creation and execution of a module by another loader."""
+
+    def __init__(self, loader, times, name):
+        self.loader = loader
+        self.times = times
+        self.name = name
+
+    def create_module(self, spec):
+        if not hasattr(self.loader, 'create_module'):
+            return None
+        with self.times.timing(self.name):
+            return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # The module only sees the original loader
+        module.__loader__ = module.__spec__.loader = self.loader
+        with self.times.timing(self.name):
+            self.loader.exec_module(module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class _TimingFinder:
+    """
+    A meta path finder timing the search of the modules by the other finders,
+    whose loaders it wraps in a `_TimedLoader`.
+    """
+
+    def __init__(self, times):
+        self.times = times
+
+    def find_spec(self, fullname, path=None, target=None):
+        with self.times.timing(fullname):
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self.times, fullname)
+        return spec
+
+
+class ImportTimer:
+    """
+    A plugin timing the imports of modules during the collection.  As all the
+    pytest-xdist workers collect all the files, the controller reports the
+    import times of the first worker that finishes.
+    """
+
+    def __init__(self, config, path):
+        self.config = config
+        self.path = path
+        self.times = ImportTimes()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_collection(self, session):
+        finder = _TimingFinder(self.times)
+        sys.meta_path.insert(0, finder)
+        try:
+            yield
+        finally:
+            sys.meta_path.remove(finder)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_make_collect_report(self, collector):
+        previous, self.times.collector = self.times.collector, collector.nodeid
+        try:
+            yield
+        finally:
+            self.times.collector = previous
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        if not self.times.roots:
+            self.times.roots = getattr(node, 'workeroutput', {}).get('doctestplus_importtime', {})
+
+    def pytest_sessionfinish(self, session):
+        workeroutput = getattr(session.config, 'workeroutput', None)
+        if workeroutput is not None:
+            workeroutput['doctestplus_importtime'] = self.times.roots
+        elif self.path:
+            self.write()
+
+    def write(self):
+        """Write the trees of imports of each collector, as JSON."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        collectors = [{'nodeid': nodeid, 'imports': with_self_times(nodes)}
+                      for nodeid, nodes in self.times.roots.items()]
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'collectors': collectors}, f, indent=1)
+            f.write('\n')
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if hasattr(self.config, 'workerinput') or not self.times.roots:
+            return
+        imports = [item for nodeid, nodes in self.times.roots.items()
+                   for item in _flatten(with_self_times(nodes), nodeid)]
+        imports.sort(key=lambda item: item[0]['self'], reverse=True)
+        terminalreporter.section("doctestplus import times")
+        terminalreporter.write_line(f"{'self [ms]':>10} {'cumul. [ms]':>12}  module (collector)")
+        for node, nodeid in imports[:TOP_IMPORTS]:
+            terminalreporter.write_line(
+                f"{node['self'] * 1e3:10.1f} {node['cumulative'] * 1e3:12.1f}  "
+                f"{node['module']} ({nodeid or '<session>'})")
+        if self.path:
+            terminalreporter.write_line(f"the imports of each collector are written to {self.path}")
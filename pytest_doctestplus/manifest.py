@@ -0,0 +1,117 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The manifest of the doctests of text files, which the Sphinx extension writes
+during a build, with the examples of each file and the directives that apply
+to them.  doctestplus collects the files whose content did not change since
+the build from the manifest, instead of parsing them again.
+"""
+import doctest
+import hashlib
+import io
+import json
+import os
+
+from .parser import IncrementalDocTestParser, TextChunk
+
+MANIFEST_VERSION = 1
+
+
+def text_digest(lines):
+    """Return the SHA-256 digest of the text of a file, from its lines."""
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def entry_to_json(entry):
+    """Return an example, or a `TextChunk`, as a dict that can be serialized to JSON."""
+    if isinstance(entry, TextChunk):
+        return {'text': entry.to_dict()}
+    names = {flag: name for name, flag in doctest.OPTIONFLAGS_BY_NAME.items()}
+    return {'source': entry.source, 'want': entry.want, 'exc_msg': entry.exc_msg,
+            'lineno': entry.lineno, 'indent': entry.indent,
+            'options': {names[flag]: value for flag, value in entry.options.items()}}
+
+
+def entry_from_json(data):
+    """Return the example, or the `TextChunk`, of the result of `entry_to_json`."""
+    if 'text' in data:
+        return TextChunk.from_dict(data['text'])
+    return doctest.Example(
+        data['source'], data['want'], data['exc_msg'], lineno=data['lineno'],
+        indent=data['indent'],
+        options={doctest.OPTIONFLAGS_BY_NAME[name]: value
+                 for name, value in data['options'].items()})
+
+
+def parse_entries(text, name):
+    """
+    Parse the text of a file, and return its examples, and the `TextChunk`
+    summaries of the text between them, as JSON entries.  Raise `ValueError`
+    if the text holds an invalid example.
+    """
+    # Like a file, the lines are only split on '\n'
+    lines = list(io.StringIO(text, newline='\n'))
+    parser = IncrementalDocTestParser()
+    min_indent = parser.min_indent(lines)
+    return [entry_to_json(entry) for entry in parser.iter_parse(lines, name, min_indent)
+            if not isinstance(entry, TextChunk) or not entry.empty]
+
+
+def write_manifest(path, files):
+    """
+    Write a manifest, with the digest and the entries of each file, given by
+    path, as ``{path: {'sha256': digest, 'entries': entries}}``.  The paths
+    are written relative to the directory of the manifest.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    data = {'version': MANIFEST_VERSION,
+            'files': {os.path.relpath(file_path, directory): record
+                      for file_path, record in sorted(files.items())}}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+class Manifest:
+    """The files recorded in a manifest, by their absolute path."""
+
+    def __init__(self, files):
+        self.files = files
+
+    @classmethod
+    def load(cls, path):
+        """Load a manifest, or return None if there is no valid manifest at the path."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+            return None
+        directory = os.path.dirname(os.path.abspath(path))
+        return cls({os.path.normpath(os.path.join(directory, file_path)): record
+                    for file_path, record in data['files'].items()})
+
+    def entries(self, path, encoding=None):
+        """
+        Return the examples and the `TextChunk` summaries of a file, if it
+        did not change since the manifest was written, or else None.
+        """
+        record = self.files.get(os.path.normpath(os.path.abspath(path)))
+        if record is None:
+            return None
+        try:
+            with open(path, encoding=encoding) as f:
+                digest = text_digest(f)
+        except (OSError, UnicodeDecodeError):
+            return None
+        if digest != record['sha256']:
+            return None
+        try:
+            return [entry_from_json(entry) for entry in record['entries']]
+        except KeyError:
+            # An option flag that is not registered in this process
+            return None
@@ -3,3 +3,33 @@
 
 def pytest_doctestplus_diffhook(info):
     """ called when a diff would be generated normally. """
+
+
+# The hooks below are called after each phase of the collection and execution
+# of the doctests, with an ``info`` dictionary which also holds the ``start``
+# time of the phase (as given by `time.time`), and its ``wall`` and ``cpu``
+# durations, in seconds.  The phases are only timed if they are implemented.
+
+def pytest_doctestplus_import(info):
+    """ called after a module is imported, with its ``path`` and ``module``
+    (`None` if it could not be imported). """
+
+
+def pytest_doctestplus_find(info):
+    """ called after the doctests of a module are found, with its ``path``,
+    ``module`` and ``tests``. """
+
+
+def pytest_doctestplus_parse(info):
+    """ called after a text file is parsed, with its ``path`` and ``examples``. """
+
+
+def pytest_doctestplus_requirement(info):
+    """ called after a ``requirement`` of a doctest is checked, the first time,
+    with whether it is ``available``. """
+
+
+def pytest_doctestplus_example(info):
+    """ called after an example is run, with the ``name``, ``filename`` and
+    ``test_lineno`` of its doctest, and its ``example_lineno``, ``source``,
+    ``want`` and ``outcome``. """
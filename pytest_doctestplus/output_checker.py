@@ -4,9 +4,14 @@ normalizations of Python expression output.  See the docstring on
 `OutputChecker` for more details.
 """
 
+import difflib
 import doctest
+import functools
+import hashlib
 import re
 import math
+import threading
+from collections import OrderedDict, namedtuple
 
 
 # Much of this code, particularly the parts of floating point handling, is
@@ -16,11 +21,13 @@ import math
 
 FIX = doctest.register_optionflag('FIX')
 FLOAT_CMP = doctest.register_optionflag('FLOAT_CMP')
+ARRAY_CMP = doctest.register_optionflag('ARRAY_CMP')
 REMOTE_DATA = doctest.register_optionflag('REMOTE_DATA')
 IGNORE_OUTPUT = doctest.register_optionflag('IGNORE_OUTPUT')
 IGNORE_OUTPUT_3 = doctest.register_optionflag('IGNORE_OUTPUT_3')
 IGNORE_WARNINGS = doctest.register_optionflag('IGNORE_WARNINGS')
 SHOW_WARNINGS = doctest.register_optionflag('SHOW_WARNINGS')
+CHECKPOINT = doctest.register_optionflag('CHECKPOINT')
 
 # These might appear in some doctests and are used in the default pytest
 # doctest plugin. This plugin doesn't actually implement these flags but this
@@ -29,6 +36,60 @@ ALLOW_BYTES = doctest.register_optionflag('ALLOW_BYTES')
 ALLOW_UNICODE = doctest.register_optionflag('ALLOW_UNICODE')
 
 
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class _ResultCache:
+    """
+    A thread-safe, bounded LRU cache of `OutputChecker` results.
+
+    Entries are keyed on a digest of the compared strings, so that the cache
+    never holds on to (possibly very large) outputs.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, want, got, *args):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(want.encode('utf-8', 'surrogatepass'))
+        digest.update(b'\0')
+        digest.update(got.encode('utf-8', 'surrogatepass'))
+        return (kind, digest.digest()) + args
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
 class OutputChecker(doctest.OutputChecker):
     """
     - Removes u'' prefixes on string literals
@@ -39,10 +100,35 @@ class OutputChecker(doctest.OutputChecker):
       out of the output and compares their numerical values rather than their
       string representation.  This naturally supports complex numbers as well
       (simply by comparing their real and imaginary parts separately).
+    - Supports the ARRAY_CMP flag, which parses the reprs of Numpy arrays
+      and masked arrays in the output and compares them as arrays: their
+      shapes and dtypes must match, and their values are compared with a
+      single vectorized call.
     """
     rtol = 1e-05
     atol = 1e-08
 
+    # The results of `check_output` and `output_difference` are memoized in
+    # a bounded LRU cache shared by all instances.  Comparisons of strings
+    # shorter than ``cache_min_length`` (in total) are cheaper than hashing
+    # them, so these bypass the cache.
+    cache_size = 1024
+    cache_min_length = 256
+    _cache = _ResultCache(cache_size)
+
+    # Outputs longer than ``max_diff_size`` characters (in total) are reported
+    # with `bounded_difference`, which shows at most ``max_diff_lines`` lines,
+    # each truncated to ``max_diff_line_length`` characters.
+    max_diff_size = 100000
+    max_diff_lines = 200
+    max_diff_line_length = 500
+
+    # pytest reports the failures with the ``REPORT_*`` flags only, so the
+    # differences are described with the FIX normalizations when the example
+    # enables FIX, or, without a FIX option, when ``fix`` is set (doctestplus
+    # sets it, since its runners always check the outputs with FIX).
+    fix = False
+
     _str_literal_re = re.compile(
         r"(\W|^)[uU]([rR]?[\'\"])", re.UNICODE)
     _byteorder_re = re.compile(
@@ -51,6 +137,14 @@ class OutputChecker(doctest.OutputChecker):
         r"([\'\"])([iu])[48]([\'\"])", re.UNICODE)
     _long_int_re = re.compile(
         r"([0-9]+)L", re.UNICODE)
+    _hunk_re = re.compile(r'@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@')
+
+    _array_call_re = re.compile(r'\b((?:masked_)?array)\(')
+    _call_token_re = re.compile(r'[()\[\]{}\'"]')
+    _array_value_re = re.compile(r'[^\s,\[\]]+')
+    _complex_space_re = re.compile(r'\s+(?=[+-][^\s,\[\]]*j)')
+    _skeleton_table = str.maketrans('', '', ' \t\n,')
+    _keyword_re = re.compile(r'\s*(\w+)\s*=(.*)', re.DOTALL)
 
     def __init__(self):
         exp = r'(?:e[+-]?\d+)'
@@ -270,30 +364,382 @@ class OutputChecker(doctest.OutputChecker):
 
         return True
 
+    def split_call(self, text, pos):
+        """
+        Split the arguments of the call whose opening parenthesis is at
+        ``pos`` in ``text``.  Return the list of arguments and the position
+        after the closing parenthesis, or `None` if it is not closed.
+
+        >>> OutputChecker().split_call("array([[1, 2]], dtype='<U1') + 1", 5)
+        (['[[1, 2]]', " dtype='<U1'"], 28)
+        """
+        depth = 0
+        args = []
+        arg_start = last = pos + 1
+        token_re = self._call_token_re
+        match = token_re.search(text, pos)
+        while match is not None:
+            start = match.start()
+            if depth == 1:
+                # Only the commas outside of brackets separate arguments.
+                comma = text.find(',', last, start)
+                while comma >= 0:
+                    args.append(text[arg_start:comma])
+                    arg_start = comma + 1
+                    comma = text.find(',', arg_start, start)
+            token = match.group()
+            if token in '([{':
+                depth += 1
+            elif token in ')]}':
+                depth -= 1
+                if depth == 0:
+                    args.append(text[arg_start:start])
+                    return args, start + 1
+            else:
+                # Skip over string literals.
+                start = text.find(token, start + 1)
+                if start < 0:
+                    return None
+            last = start + 1
+            match = token_re.search(text, last)
+        return None
+
+    def parse_array(self, text):
+        """
+        Parse the nested list of an array repr into a Numpy array and a
+        boolean array of its masked (``--``) elements.  Return `None` if
+        the list is summarized, ragged, or its values are not numbers or
+        booleans.
+
+        >>> values, mask = OutputChecker().parse_array('[[1., --], [nan, 4.]]')
+        >>> values.shape, values.dtype.kind, mask.tolist()
+        ((2, 2), 'f', [[False, True], [False, False]])
+        """
+        numpy = _get_numpy()
+        if numpy is None or '...' in text:
+            return None
+
+        if 'j' in text:
+            # Complex values may have a space before their imaginary part.
+            text = self._complex_space_re.sub('', text)
+        values = self._array_value_re.findall(text)
+        skeleton = self._array_value_re.sub('0', text).translate(self._skeleton_table)
+        ndim = len(skeleton) - len(skeleton.lstrip('['))
+        if ndim == 0:
+            return None
+
+        # The first list at each depth starts at the start of the skeleton,
+        # so the shape follows from their lengths, and is then checked by
+        # rebuilding the full skeleton.
+        shape = []
+        length = 0
+        for depth in range(ndim - 1, -1, -1):
+            end = skeleton.find(']' * (ndim - depth))
+            if end < 0:
+                return None
+            new_length = end + ndim - 2 * depth
+            shape.insert(0, (new_length - 2) // length if length else new_length - 2)
+            length = new_length
+        expected = '[' + '0' * shape[-1] + ']'
+        for size in reversed(shape[:-1]):
+            expected = '[' + expected * size + ']'
+        if skeleton != expected:
+            return None
+
+        if '--' in values:
+            mask = numpy.array([value == '--' for value in values]).reshape(shape)
+            values = ['0' if value == '--' else value for value in values]
+        else:
+            mask = numpy.zeros(shape, dtype=bool)
+
+        if values and values[0] in ('True', 'False'):
+            converters = ({'True': True, 'False': False}.__getitem__,)
+        else:
+            converters = (int, float, complex)
+        for converter in converters:
+            try:
+                values = list(map(converter, values))
+            except (ValueError, KeyError):
+                continue
+            return numpy.array(values).reshape(shape), mask
+        return None
+
+    def equal_arrays(self, want, got):
+        """
+        Compare the nested lists of two array reprs, or return `None` if
+        either of them can not be parsed.
+
+        >>> OutputChecker().equal_arrays('[[1., 2.]]', '[[1.0000001, 2.]]')
+        True
+        >>> OutputChecker().equal_arrays('[[1., 2.]]', '[1., 2.]')
+        False
+        >>> OutputChecker().equal_arrays('[1., 2.]', '[1, 2]')
+        False
+        """
+        want = self.parse_array(want)
+        got = self.parse_array(got)
+        if want is None or got is None:
+            return None
+        numpy = _get_numpy()
+        (want, want_mask), (got, got_mask) = want, got
+
+        if (want.shape != got.shape or want.dtype.kind != got.dtype.kind
+                or not numpy.array_equal(want_mask, got_mask)):
+            return False
+        if want.dtype.kind in 'fc':
+            close = numpy.isclose(got, want, rtol=self.rtol, atol=self.atol,
+                                  equal_nan=True)
+            return bool((close | got_mask).all())
+        return bool((want == got).all())
+
+    def find_arrays(self, text):
+        """
+        Find the reprs of arrays and masked arrays in ``text``.  Return the
+        text around them, with each repr replaced by ``name()``, and a list
+        of the names and arguments of the reprs.
+        """
+        outside = []
+        arrays = []
+        pos = search = 0
+        while True:
+            match = self._array_call_re.search(text, search)
+            if match is None:
+                break
+            call = self.split_call(text, match.end() - 1)
+            if call is None:
+                search = match.end()
+                continue
+            args, end = call
+            outside.append(text[pos:match.start()] + match.group(1) + '()')
+            arrays.append((match.group(1), args))
+            pos = search = end
+        outside.append(text[pos:])
+        return ''.join(outside), arrays
+
+    def compare_arrays(self, want, got, flags):
+        """
+        Compare outputs containing the reprs of Numpy arrays, as done for
+        ARRAY_CMP.  The text around the reprs and the arguments other than
+        the data and mask are compared as for FLOAT_CMP, whereas the data
+        and mask are parsed into arrays and compared with `equal_arrays`.
+        Return `None` if the outputs can not be compared this way, e.g.
+        because an array is summarized or holds strings.
+
+        >>> c = OutputChecker()
+        >>> c.compare_arrays('array([1., 2.], dtype=float32)',
+        ...                  'array([1.0000001, 2.], dtype=float32)', 0)
+        True
+        >>> c.compare_arrays('array([1., 2.], dtype=float32)',
+        ...                  'array([1., 2.1], dtype=float32)', 0)
+        False
+        """
+        if got == want:
+            return True
+
+        want_outside, want_arrays = self.find_arrays(want)
+        got_outside, got_arrays = self.find_arrays(got)
+        if not want_arrays or len(want_arrays) != len(got_arrays):
+            return None
+
+        for (want_name, want_args), (got_name, got_args) in zip(want_arrays, got_arrays):
+            if want_name != got_name or len(want_args) != len(got_args):
+                return None
+            for i, (want_arg, got_arg) in enumerate(zip(want_args, got_args)):
+                want_kw = self._keyword_re.match(want_arg)
+                got_kw = self._keyword_re.match(got_arg)
+                if want_kw and got_kw:
+                    if want_kw.group(1) != got_kw.group(1):
+                        return None
+                    key, want_arg, got_arg = want_kw.group(1), want_kw.group(2), got_kw.group(2)
+                elif not (want_kw or got_kw) and i == 0:
+                    key = 'data'
+                else:
+                    return None
+
+                if key in ('data', 'mask') and want_arg.lstrip().startswith('['):
+                    equal = self.equal_arrays(want_arg, got_arg)
+                    if equal is None:
+                        return None
+                else:
+                    equal = self.normalize_floats(want_arg, got_arg, flags)
+                if not equal:
+                    return False
+
+        return self.normalize_floats(want_outside, got_outside, flags)
+
+    @classmethod
+    def cache_info(cls):
+        """
+        Return the statistics of the result cache, as a `CacheInfo` named
+        tuple of ``hits``, ``misses``, ``maxsize`` and ``currsize``.
+        """
+        return cls._cache.info()
+
+    @classmethod
+    def cache_clear(cls):
+        """Clear the result cache and its statistics."""
+        cls._cache.clear()
+        cls._cache.maxsize = cls.cache_size
+
+    def _cached(self, kind, want, got, flags, func, *args):
+        if (self.cache_size <= 0
+                or len(want) + len(got) < self.cache_min_length):
+            return func(*args)
+
+        # Tolerances are class attributes that may be changed at any time.
+        key = self._cache.make_key(kind, want, got, flags, self.rtol, self.atol)
+        result = self._cache.get(key)
+        if result is None:
+            result = func(*args)
+            self._cache.set(key, result)
+        return result
+
     def check_output(self, want, got, flags):
         if ((flags & IGNORE_OUTPUT) or (flags & IGNORE_OUTPUT_3)):
             return True
 
+        return self._cached('check', want, got, flags,
+                            self._check_output, want, got, flags)
+
+    def _check_output(self, want, got, flags):
         if flags & FIX:
             want, got = self.do_fixes(want, got)
 
-        if flags & FLOAT_CMP:
+        if flags & ARRAY_CMP:
+            result = self.compare_arrays(want, got, flags)
+            if result is not None:
+                return result
+
+        if flags & (FLOAT_CMP | ARRAY_CMP):
             return self.normalize_floats(want, got, flags)
 
         return super().check_output(want, got, flags)
 
-    def output_difference(self, want, got, flags):
+    def output_difference(self, example, got, flags):
+        if example.options.get(FIX, self.fix or flags & FIX):
+            flags |= FIX
+        else:
+            flags &= ~FIX
+        return self._cached('difference', example.want, got, flags,
+                            self._output_difference, example, got, flags)
+
+    def _output_difference(self, example, got, flags):
+        # The base class only uses the `want` attribute of the example.
         if flags & FIX:
-            want, got = self.do_fixes(want, got)
+            want, got = self.do_fixes(example.want, got)
+            example = doctest.Example(example.source, want)
 
-        return super().output_difference(want, got, flags)
+        if len(example.want) + len(got) > self.max_diff_size:
+            return self.bounded_difference(example.want, got, flags)
 
+        return super().output_difference(example, got, flags)
 
-try:
-    import numpy
+    def _truncate_line(self, line):
+        line = line.rstrip()
+        if len(line) > self.max_diff_line_length:
+            extra = len(line) - self.max_diff_line_length
+            line = (line[:self.max_diff_line_length]
+                    + f' ... ({extra} more characters)')
+        return line
 
-    def isclose(a, b, rtol=1e-05, atol=1e-08, equal_nan=True):
+    def bounded_difference(self, want, got, flags):
+        """
+        Describe the differences between large outputs at a bounded cost.
+
+        Common leading and trailing lines are trimmed in linear time, and
+        only the remaining lines are diffed, if there are few enough of them.
+        Otherwise, the first differing lines of both outputs are listed.  In
+        both cases, the report is truncated to ``max_diff_lines`` lines and
+        gives the line numbers of the first and last differences.
+
+        >>> c = OutputChecker()
+        >>> want = ''.join(f'{i}\\n' for i in range(10000))
+        >>> print(c.bounded_difference(want, want.replace('5000', '-'), 0))
+        Differences (bounded diff with -expected +actual):
+            Expected output: line 5001 differs (of 10000 lines)
+            Actual output: line 5001 differs (of 10000 lines)
+            @@ -4999,5 +4999,5 @@
+             4998
+             4999
+            -5000
+            +-
+             5001
+             5002
+        <BLANKLINE>
+        """
+        # Replace blank lines with <BLANKLINE>, as the base class does.
+        if not (flags & doctest.DONT_ACCEPT_BLANKLINE):
+            got = re.sub(r'(?m)^[ ]*(?=\n)', doctest.BLANKLINE_MARKER, got)
+
+        want_lines = want.splitlines(keepends=True)
+        got_lines = got.splitlines(keepends=True)
+        n_want, n_got = len(want_lines), len(got_lines)
+
+        # Trim the common prefix and suffix.
+        start = 0
+        stop = min(n_want, n_got)
+        while start < stop and want_lines[start] == got_lines[start]:
+            start += 1
+        end = 0
+        while (end < stop - start
+               and want_lines[n_want - end - 1] == got_lines[n_got - end - 1]):
+            end += 1
+        want_diff = want_lines[start:n_want - end]
+        got_diff = got_lines[start:n_got - end]
+
+        def describe(lines, total):
+            if not lines:
+                return f'no lines at line {start + 1} (of {total} lines)'
+            elif len(lines) == 1:
+                return f'line {start + 1} differs (of {total} lines)'
+            return f'lines {start + 1}-{start + len(lines)} differ (of {total} lines)'
+
+        out = ['Expected output: ' + describe(want_diff, n_want),
+               'Actual output: ' + describe(got_diff, n_got)]
+
+        if len(want_diff) + len(got_diff) <= self.max_diff_lines:
+            # Few enough lines to diff them, with two lines of context as
+            # doctest does.
+            before, after = min(2, start), min(2, end)
+            diff = difflib.unified_diff(
+                want_lines[start - before:n_want - end + after],
+                got_lines[start - before:n_got - end + after], n=2)
+            offset = start - before
+            for line in list(diff)[2:]:
+                match = self._hunk_re.match(line)
+                if match:
+                    line = '@@ -{}{} +{}{} @@'.format(
+                        int(match.group(1)) + offset, match.group(2) or '',
+                        int(match.group(3)) + offset, match.group(4) or '')
+                out.append(self._truncate_line(line))
+        else:
+            half = self.max_diff_lines // 2
+            for prefix, lines in (('-', want_diff), ('+', got_diff)):
+                for line in lines[:half]:
+                    out.append(self._truncate_line(prefix + line))
+                if len(lines) > half:
+                    out.append(f'... ({len(lines) - half} more differing lines)')
+
+        if len(out) > self.max_diff_lines:
+            out[self.max_diff_lines:] = [
+                f'... ({len(out) - self.max_diff_lines} more lines)']
+
+        return ('Differences (bounded diff with -expected +actual):\n'
+                + ''.join(f'    {line}\n' for line in out))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_numpy():
+    # Numpy is only imported when first needed, as it is slow to import.
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def isclose(a, b, rtol=1e-05, atol=1e-08, equal_nan=True):
+    numpy = _get_numpy()
+    if numpy is not None:
         return numpy.isclose(a, b, rtol=rtol, atol=atol, equal_nan=equal_nan)
-except ImportError:
-    def isclose(a, b, rtol=1e-05, atol=1e-08, equal_nan=True):
-        return abs(a - b) <= atol + rtol * abs(b) or (equal_nan and math.isnan(a) and math.isnan(b))
+    return abs(a - b) <= atol + rtol * abs(b) or (equal_nan and math.isnan(a) and math.isnan(b))
@@ -0,0 +1,217 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+Incremental parsing of doctests, which reads text files line by line rather
+than holding their (possibly very large) contents in memory.
+"""
+import doctest
+import re
+
+
+class TextChunk:
+    """
+    Summary of the text between two examples, holding what is needed to find
+    the directives that apply to the following examples.  Its attributes are
+    all derived from the lines of the stripped text, i.e. from
+    ``text.strip().splitlines()``:
+
+    - ``empty``: whether the text is empty,
+    - ``blank``: whether the text only holds whitespace,
+    - ``directive_lines``: the lines that may hold a directive,
+    - ``last_lines``: the last two lines.
+
+    The ``section`` attribute tells whether the text holds a section title, in
+    reStructuredText or Markdown.
+    """
+
+    # The underline of a reStructuredText title, or a Markdown heading
+    _SECTION_RE = re.compile(r'\s*(?:([^\w\s])\1{2,}\s*$|#{1,6}\s+\S)')
+
+    def __init__(self):
+        self.empty = True
+        self.directive_lines = []
+        self.section = False
+        self._lineno = 0
+        self._previous = ''
+        # The number of non-blank lines, and the index of the last one
+        self._ncontent = 0
+        self._content_lineno = None
+        # The last non-blank line, whose directives are only added once it is
+        # known whether it is the last one
+        self._pending = None
+        # The text from the line before the last non-blank line, and whether
+        # there is any text before it
+        self._tail = None
+        self._content_before = False
+
+    @property
+    def blank(self):
+        return self._ncontent == 0
+
+    def append(self, line):
+        self.empty = False
+        if line.strip():
+            if self._pending is not None:
+                self._add_directive_lines(self._pending, self._ncontent == 1, False)
+            self._content_before = (self._ncontent > 1 or self._ncontent == 1
+                                    and self._content_lineno < self._lineno - 1)
+            if not self.section and self._SECTION_RE.match(line):
+                self.section = line.lstrip()[0] == '#' or bool(self._previous.strip())
+            self._pending = line
+            self._tail = self._previous + line
+            self._ncontent += 1
+            self._content_lineno = self._lineno
+        self._previous = line
+        self._lineno += 1
+
+    def _add_directive_lines(self, line, first, last):
+        if 'doctest-' not in line:
+            return
+        if first:
+            line = line.lstrip()
+        if last:
+            line = line.rstrip()
+        self.directive_lines.extend(part for part in line.splitlines() if 'doctest-' in part)
+
+    def close(self):
+        """Add the directives of the last line, once all lines are known."""
+        if self._pending is not None:
+            self._add_directive_lines(self._pending, self._ncontent == 1, True)
+
+    @property
+    def last_lines(self):
+        if self._tail is None:
+            return []
+        # The placeholder line keeps the tail from being stripped if there
+        # is some text before it.
+        tail = ('.\n' if self._content_before else '') + self._tail
+        return tail.strip().splitlines()[-2:]
+
+    def to_dict(self):
+        """Return the summary as a dict, which can be serialized to JSON."""
+        return {'empty': self.empty, 'blank': self.blank, 'section': self.section,
+                'directive_lines': self.directive_lines, 'last_lines': self.last_lines}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return a summary from the result of `to_dict`."""
+        return _StoredTextChunk(data)
+
+
+class _StoredTextChunk(TextChunk):
+    # A summary restored from a dict, rather than built from the lines
+    blank = last_lines = None
+
+    def __init__(self, data):
+        for name in ('empty', 'blank', 'section', 'directive_lines', 'last_lines'):
+            setattr(self, name, data[name])
+
+
+class IncrementalDocTestParser(doctest.DocTestParser):
+    """
+    A `doctest.DocTestParser` that parses text from an iterable of lines,
+    e.g. an open file, and yields the examples as it goes.
+    """
+
+    _ps1_re = re.compile(r'[ ]*>>>')
+    _ps2_re = re.compile(r'[ ]*\.\.\.')
+
+    def min_indent(self, lines):
+        """
+        Return the minimum indentation of the non-blank lines, which
+        `doctest.DocTestParser.parse` removes from all lines.
+        """
+        min_indent = None
+        for line in lines:
+            match = self._INDENT_RE.match(line.expandtabs())
+            if match:
+                indent = len(match.group(1))
+                if min_indent is None or indent < min_indent:
+                    min_indent = indent
+                    if indent == 0:
+                        break
+        return min_indent or 0
+
+    def iter_parse(self, lines, name='<string>', min_indent=0):
+        """
+        Parse the lines (with their line endings) of a text holding doctests.
+
+        This yields the same examples as `doctest.DocTestParser.parse`, but
+        the text between them is given as `TextChunk` summaries.  The lines
+        should only be split on ``'\\n'``, and ``min_indent`` should be the
+        result of `min_indent` for the lines.
+        """
+        chunk = TextChunk()
+        source = want = start = None
+        for lineno, line in enumerate(lines):
+            line = line.expandtabs()
+            if min_indent:
+                if line.endswith('\n'):
+                    line = line[min_indent:-1] + '\n'
+                else:
+                    # The last line, if it has no line ending
+                    line = line[min_indent:]
+                    if not line:
+                        break
+
+            if source is not None:
+                if not want and self._ps2_re.match(line):
+                    source.append(line)
+                    continue
+                if line.rstrip('\n').strip(' ') and not self._ps1_re.match(line):
+                    want.append(line)
+                    continue
+                example = self._make_example(source, want, start, name, min_indent)
+                if example is not None:
+                    yield example
+                source = None
+
+            if self._ps1_re.match(line):
+                chunk.close()
+                yield chunk
+                chunk = TextChunk()
+                source, want, start = [line], [], lineno
+            else:
+                chunk.append(line)
+
+        if source is not None:
+            example = self._make_example(source, want, start, name, min_indent)
+            if example is not None:
+                yield example
+        chunk.close()
+        yield chunk
+
+    def _make_example(self, source, want, lineno, name, min_indent):
+        match = self._EXAMPLE_RE.match(''.join(source + want))
+        source, options, want, exc_msg = self._parse_example(match, name, lineno)
+        if self._IS_BLANK_OR_COMMENT(source):
+            return None
+        return doctest.Example(source, want, exc_msg, lineno=lineno,
+                               indent=min_indent + len(match.group('indent')),
+                               options=options)
+
+
+class FileDocTest(doctest.DocTest):
+    """
+    A `doctest.DocTest` for the examples of a text file, whose ``docstring``
+    (the text of the file) is only read when needed, e.g. by pytest to show
+    the context of a failure.
+    """
+
+    def __init__(self, examples, globs, name, filename, lineno, encoding=None):
+        self._encoding = encoding
+        super().__init__(examples, globs, name, filename, lineno, None)
+
+    @property
+    def docstring(self):
+        if self._docstring is None:
+            with open(self.filename, encoding=self._encoding) as f:
+                self._docstring = f.read()
+        return self._docstring
+
+    @docstring.setter
+    def docstring(self, docstring):
+        self._docstring = docstring
+
+    def __hash__(self):
+        return hash((self.name, self.filename, self.lineno))
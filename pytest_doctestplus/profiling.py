@@ -0,0 +1,179 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The profiles of the doctests, written with ``--doctest-plus-profile``: a
+`cProfile` profile per doctest, and the collapsed stacks of all of them, for
+flame graph tools.
+"""
+import cProfile
+import collections
+import fnmatch
+import os
+import pstats
+import re
+
+import pytest
+
+# The name of the file of collapsed stacks, in the directory of the profiles
+COLLAPSED_NAME = 'doctests.collapsed'
+
+
+def profile_path(directory, nodeid):
+    """Return the path of the profile of the test with the given node id."""
+    return os.path.join(directory, re.sub(r'[^\w.-]+', '_', nodeid).strip('_') + '.pstats')
+
+
+def example_locations(dtest):
+    """
+    Return the file name and line of each example of a doctest, by the file
+    name under which `doctest` compiles it.
+    """
+    lineno = dtest.lineno or 0
+    return {f'<doctest {dtest.name}[{i}]>': (dtest.filename, lineno + example.lineno)
+            for i, example in enumerate(dtest.examples)}
+
+
+def _label(func, locations):
+    filename, lineno, name = func
+    if filename in locations:
+        # The lines of the code of the examples start at 1
+        path, start = locations[filename]
+        label = f'{name} ({path}:{start + lineno})'
+    elif filename == '~':
+        label = name  # A builtin
+    else:
+        label = f'{name} ({filename}:{lineno})'
+    return label.replace(';', ',')
+
+
+def collapsed_stacks(stats, locations, min_time=1e-6, max_depth=512, max_stacks=100000):
+    """
+    Return the self time of each stack of the profile of a doctest, from the
+    call graph of `pstats.Stats.stats`, as a `collections.Counter` of tuples
+    of frame labels.
+
+    The profile only records the callers of each function, so its time is
+    split between the stacks of its callers in proportion to the time it
+    spent when called by each of them.  The stacks start at the code of the
+    examples, whose frames are labeled with their location in the file given
+    by `locations` (see `example_locations`); the time spent outside of the
+    examples is counted in the empty stack.  Branches taking less than
+    `min_time` seconds are left out.
+
+    The stacks deeper than `max_depth` frames, and those left once
+    `max_stacks` stacks were walked (as the paths through the functions
+    called from several places multiply), are cut: their whole time is
+    counted in their last frame.
+    """
+    callees = collections.defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+
+    result = collections.Counter()
+    # The branches left to walk, with their stack of functions, the labels
+    # of the frames from the first example, and their self and total time
+    pending = [(func, (func,), (_label(func, locations),) if func[0] in locations else None,
+                self_time, time)
+               for func, (_, _, self_time, time, callers) in stats.items() if not callers]
+    walked = 0
+    while pending:
+        func, stack, labels, self_time, time = pending.pop()
+        key = labels or ()
+        walked += 1
+        if walked > max_stacks or len(stack) >= max_depth:
+            result[key] += time
+            continue
+        result[key] += self_time
+        total = stats[func][3]
+        if not total:
+            continue
+        scale = time / total
+        for callee, (_, _, callee_self_time, callee_time) in callees[func].items():
+            # Recursive calls are already counted in the time of the caller
+            if callee in stack or callee_time * scale < min_time:
+                continue
+            if labels is not None:
+                callee_labels = labels + (_label(callee, locations),)
+            elif callee[0] in locations:
+                callee_labels = (_label(callee, locations),)
+            else:
+                callee_labels = None
+            pending.append((callee, stack + (callee,), callee_labels,
+                            callee_self_time * scale, callee_time * scale))
+    return result
+
+
+class Profiler:
+    """
+    A plugin profiling the doctests whose node id starts with or matches the
+    given pattern.  The collapsed stacks of the pytest-xdist workers are sent
+    to the controller, which writes them.
+    """
+
+    def __init__(self, config, pattern, directory):
+        self.config = config
+        self.pattern = pattern
+        self.directory = directory
+        # The time spent in each collapsed stack, in seconds
+        self.collapsed = collections.Counter()
+
+    def selected(self, item):
+        return hasattr(item, 'dtest') and (item.nodeid.startswith(self.pattern)
+                                           or fnmatch.fnmatchcase(item.nodeid, self.pattern))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        if not self.selected(item):
+            yield
+            return
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(profile_path(self.directory, item.nodeid))
+
+        stats = pstats.Stats(profile).stats
+        for stack, seconds in collapsed_stacks(stats, example_locations(item.dtest)).items():
+            self.collapsed[';'.join((item.nodeid,) + stack)] += seconds
+
+    def child_output(self):
+        """
+        Return the collapsed stacks recorded since the last call, in a child
+        process of ``--doctest-plus-fork``, and forget them.
+        """
+        collapsed = dict(self.collapsed)
+        self.collapsed.clear()
+        return collapsed
+
+    def merge_child_output(self, collapsed):
+        self.collapsed.update(collapsed)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        self.collapsed.update(getattr(node, 'workeroutput', {}).get('doctestplus_profile', {}))
+
+    def pytest_sessionfinish(self, session):
+        workeroutput = getattr(session.config, 'workeroutput', None)
+        if workeroutput is not None:
+            workeroutput['doctestplus_profile'] = dict(self.collapsed)
+        elif self.collapsed:
+            self.write()
+
+    def write(self):
+        """Write the collapsed stacks, with their time in microseconds."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, COLLAPSED_NAME), 'w', encoding='utf-8') as f:
+            for stack, seconds in sorted(self.collapsed.items()):
+                if round(seconds * 1e6):
+                    f.write(f'{stack} {round(seconds * 1e6)}\n')
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.collapsed and not hasattr(self.config, 'workerinput'):
+            terminalreporter.write_line(
+                f"doctestplus profiles written to {self.directory}, with the collapsed "
+                f"stacks of all of them in {COLLAPSED_NAME}")
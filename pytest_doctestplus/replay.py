@@ -0,0 +1,116 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+Replay of the examples of a doctest that failed in a previous run, together
+with the examples they depend on, before running the whole doctest.
+"""
+import ast
+import hashlib
+
+# The key of the pytest cache holding the failed examples of the tests, as a
+# mapping of the node ids to lists of ``[lineno, source hash]`` pairs.
+FAILED_EXAMPLES_KEY = "doctestplus/failed-examples"
+
+
+def example_key(example):
+    """Return the ``[lineno, source hash]`` pair identifying an example."""
+    return [example.lineno, hashlib.sha1(example.source.encode('utf-8')).hexdigest()]
+
+
+def _base_name(node):
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    if isinstance(node, ast.Name):
+        return node.id
+    return None
+
+
+def example_names(source):
+    """
+    Return the names that the source of an example may define or modify, and
+    those it uses, or `None` if they can not be told.
+
+    This errs on the side of finding too many defined names: besides the
+    names that are assigned, names whose attributes or items are assigned,
+    whose methods are called, or that are passed to a function, are
+    considered as modified.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+
+    defined = set()
+    used = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                used.add(node.id)
+            else:
+                defined.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            defined.add(node.name)
+        elif isinstance(node, ast.alias):
+            if node.name == '*':
+                return None
+            defined.add((node.asname or node.name).split('.')[0])
+        elif isinstance(node, (ast.Attribute, ast.Subscript)):
+            if not isinstance(node.ctx, ast.Load):
+                defined.add(_base_name(node.value))
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Attribute):
+                defined.add(_base_name(node.func.value))
+            for arg in node.args + [keyword.value for keyword in node.keywords]:
+                defined.add(_base_name(arg))
+    defined.discard(None)
+    return defined, used
+
+
+def find_examples(examples, keys):
+    """
+    Return the indices of the examples identified by the ``[lineno, source
+    hash]`` pairs, or `None` if any of them is not found.  If lines were added
+    or removed, the example with the same source closest to the line is used.
+    """
+    hashes = [example_key(example)[1] for example in examples]
+    indices = []
+    for lineno, source_hash in keys:
+        candidates = [i for i, other in enumerate(hashes) if other == source_hash]
+        if not candidates:
+            return None
+        indices.append(min(candidates, key=lambda i: abs(examples[i].lineno - lineno)))
+    return sorted(set(indices))
+
+
+def dependencies(examples, needed=(), names=()):
+    """
+    Return the sorted indices of the examples needed to run the examples with
+    the given indices, or to define the given names, at the end of the
+    examples.
+    """
+    needed = set(needed)
+    wanted = set(names)
+    everything = False
+    for i in range(len(examples) - 1, -1, -1):
+        names = example_names(examples[i].source)
+        if i not in needed:
+            if not (everything or names is None or names[0] & wanted):
+                continue
+            needed.add(i)
+        if names is None:
+            everything = True
+        else:
+            wanted |= names[1]
+    return sorted(needed)
+
+
+def replay_examples(examples, keys):
+    """
+    Return the examples identified by the ``[lineno, source hash]`` pairs,
+    preceded by the examples they depend on, or `None` if the failed examples
+    can not be found.
+    """
+    targets = find_examples(examples, keys)
+    if not targets:
+        return None
+    return [examples[i] for i in dependencies(examples[:targets[-1] + 1], targets)]
@@ -0,0 +1,103 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The machine-readable report of the collection and execution of the doctests,
+written with ``--doctest-plus-report``.
+"""
+import json
+import os
+
+# The messages of the skips inserted by `DocTestFinderPlus`, and of pytest
+# when all the examples of a doctest are skipped
+SKIP_LISTED = 'listed in `__doctest_skip__`'
+SKIP_NOT_IMPORTED = 'could not import '
+SKIP_ALL_EXAMPLES = 'all tests skipped by +SKIP option'
+
+
+def skip_reason(dtest, message):
+    """
+    Return why a doctest was skipped, given the message of the skip: one of
+    ``'directive'``, ``'__doctest_skip__'``, ``'requirement'`` and
+    ``'remote data'``, or ``'other'`` if it was not skipped by doctestplus
+    (e.g. by a marker).
+    """
+    if message.startswith('Skipped: '):
+        message = message[len('Skipped: '):]
+    if message == SKIP_LISTED:
+        return '__doctest_skip__'
+    if message.startswith(SKIP_NOT_IMPORTED):
+        return 'requirement'
+    examples = [example for example in dtest.examples
+                if not getattr(example, '_doctestplus_helper', False)]
+    if message == SKIP_ALL_EXAMPLES and examples:
+        # The reason the parser skipped the first example (not one inserted
+        # by doctestplus); the examples skipped by a ``+SKIP`` flag have none.
+        return getattr(examples[0], '_doctestplus_skip_reason', 'directive')
+    return 'other'
+
+
+def doctest_record(item):
+    """
+    Return the record of a collected doctest item: its location, number of
+    examples, and the time taken by each phase of the collection of its file.
+    """
+    path, lineno, _ = item.location
+    return {
+        'nodeid': item.nodeid,
+        'file': path.replace(os.sep, '/'),
+        'line': None if lineno is None else lineno + 1,
+        'examples': sum(not getattr(example, '_doctestplus_helper', False)
+                        for example in item.dtest.examples),
+        'collection': dict(getattr(item.parent, '_doctestplus_timings', {})),
+    }
+
+
+class DoctestReport:
+    """
+    The records of the collected doctests, completed with the execution time
+    and outcome of the test reports, as they are logged (by the controller,
+    when using pytest-xdist).  The doctests that did not run have no outcome,
+    or the ``deselected`` one.
+    """
+
+    def __init__(self):
+        self.records = {}
+
+    def collect(self, record):
+        """Add the record of a collected doctest, unless it is already known."""
+        self.records.setdefault(record['nodeid'], dict(record, duration=0.0, outcome=None,
+                                                       skip_reason=None))
+
+    def deselect(self, nodeid):
+        record = self.records.get(nodeid)
+        if record is not None:
+            record['outcome'] = 'deselected'
+
+    def add(self, report):
+        record = getattr(report, 'doctestplus_record', None)
+        if record is not None:
+            self.records[report.nodeid] = dict(record, duration=0.0, outcome=None,
+                                               skip_reason=None)
+        record = self.records.get(report.nodeid)
+        if record is None:
+            return
+
+        record['duration'] += report.duration
+        if hasattr(report, 'wasxfail'):
+            record['outcome'] = 'xfailed' if report.skipped else 'xpassed'
+        elif report.failed:
+            record['outcome'] = 'failed'
+        elif report.skipped:
+            record['outcome'] = 'skipped'
+            record['skip_reason'] = getattr(report, 'doctestplus_skip_reason', 'other')
+        elif report.when == 'call':
+            record['outcome'] = 'passed'
+
+    def write(self, path):
+        """Write the records, sorted by node id, as JSON."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        records = [self.records[nodeid] for nodeid in sorted(self.records)]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'doctests': records}, f, indent=1)
+            f.write('\n')
@@ -0,0 +1,129 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+Scheduling of the items run by pytest-xdist workers based on their durations
+in previous runs, as recorded in the pytest cache.
+"""
+import os
+
+from xdist.scheduler import LoadScheduling
+
+from .core import load_durations
+
+# A guess of the time it takes to run the doctests of one byte of a file,
+# only used when there are no recorded durations to derive it from.
+DEFAULT_SECONDS_PER_BYTE = 2e-5
+
+
+def estimate_costs(collection, durations, rootdir):
+    """
+    Estimate the duration of each item of the collection.
+
+    Items that ran before are expected to take as long as they did then.  The
+    others are assumed to take a time proportional to the size of their file,
+    shared between the items of the file, at the rate of the items that ran
+    before.
+    """
+    paths = [nodeid.split("::", 1)[0] for nodeid in collection]
+    items_per_path = {}
+    for path in paths:
+        items_per_path[path] = items_per_path.get(path, 0) + 1
+
+    sizes = {}
+    for path, count in items_per_path.items():
+        try:
+            sizes[path] = os.path.getsize(os.path.join(rootdir, path)) / count
+        except OSError:
+            sizes[path] = 0
+
+    known_time = known_size = 0
+    for nodeid, path in zip(collection, paths):
+        if nodeid in durations:
+            known_time += durations[nodeid]
+            known_size += sizes[path]
+    if known_size and known_time:
+        seconds_per_byte = known_time / known_size
+    else:
+        seconds_per_byte = DEFAULT_SECONDS_PER_BYTE
+
+    return [durations[nodeid] if nodeid in durations else sizes[path] * seconds_per_byte
+            for nodeid, path in zip(collection, paths)]
+
+
+class DurationScheduling(LoadScheduling):
+    """
+    Like the ``load`` scheduling of pytest-xdist, but sending the items to the
+    workers longest first, and only as the workers run out of work, so that
+    each item goes to the least loaded worker.
+
+    The duration of the items is estimated with `estimate_costs`.
+    """
+
+    # The estimated duration of the items, in seconds, to keep queued on each
+    # worker, which hides the latency of sending it the next items.
+    min_queued = 0.1
+
+    def __init__(self, config, log=None):
+        super().__init__(config, log)
+        self.costs = []
+
+    def schedule(self):
+        assert self.collection_is_completed
+
+        # Initial distribution already happened, reschedule on all nodes
+        if self.collection is not None:
+            for node in self.nodes:
+                self.check_schedule(node)
+            return
+
+        if not self._check_nodes_have_same_collection():
+            self.log("**Different tests collected, aborting run**")
+            return
+
+        self.collection = next(iter(self.node2collection.values()))
+        self.costs = estimate_costs(self.collection, load_durations(self.config),
+                                    str(self.config.rootpath))
+        self.pending[:] = sorted(range(len(self.collection)),
+                                 key=self.costs.__getitem__, reverse=True)
+        if not self.collection:
+            return
+
+        # Run each item on its own node if there are enough of them
+        if len(self.pending) <= len(self.nodes):
+            for node in self.nodes:
+                self._send_tests(node, 1)
+                node.shutdown()
+            return
+
+        for node in self.nodes:
+            self.check_schedule(node)
+
+    def check_schedule(self, node, duration=0):
+        if node.shutting_down:
+            return
+
+        if not self.pending:
+            node.shutdown()
+            return
+
+        # Send the longest pending items until the node has enough work
+        # queued, without holding back the other nodes.
+        node_pending = self.node2pending[node]
+        queued = sum(self.costs[index] for index in node_pending)
+        num_send = 0
+        max_send = len(self.pending) // len(self.node2pending) or 1
+        while num_send < max_send and queued < self.min_queued:
+            queued += self.costs[self.pending[num_send]]
+            num_send += 1
+        self._send_tests(node, num_send)
+
+        # The workers only run an item once they know the next one, so pair a
+        # long item with the shortest pending one rather than another long one.
+        if len(node_pending) < 2 and self.pending:
+            index = self.pending.pop()
+            node_pending.append(index)
+            node.send_runtest_some([index])
+
+        if not self.pending:
+            node.shutdown()
+        self.log("num items waiting for node:", len(self.pending))
@@ -8,11 +8,34 @@ This is quite different from the doctest extension in Sphinx itself,
 which actually does something.  For astropy, all of the testing is
 centrally managed from py.test and Sphinx is not used for running
 tests.
+
+With the ``doctestplus_manifest`` configuration value, the extension also
+writes a manifest of the doctests of the documents, relative to the output
+directory, from which pytest can collect them (see the
+``doctest_plus_manifest`` option of pytest).
+
+The ``doctestplus`` builder, or the ``doctestplus_run`` configuration value
+with any other builder, runs the doctests of the documents read by the build
+with pytest and doctestplus, collecting them from the manifest, and writes
+their results as a JUnit XML report.
 """
+import os
 import re
+import subprocess
+import sys
 from docutils.parsers.rst import Directive
+from sphinx.builders import Builder
+from sphinx.util import logging
 from sphinx.util.docutils import SphinxDirective
 
+from .. import output_checker  # noqa: F401  (registers the option flags)
+from ..manifest import parse_entries, text_digest, write_manifest
+
+logger = logging.getLogger(__name__)
+
+# The name of the JUnit XML report of the doctests, in the output directory
+JUNIT_NAME = 'doctestplus-junit.xml'
+
 class NoRunDirective(Directive):
     def run(self):
         # Simply do not add any content when this directive is encountered
@@ -46,6 +69,147 @@ class DoctestAllDirective(NoRunDirective):
     has_content = False
 
 
+def _manifest(env):
+    # The manifest records of the documents, by document name
+    if not hasattr(env, 'doctestplus_manifest'):
+        env.doctestplus_manifest = {}
+    return env.doctestplus_manifest
+
+
+def _manifest_path(app):
+    if app.config.doctestplus_manifest:
+        return os.path.join(app.outdir, app.config.doctestplus_manifest)
+    if app.builder.name == DoctestPlusBuilder.name or app.config.doctestplus_run:
+        return os.path.join(app.doctreedir, 'doctestplus-manifest.json')
+    return None
+
+
+def read_doctests(app, docname, source):
+    """Record the doctests of a document, as it is read."""
+    if _manifest_path(app) is None:
+        return
+    path = str(app.env.doc2path(docname))
+    text = source[0]
+    try:
+        entries = parse_entries(text, os.path.basename(path))
+    except ValueError:
+        # pytest reports the invalid examples, when it parses the file
+        _manifest(app.env).pop(docname, None)
+        return
+    _manifest(app.env)[docname] = {'path': path, 'sha256': text_digest([text]),
+                                   'entries': entries}
+
+
+def purge_doctests(app, env, docname):
+    _manifest(env).pop(docname, None)
+
+
+def merge_doctests(app, env, docnames, other):
+    # Merge the records of the parallel readers
+    records = _manifest(other)
+    _manifest(env).update((docname, records[docname]) for docname in docnames
+                          if docname in records)
+
+
+def _write_manifest(app):
+    path = _manifest_path(app)
+    files = {record['path']: {'sha256': record['sha256'], 'entries': record['entries']}
+             for record in _manifest(app.env).values()}
+    write_manifest(path, files)
+    return path
+
+
+def _warning_options(app):
+    """
+    Return whether the warnings of the build are errors, and whether the build
+    keeps going after the first of them.
+    """
+    if hasattr(app, '_fail_on_warnings'):
+        # Sphinx >= 8.1 always keeps going, and fails at the end of the build
+        return app._fail_on_warnings, True
+    return app.warningiserror, app.keep_going
+
+
+def run_doctests(app):
+    """
+    Run the doctests of the documents with pytest, in ``app.parallel``
+    processes, and write their JUnit XML report in the output directory.
+
+    With ``-W``, the warnings of the doctests are errors as well and, unless
+    the build keeps going, pytest stops at the first failure.  A failure of
+    the doctests is reported as a warning of the build.
+    """
+    manifest_path = _write_manifest(app)
+    records = _manifest(app.env)
+    # The documents read by a previous build, without the manifest, are
+    # parsed by pytest
+    paths = [str(app.env.doc2path(docname)) for docname in sorted(app.env.found_docs)
+             if docname not in records
+             or any('source' in entry for entry in records[docname]['entries'])]
+    if not paths:
+        return
+    junit_path = os.path.join(app.outdir, JUNIT_NAME)
+    args = [sys.executable, '-m', 'pytest', '--doctest-plus',
+            '-o', f'doctest_plus_manifest={manifest_path}', f'--junitxml={junit_path}']
+    args += [f'--doctest-glob=*{suffix}'
+             for suffix in sorted({os.path.splitext(path)[1] for path in paths})]
+    if app.parallel > 1 and hasattr(os, 'fork'):
+        args.append(f'--doctest-plus-fork={app.parallel}')
+    warningiserror, keep_going = _warning_options(app)
+    if warningiserror:
+        args += ['-W', 'error']
+        if not keep_going:
+            args.append('--exitfirst')
+    args += list(app.config.doctestplus_pytest_args) + paths
+
+    logger.info('running the doctests of %d documents with pytest', len(paths))
+    result = subprocess.run(args, cwd=app.srcdir, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    logger.info(result.stdout)
+    # pytest exits with 5 if no tests were collected
+    if result.returncode not in (0, 5):
+        app.statuscode = 1
+        logger.warning('the doctests failed (pytest exited with status %d), see %s',
+                       result.returncode, junit_path)
+
+
+def write_doctests(app, exception):
+    if exception is not None:
+        return
+    if app.builder.name == DoctestPlusBuilder.name or app.config.doctestplus_run:
+        run_doctests(app)
+    elif app.config.doctestplus_manifest:
+        _write_manifest(app)
+
+
+class DoctestPlusBuilder(Builder):
+    """
+    Runs the doctests of the documents with pytest and doctestplus, with the
+    same semantics as ``pytest --doctest-plus``, from the manifest of the
+    doctests recorded as the documents are read.  The doctests run once the
+    build is finished (see `write_doctests`).
+    """
+    name = 'doctestplus'
+    epilog = ('The results of the doctests are in the JUnit XML report '
+              f'%(outdir)s/{JUNIT_NAME}.')
+
+    def get_outdated_docs(self):
+        return self.env.found_docs
+
+    def get_target_uri(self, docname, typ=None):
+        return ''
+
+    def write_documents(self, docnames):
+        # Sphinx >= 8.1
+        pass
+
+    def prepare_writing(self, docnames):
+        pass
+
+    def write_doc(self, docname, doctree):
+        pass
+
+
 def setup(app):
 
     app.add_directive('doctest-requires', DoctestRequiresDirective)
@@ -62,5 +226,15 @@ def setup(app):
     app.add_directive('testsetup', DoctestOmitDirective, override=True)
     app.add_directive('testcleanup', DoctestOmitDirective, override=True)
 
+    app.add_config_value('doctestplus_manifest', None, 'env')
+    app.add_config_value('doctestplus_run', False, 'env')
+    app.add_config_value('doctestplus_pytest_args', [], '')
+    app.add_builder(DoctestPlusBuilder)
+    # Before the other extensions may change the sources
+    app.connect('source-read', read_doctests, priority=100)
+    app.connect('env-purge-doc', purge_doctests)
+    app.connect('env-merge-info', merge_doctests)
+    app.connect('build-finished', write_doctests)
+
     return {'parallel_read_safe': True,
             'parallel_write_safe': True}
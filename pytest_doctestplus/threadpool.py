@@ -0,0 +1,306 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The experimental execution of the doctests in a pool of threads, with
+``--doctest-plus-threads``.  The doctests of each file run in the same thread,
+and the code of pytest (the setup and teardown of the tests, their reports,
+etc.) still runs in one thread at a time: only the examples of the doctests of
+several files run concurrently, which is only faster on free-threaded builds
+of Python, or for doctests waiting on I/O.
+
+While the doctests run in the threads, the capture of the output by pytest is
+suspended, as it swaps `sys.stdout`: `sys.stdout` is a `ThreadStdout`, which
+sends the output of each example to the doctest running it.  Likewise, the
+other functions that the doctest runners swap while they run are replaced by
+`ThreadHooks`, which call those of the doctest run by the current thread.
+
+The doctests using a cassette (``--doctest-plus-cassette``), which patches
+`http.client` while they run, run serially.
+"""
+import doctest
+import linecache
+import pdb
+import queue
+import sys
+import threading
+import warnings
+
+import pytest
+from _pytest.capture import MultiCapture  # Private API
+from _pytest.runner import SetupState  # Private API
+
+from .core import DebugRunnerPlus, uses_cassette
+
+# The marker, and the module variable, of the doctests that run serially, in
+# the main thread
+SERIAL_MARKER = "doctest_serial"
+SERIAL_VARIABLE = "__doctest_serial__"
+
+
+def gil_enabled():
+    """Return whether the GIL is enabled (it always is before Python 3.13)."""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+def is_serial(item):
+    """Return whether an item has to run in the main thread."""
+    return (not hasattr(item, "dtest") or DebugRunnerPlus._generate_diff
+            or item.get_closest_marker(SERIAL_MARKER) is not None
+            or bool(item.dtest.globs.get(SERIAL_VARIABLE, False))
+            or uses_cassette(item))
+
+
+class ThreadStdout:
+    """
+    A standard output writing to the output of the doctest run by the current
+    thread, if any, or else to the ``default`` stream.  It replaces the
+    output of the doctest runners (``_fakeout``), which is swapped with
+    `sys.stdout` while they run.
+    """
+
+    def __init__(self):
+        self.default = None
+        self._local = threading.local()
+
+    def start(self):
+        """Give an output to the doctest run by the current thread."""
+        self._local.out = doctest._SpoofOut()
+
+    def stop(self):
+        self._local.out = None
+
+    @property
+    def _target(self):
+        return getattr(self._local, "out", None) or self.default
+
+    def write(self, text):
+        return self._target.write(text)
+
+    def getvalue(self):
+        return self._local.out.getvalue()
+
+    def truncate(self, size=None):
+        return self._local.out.truncate(size)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class ThreadHooks:
+    """
+    The functions that `doctest.DocTestRunner.run` swaps while it runs
+    (`pdb.set_trace`, `linecache.getlines` and `sys.displayhook`), replaced,
+    once for all the threads, by functions calling those of the doctest run by
+    the current thread, if any, or else the original ones.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._original = self._hooks = None
+
+    def install(self):
+        self._original = (pdb.set_trace, linecache.getlines, sys.displayhook)
+        self._hooks = self._make_hooks()
+        pdb.set_trace, linecache.getlines, sys.displayhook = self._hooks
+
+    def uninstall(self):
+        pdb.set_trace, linecache.getlines, sys.displayhook = self._original
+        self._original = self._hooks = None
+
+    def _make_hooks(self):
+        original_set_trace, original_getlines, original_displayhook = self._original
+
+        def set_trace(*args, **kwargs):
+            debugger_set_trace = getattr(self._local, "set_trace", None)
+            if debugger_set_trace is None:
+                return original_set_trace(*args, **kwargs)
+            # The debugger stops in the caller, as with `pdb.set_trace`
+            return debugger_set_trace(sys._getframe().f_back)
+
+        def getlines(*args, **kwargs):
+            return (getattr(self._local, "getlines", None) or original_getlines)(*args, **kwargs)
+
+        def displayhook(value):
+            return (getattr(self._local, "displayhook", None) or original_displayhook)(value)
+
+        return set_trace, getlines, displayhook
+
+    def start(self, runner):
+        """
+        Give the current thread the functions set by ``runner``, which just
+        swapped them, and install the hooks again.
+        """
+        self._local.set_trace = pdb.set_trace
+        self._local.getlines = linecache.getlines
+        self._local.displayhook = sys.displayhook
+        # The function of the doctest runner calls the original one for the
+        # other files, and then restores the one it saved
+        self._local.saved_getlines = runner.save_linecache_getlines
+        runner.save_linecache_getlines = self._original[1]
+        pdb.set_trace, linecache.getlines, sys.displayhook = self._hooks
+
+    def stop(self, runner):
+        runner.save_linecache_getlines = self._local.saved_getlines
+        self._local.set_trace = self._local.getlines = self._local.displayhook = None
+
+
+class _ThreadSetupState(threading.local):
+    # The state of the setup of the nodes, with a stack of nodes per thread,
+    # each of them added to ``states``
+    def __init__(self, states):
+        self.state = SetupState()
+        states.append(self.state)
+
+    def __getattr__(self, name):
+        return getattr(self.state, name)
+
+
+class ThreadPool:
+    """
+    A plugin running the doctests in ``threads`` threads, one file at a
+    time in each thread.  The other tests, and the doctests marked with
+    ``doctest_serial``, or whose module sets ``__doctest_serial__``, run
+    first, in the main thread.
+    """
+
+    def __init__(self, config, threads):
+        self.config = config
+        self.threads = threads
+        self.stdout = ThreadStdout()
+        self.hooks = ThreadHooks()
+        # Held by the thread running the code of pytest
+        self._lock = threading.Lock()
+        self._pool_threads = set()
+        self._errors = []
+
+    def pytest_report_header(self, config):
+        gil = "enabled" if gil_enabled() else "disabled"
+        return f"doctestplus: running the doctests in {self.threads} threads (GIL {gil})"
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if hasattr(self.config, "workerinput") or session.config.option.collectonly:
+            return None
+        if session.testsfailed and not session.config.option.continue_on_collection_errors:
+            raise session.Interrupted(
+                f"{session.testsfailed} error{'s' if session.testsfailed != 1 else ''} "
+                "during collection")
+
+        serial = []
+        files = {}
+        for item in session.items:
+            if is_serial(item):
+                serial.append(item)
+            else:
+                files.setdefault(item.parent, []).append(item)
+        for item, nextitem in zip(serial, serial[1:] + [None]):
+            item.ihook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+            self._check(session)
+        if files:
+            self._run_threads(session, list(files.values()))
+        self._check(session)
+        return True
+
+    def _run_threads(self, session, files):
+        tasks = queue.SimpleQueue()
+        for items in files:
+            tasks.put(items)
+        threads = [threading.Thread(target=self._work, args=(session, tasks),
+                                    name=f"doctestplus-{i}")
+                   for i in range(min(self.threads, len(files)))]
+
+        capman = self.config.pluginmanager.getplugin("capturemanager")
+        capturing = None
+        if capman is not None:
+            capman.suspend_global_capture()
+            capturing, capman._global_capturing = (capman._global_capturing,
+                                                   MultiCapture(in_=None, out=None, err=None))
+        states = []
+        setupstate, session._setupstate = session._setupstate, _ThreadSetupState(states)
+        filters, showwarning = warnings.filters[:], warnings.showwarning
+        self.stdout.default, sys.stdout = sys.stdout, self.stdout
+        self.hooks.install()
+        try:
+            for thread in threads:
+                thread.start()
+        finally:
+            for thread in threads:
+                thread.join()
+            self.hooks.uninstall()
+            sys.stdout, self.stdout.default = self.stdout.default, None
+            # The warnings filters of the tests are restored in an arbitrary
+            # order by the threads
+            warnings.filters[:], warnings.showwarning = filters, showwarning
+            session._setupstate = setupstate
+            if capman is not None:
+                capman._global_capturing = capturing
+                capman.resume_global_capture()
+            # The nodes above the files (the session, the packages, etc.),
+            # shared by the threads, are torn down once they are all done
+            for state in states:
+                state.teardown_exact(None)
+        if self._errors:
+            raise self._errors[0]
+
+    def _work(self, session, tasks):
+        self._pool_threads.add(threading.get_ident())
+        try:
+            while True:
+                try:
+                    items = tasks.get_nowait()
+                except queue.Empty:
+                    break
+                with self._lock:
+                    self._run(session, items)
+        except BaseException as exc:
+            self._errors.append(exc)
+
+    def _run(self, session, items):
+        # The last item of the file tears down the nodes of the thread up to
+        # the file, as its next item, run by another thread, may not share
+        # them: its "next item" is the parent of the file, whose nodes are
+        # kept (only its ``listchain`` is used by `SetupState.teardown_exact`)
+        parent = items[0].parent.parent
+        for item, nextitem in zip(items, items[1:] + [parent]):
+            if session.shouldfail or session.shouldstop or self._errors:
+                session._setupstate.teardown_exact(parent)
+                return
+            item.ihook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+
+    @pytest.hookimpl(hookwrapper=True, trylast=True)
+    def pytest_runtest_call(self, item):
+        if threading.get_ident() not in self._pool_threads:
+            yield
+            return
+
+        # Only the examples run outside of the lock, with their own output:
+        # the runner swaps the global functions while holding it
+        runner = item.runner
+        fakeout, runner._fakeout = runner._fakeout, self.stdout
+        run_examples = runner._DocTestRunner__run  # Private API
+
+        def run_unlocked(*args, **kwargs):
+            self.hooks.start(runner)
+            self._lock.release()
+            try:
+                return run_examples(*args, **kwargs)
+            finally:
+                self._lock.acquire()
+                self.hooks.stop(runner)
+
+        runner._DocTestRunner__run = run_unlocked
+        self.stdout.start()
+        try:
+            yield
+        finally:
+            self.stdout.stop()
+            del runner._DocTestRunner__run
+            runner._fakeout = fakeout
+
+    @staticmethod
+    def _check(session):
+        if session.shouldfail:
+            raise session.Failed(session.shouldfail)
+        if session.shouldstop:
+            raise session.Interrupted(session.shouldstop)
@@ -0,0 +1,115 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The trace of the collection and execution of the doctests, written with
+``--doctest-plus-trace`` in the trace event format of Chrome, which can be
+loaded in Perfetto (https://ui.perfetto.dev) or ``chrome://tracing``.
+"""
+import json
+import os
+import time
+
+import pytest
+
+
+def _span(name, category, tid, info, **args):
+    # A complete event, whose times are in microseconds
+    return {'name': name, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': tid,
+            'ts': info['start'] * 1e6, 'dur': info['wall'] * 1e6,
+            'args': dict(args, cpu=info['cpu'])}
+
+
+class Tracer:
+    """
+    A plugin recording the spans of the collection and execution of the
+    doctests (through the doctestplus timing hooks) and of the test items,
+    with a track per pytest-xdist worker.  The workers send their spans to
+    the controller, which writes the trace.
+    """
+
+    def __init__(self, config, path):
+        self.path = path
+        workerid = getattr(config, 'workerinput', {}).get('workerid')
+        self.tid = 0 if workerid is None else int(workerid.lstrip('gw')) + 1
+        self.events = []
+        # The outcomes of the reports of the item being run
+        self._outcomes = None
+
+    def pytest_doctestplus_import(self, info):
+        self.events.append(_span('import_path', 'collect', self.tid, info,
+                                 path=str(info['path'])))
+
+    def pytest_doctestplus_find(self, info):
+        self.events.append(_span('find', 'collect', self.tid, info,
+                                 path=str(info['path']), tests=len(info['tests'])))
+
+    def pytest_doctestplus_parse(self, info):
+        self.events.append(_span('parse', 'collect', self.tid, info,
+                                 path=str(info['path']), examples=len(info['examples'])))
+
+    def pytest_doctestplus_requirement(self, info):
+        self.events.append(_span('requirement', 'collect', self.tid, info,
+                                 requirement=info['requirement'],
+                                 available=info.get('available')))
+
+    def pytest_doctestplus_example(self, info):
+        lineno = info['example_lineno']
+        if info['test_lineno'] is not None:
+            lineno += info['test_lineno']
+        source = info['source'].splitlines()[0] if info['source'] else ''
+        self.events.append(_span(
+            source[:60], 'example', self.tid, info, test=info['name'],
+            location=f"{info['filename']}:{lineno + 1}", outcome=info['outcome']))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        self._outcomes = []
+        start = time.time()
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        info = dict(start=start, wall=time.perf_counter() - wall,
+                    cpu=time.process_time() - cpu)
+        outcome = next((outcome for outcome in ('failed', 'skipped')
+                        if outcome in self._outcomes), 'passed')
+        self._outcomes = None
+        self.events.append(_span(item.nodeid, 'item', self.tid, info, outcome=outcome))
+
+    def pytest_runtest_logreport(self, report):
+        if self._outcomes is not None:
+            self._outcomes.append(report.outcome)
+
+    def child_output(self):
+        """
+        Return the spans recorded since the last call, in a child process
+        of ``--doctest-plus-fork``, and forget them.
+        """
+        events, self.events = self.events, []
+        return events
+
+    def merge_child_output(self, events):
+        self.events.extend(events)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        self.events.extend(getattr(node, 'workeroutput', {}).get('doctestplus_trace', []))
+
+    def pytest_sessionfinish(self, session):
+        workeroutput = getattr(session.config, 'workeroutput', None)
+        if workeroutput is not None:
+            workeroutput['doctestplus_trace'] = self.events
+        else:
+            self.write()
+
+    def write(self):
+        """Write the trace, with times relative to its first span."""
+        start = min((event['ts'] for event in self.events), default=0)
+        events = [dict(event, ts=event['ts'] - start) for event in self.events]
+        tids = sorted({event['tid'] for event in events})
+        events[:0] = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0,
+                       'args': {'name': 'pytest'}}] + [
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+             'args': {'name': f'gw{tid - 1}' if tid else 'main'}} for tid in tids]
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
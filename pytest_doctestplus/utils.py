@@ -1,8 +1,5 @@
 import importlib.util
 
-from importlib.metadata import distribution
-from packaging.requirements import Requirement
-
 
 class ModuleChecker:
 
@@ -15,6 +12,10 @@ class ModuleChecker:
 
     def find_distribution(self, dist):
         """Search for distribution with specified version (eg 'numpy>=1.15')."""
+        # These are slow to import, and only needed when a module is missing.
+        from importlib.metadata import distribution
+        from packaging.requirements import Requirement
+
         try:
             reqs = Requirement(dist)
             dist_meta = distribution(reqs.name)
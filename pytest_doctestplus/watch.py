@@ -0,0 +1,293 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The watch mode of ``--doctest-plus-watch``, which runs the tests once, and
+then, until it is interrupted, runs again the doctests of each collected file
+that changes.
+
+The pytest process, which imported the modules used by the doctests during the
+collection, never runs the tests: each run is a child process forked from it,
+which starts with these modules already imported, collects the changed files
+again (after removing their modules from `sys.modules`), and runs their
+doctests.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+from pathlib import Path
+
+import pytest
+from _pytest import timing  # Private API
+
+# The interval between two scans of the files by `PollingWatcher`, and the
+# delay to wait for the other changes of a save (of several files, or of a
+# file renamed over another) before reporting them
+POLL_INTERVAL = 0.5
+SETTLE_DELAY = 0.1
+
+# The inotify events of a file being written, or moved over another one
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """Watch files for changes by comparing their modification times."""
+
+    def __init__(self, paths, interval=POLL_INTERVAL):
+        self.paths = {Path(path) for path in paths}
+        self.interval = interval
+        self._stats = {path: self._stat(path) for path in self.paths}
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _scan(self):
+        changed = set()
+        for path in self.paths:
+            stat = self._stat(path)
+            if stat != self._stats[path]:
+                self._stats[path] = stat
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Wait for some files to change, and return their paths, or an empty
+        set if none changed within ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self._scan()
+            if changed:
+                time.sleep(SETTLE_DELAY)
+                return changed | self._scan()
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Watch files for changes with inotify, on Linux.  The directories of the
+    files are watched, to see the files that editors replace when saving them.
+    """
+
+    def __init__(self, paths):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.paths = {Path(path).absolute() for path in paths}
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = {}
+        try:
+            for directory in {path.parent for path in self.paths}:
+                wd = libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                            _IN_CLOSE_WRITE | _IN_MOVED_TO)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"cannot watch {directory}")
+                self._directories[wd] = directory
+        except BaseException:
+            self.close()
+            raise
+
+    def _read(self, timeout):
+        # Return the watched files of the events read within the timeout
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        data = os.read(self.fd, 1 << 16)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            path = self._directories[wd] / os.fsdecode(name)
+            if path in self.paths:
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Wait for some files to change, and return their paths, or an empty
+        set if none changed within ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            changed = self._read(remaining)
+            if changed:
+                while True:
+                    more = self._read(SETTLE_DELAY)
+                    if not more:
+                        return changed
+                    changed |= more
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def make_watcher(paths):
+    """Return an `InotifyWatcher` of the files, or a `PollingWatcher` without inotify."""
+    try:
+        return InotifyWatcher(paths)
+    except (OSError, AttributeError):
+        # Not on Linux, no inotify functions in the C library, or too many
+        # watches
+        return PollingWatcher(paths)
+
+
+def collect_again(session, paths, keep=None):
+    """
+    Collect the doctests of files again, with new nodes, after removing
+    their modules from `sys.modules`, and make them (or those for which
+    ``keep(item)`` is true) the items of the session, in a process forked
+    after the collection.
+    """
+    config = session.config
+    paths = {Path(path) for path in paths}
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, "__file__", None)
+        if module_file and Path(module_file) in paths:
+            del sys.modules[name]
+
+    terminal = config.pluginmanager.getplugin("terminalreporter")
+    if terminal is not None:
+        # The outcomes, and the duration, of this run only (private API)
+        terminal.stats.clear()
+        if hasattr(terminal, "_session_start"):
+            terminal._session_start = timing.Instant()
+        else:
+            terminal._sessionstarttime = timing.time()
+
+    session.testsfailed = 0
+    items = []
+    for path in sorted(paths):
+        if not path.is_file():
+            continue
+        ihook = session.gethookproxy(path)
+        for collector in ihook.pytest_collect_file(file_path=path, parent=session):
+            items.extend(item for item in session.genitems(collector)
+                         if hasattr(item, "dtest") and (keep is None or keep(item)))
+    config.hook.pytest_collection_modifyitems(session=session, config=config, items=items)
+    session.items = items
+    session.testscollected = len(items)
+
+
+def run_session(session):
+    """
+    Run the items of a session, and finish it, like `_pytest.main.wrap_session`,
+    in a process forked after the collection.  Return the exit status.
+    """
+    config = session.config
+    try:
+        config.hook.pytest_runtestloop(session=session)
+        if session.testsfailed:
+            status = pytest.ExitCode.TESTS_FAILED
+        elif session.testscollected == 0:
+            status = pytest.ExitCode.NO_TESTS_COLLECTED
+        else:
+            status = pytest.ExitCode.OK
+    except session.Failed:
+        status = pytest.ExitCode.TESTS_FAILED
+    except KeyboardInterrupt:
+        config.hook.pytest_keyboard_interrupt(excinfo=pytest.ExceptionInfo.from_current())
+        status = pytest.ExitCode.INTERRUPTED
+    config.hook.pytest_sessionfinish(session=session, exitstatus=status)
+    config._ensure_unconfigure()
+    return status
+
+
+class Watch:
+    """
+    A plugin running the tests in a child process forked from this one, and
+    then, each time some of the collected files change, their doctests in a
+    new child, until it is interrupted.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._child = False
+        # The files that failed to be collected, which are watched too
+        self._failed_paths = set()
+
+    def pytest_collectreport(self, report):
+        if report.failed and report.fspath:
+            path = self.config.rootpath / report.fspath
+            if path.is_file():
+                self._failed_paths.add(path)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if self._child or session.config.option.collectonly:
+            return None
+
+        paths = ({Path(item.path) for item in session.items if hasattr(item, "dtest")}
+                 | self._failed_paths)
+        terminal = self.config.pluginmanager.getplugin("terminalreporter")
+        # Watched from before the first run, not to miss the changes made
+        # while it runs
+        watcher = make_watcher(paths)
+        try:
+            self._fork(session, None)
+            while True:
+                if terminal is not None:
+                    terminal.write_line(
+                        f"doctestplus: watching {len(paths)} "
+                        f"file{'s' if len(paths) != 1 else ''} for changes (Ctrl-C to stop)")
+                self._fork(session, watcher.wait())
+        except KeyboardInterrupt:
+            raise session.Interrupted("stopped watching for changes") from None
+        finally:
+            watcher.close()
+
+    def _fork(self, session, changed):
+        # Run the tests, or the doctests of the changed files, in a child
+        pid = os.fork()
+        if pid == 0:
+            self._child = True
+            status = pytest.ExitCode.INTERNAL_ERROR
+            try:
+                status = self._run(session, changed)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(int(status))
+        try:
+            os.waitpid(pid, 0)
+        except KeyboardInterrupt:
+            # The child is interrupted too, and reports it
+            os.waitpid(pid, 0)
+            raise
+
+    def _run(self, session, changed):
+        if changed is not None:
+            terminal = self.config.pluginmanager.getplugin("terminalreporter")
+            if terminal is not None:
+                names = ", ".join(sorted(os.path.relpath(path, self.config.rootpath)
+                                         for path in changed))
+                terminal.write_sep("=", f"changed: {names}")
+            collect_again(session, changed)
+        return run_session(session)
@@ -0,0 +1,411 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+The execution of the doctests in child processes forked from the pytest
+process, with ``--doctest-plus-fork``.  The pytest process, which imported the
+modules of the ``doctest_plus_preload`` option once, and collected the tests,
+is the "zygote" of the children: they share its memory copy-on-write, so they
+start without importing anything, and their changes to the global state are
+discarded when they exit.
+
+The plugins of doctestplus that record something while the tests run (e.g.
+the spans of ``--doctest-plus-trace``) have a ``child_output`` method, which
+returns, in a child, what they recorded since it was last called, and a
+``merge_child_output`` method, which merges it in the pytest process.  The
+children send it with the reports of each test, and when each example starts,
+not to lose it if the child dies in the middle of a test.
+
+Each child runs the tests sent by the pytest process (by their index in
+``session.items``), up to ``doctest_plus_fork_max_items`` tests, or until its
+peak memory reaches ``doctest_plus_fork_max_memory``, and then exits, to be
+replaced by a new child.  The address space and the CPU time of each test are
+limited by ``doctest_plus_memory_limit`` and ``doctest_plus_cpu_limit``.
+"""
+import importlib
+import json
+import math
+import os
+import re
+import resource
+import selectors
+import signal
+import sys
+import traceback
+
+import pytest
+from _pytest.runner import runtestprotocol  # Private API, also used by pytest-forked
+
+from .core import DebugRunnerPlus
+from .diff import ChangesetSpool
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+# The file descriptors of the pipes of the children, in the pytest process,
+# which each new child closes
+_parent_fds = set()
+
+
+def preload(modules):
+    """Import the given modules, to share them with the forked children."""
+    for name in modules:
+        importlib.import_module(name)
+
+
+def parse_size(value, name):
+    """Return the number of bytes of a size such as ``512M``, or None if it is empty."""
+    if not value:
+        return None
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?)B?\s*", str(value), re.IGNORECASE)
+    if match is None:
+        raise pytest.UsageError(f"invalid {name}: {value!r} (expected a size such as 512M)")
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]
+
+
+def parse_seconds(value, name):
+    """Return the number of seconds of a duration, or None if it is empty."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+        if seconds <= 0:
+            raise ValueError
+    except ValueError:
+        raise pytest.UsageError(
+            f"invalid {name}: {value!r} (expected a number of seconds)") from None
+    return seconds
+
+
+def peak_memory():
+    """Return the peak resident memory of this process, in bytes."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In kilobytes, except on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def example_location(test, example):
+    """Return the file name and line (1-based) of an example of a doctest."""
+    return f"{test.filename}:{(test.lineno or 0) + example.lineno + 1}"
+
+
+def child_output_plugins(config):
+    """
+    Return the plugins recording something in the children, with a
+    ``child_output`` method, by name.
+    """
+    pluginmanager = config.pluginmanager
+    return {pluginmanager.get_name(plugin): plugin for plugin in pluginmanager.get_plugins()
+            if hasattr(plugin, "child_output") and pluginmanager.get_name(plugin)}
+
+
+def _set_soft_limit(limit, value):
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, hard))
+
+
+def _serve(session, commands, results, memory_limit, cpu_limit):
+    # Run the items sent by the pytest process in the child, send the location
+    # of each example it starts, and the reports of each item, through the
+    # pipe, and exit without running any cleanup of the parent.
+    config = session.config
+    out = open(results, "wb")
+
+    def send(message):
+        out.write(json.dumps(message).encode("utf-8") + b"\n")
+        out.flush()
+
+    try:
+        capman = config.pluginmanager.getplugin("capturemanager")
+        if capman is not None:
+            # The output of the child is captured in its own files, rather
+            # than in those shared with the pytest process
+            capman.stop_global_capturing()
+            capman.start_global_capturing()
+            capman.suspend_global_capture()
+        plugins = child_output_plugins(config)
+        for plugin in plugins.values():
+            # What the pytest process recorded before the fork
+            plugin.child_output()
+
+        def plugins_output():
+            output = {}
+            for name, plugin in plugins.items():
+                data = plugin.child_output()
+                if data:
+                    output[name] = data
+            return output
+
+        spool = DebugRunnerPlus._spool
+        if spool is not None:
+            DebugRunnerPlus._spool = ChangesetSpool(spool.directory,
+                                                    f"{spool.name}-{os.getpid()}")
+        # With what the plugins recorded in the previous examples, which
+        # would be lost if the child crashed in this one
+        DebugRunnerPlus._example_started = (
+            lambda test, example: send({"example": example_location(test, example),
+                                        "plugins": plugins_output()}))
+        if memory_limit is not None:
+            _set_soft_limit(resource.RLIMIT_AS, memory_limit)
+
+        with open(commands, "rb") as f:
+            for line in f:
+                item = session.items[int(line)]
+                if cpu_limit is not None:
+                    # The limit applies to the CPU time of the whole process
+                    usage = resource.getrusage(resource.RUSAGE_SELF)
+                    _set_soft_limit(resource.RLIMIT_CPU,
+                                    math.ceil(usage.ru_utime + usage.ru_stime + cpu_limit))
+                reports = runtestprotocol(item, nextitem=None, log=False)
+                send({"reports": [config.hook.pytest_report_to_serializable(config=config,
+                                                                            report=report)
+                                  for report in reports],
+                      "memory": peak_memory(), "plugins": plugins_output()})
+    except BaseException:
+        try:
+            send({"error": traceback.format_exc()})
+        except BaseException:
+            pass
+    finally:
+        os._exit(0)
+
+
+def failed_report(item, message):
+    """Return the report of a test whose process did not report its outcome."""
+    return pytest.TestReport(item.nodeid, item.location, {name: 1 for name in item.keywords},
+                             "failed", message, "call")
+
+
+def exit_message(status):
+    """Describe how a child process, which did not report, exited."""
+    code = os.waitstatus_to_exitcode(status)
+    if code == -signal.SIGXCPU:
+        return "the process running the test exceeded its CPU time limit"
+    if code < 0:
+        return f"the process running the test was killed by {signal.Signals(-code).name}"
+    return f"the process running the test exited with status {code}"
+
+
+class ForkedChild:
+    """A child process forked from this one, running the test items it is sent."""
+
+    def __init__(self, session, memory_limit=None, cpu_limit=None):
+        command_read, command_write = os.pipe()
+        result_read, result_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            for fd in _parent_fds | {command_write, result_read}:
+                os.close(fd)
+            _serve(session, command_read, result_write, memory_limit, cpu_limit)
+        os.close(command_read)
+        os.close(result_write)
+        _parent_fds.update((command_write, result_read))
+        self.pid = pid
+        self.config = session.config
+        self.fd = result_read
+        self._commands = command_write
+        self._buffer = b""
+        # The item being run, the location of its latest example, the
+        # number of items run and the peak memory of the child
+        self.item = None
+        self.example = None
+        self.items = 0
+        self.memory = 0
+
+    def start(self, item, index):
+        """Send an item to run, by its index in the items of the session."""
+        self.item = item
+        self.example = None
+        self.items += 1
+        os.write(self._commands, f"{index}\n".encode("ascii"))
+
+    def read(self):
+        """
+        Read the available messages of the child, and return the reports of
+        the item, once it is done, or None.  The child exited if it sent no
+        reports and ``self.fd`` is None.
+        """
+        chunk = os.read(self.fd, 1 << 16)
+        if not chunk:
+            return self._exited()
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            message = json.loads(line.decode("utf-8"))
+            self._merge(message.get("plugins", {}))
+            if "example" in message:
+                self.example = message["example"]
+            elif "error" in message:
+                item, self.item = self.item, None
+                self._close()
+                return [failed_report(item, message["error"])]
+            else:
+                item, self.item = self.item, None
+                self.memory = message["memory"]
+                config = item.config
+                return [config.hook.pytest_report_from_serializable(config=config, data=report)
+                        for report in message["reports"]]
+        return None
+
+    def _merge(self, output):
+        # Merge what the plugins recorded in the child
+        for name, data in output.items():
+            plugin = self.config.pluginmanager.get_plugin(name)
+            if plugin is not None:
+                plugin.merge_child_output(data)
+
+    def _exited(self):
+        # The child exited, or died, before reporting the outcome of its item
+        status = self._close()
+        if self.item is None:
+            return None
+        message = exit_message(status)
+        if self.example is not None:
+            message += f", while running the example at {self.example}"
+        item, self.item = self.item, None
+        return [failed_report(item, message)]
+
+    def _close(self):
+        for fd in (self.fd, self._commands):
+            if fd is not None:
+                os.close(fd)
+                _parent_fds.discard(fd)
+        self.fd = self._commands = None
+        _, status = os.waitpid(self.pid, 0)
+        return status
+
+    def close(self):
+        """Let the child exit, once it is done with its item."""
+        if self.fd is not None:
+            os.close(self._commands)
+            _parent_fds.discard(self._commands)
+            self._commands = None
+            while self.fd is not None:
+                self.read()
+
+    def kill(self):
+        if self.fd is not None:
+            os.kill(self.pid, signal.SIGKILL)
+            self.item = None
+            self._close()
+
+
+def log_reports(item, reports):
+    """Log the reports of a test, as if it had run in this process."""
+    item.ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+    for report in reports:
+        item.ihook.pytest_runtest_logreport(report=report)
+    item.ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+
+
+class Zygote:
+    """
+    A plugin running each doctest item in a child process forked from this
+    one, up to ``processes`` at a time.  In the pytest-xdist workers, the
+    doctests run one at a time, in children forked from each worker.
+    """
+
+    def __init__(self, config, processes):
+        self.config = config
+        self.processes = processes
+        try:
+            self.max_items = int(config.getini("doctest_plus_fork_max_items") or 0)
+        except ValueError:
+            raise pytest.UsageError("invalid doctest_plus_fork_max_items: "
+                                    f"{config.getini('doctest_plus_fork_max_items')!r}") from None
+        self.max_memory = parse_size(config.getini("doctest_plus_fork_max_memory"),
+                                     "doctest_plus_fork_max_memory")
+        self.memory_limit = parse_size(config.getini("doctest_plus_memory_limit"),
+                                       "doctest_plus_memory_limit")
+        self.cpu_limit = parse_seconds(config.getini("doctest_plus_cpu_limit"),
+                                       "doctest_plus_cpu_limit")
+        self._idle = []
+        self._indices = None
+
+    def _start(self, session, item):
+        # Start running an item in an idle child, or in a new one
+        if self._indices is None:
+            self._indices = {id(item): index for index, item in enumerate(session.items)}
+        child = (self._idle.pop() if self._idle
+                 else ForkedChild(session, self.memory_limit, self.cpu_limit))
+        child.start(item, self._indices[id(item)])
+        return child
+
+    def _done(self, child):
+        # Reuse the child that ran an item, unless it has to be recycled
+        if child.fd is None:
+            return
+        if ((self.max_items and child.items >= self.max_items)
+                or (self.max_memory and child.memory >= self.max_memory)):
+            child.close()
+        else:
+            self._idle.append(child)
+
+    def pytest_sessionfinish(self, session):
+        while self._idle:
+            self._idle.pop().close()
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        if not hasattr(item, "dtest"):
+            return None
+        child = self._start(item.session, item)
+        reports = None
+        while reports is None:
+            reports = child.read()
+        self._done(child)
+        log_reports(item, reports)
+        return True
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if (self.processes <= 1 or hasattr(self.config, "workerinput")
+                or session.config.option.collectonly):
+            return None
+        if session.testsfailed and not session.config.option.continue_on_collection_errors:
+            raise session.Interrupted(
+                f"{session.testsfailed} error{'s' if session.testsfailed != 1 else ''} "
+                "during collection")
+
+        # The other tests run in this process, while the doctests run in the
+        # children
+        others = [item for item in session.items if not hasattr(item, "dtest")]
+        nextitems = dict(zip(others, others[1:]))
+        selector = selectors.DefaultSelector()
+        try:
+            for item in session.items:
+                if not hasattr(item, "dtest"):
+                    item.ihook.pytest_runtest_protocol(item=item, nextitem=nextitems.get(item))
+                    self._check(session)
+                    continue
+                while len(selector.get_map()) >= self.processes:
+                    self._wait(session, selector)
+                child = self._start(session, item)
+                selector.register(child.fd, selectors.EVENT_READ, child)
+            while selector.get_map():
+                self._wait(session, selector)
+        finally:
+            for key in list(selector.get_map().values()):
+                key.data.kill()
+            selector.close()
+        return True
+
+    def _wait(self, session, selector):
+        # Read what the children sent, and log the reports of those that are done
+        for key, _ in selector.select():
+            child = key.data
+            item = child.item
+            reports = child.read()
+            if child.fd is None or reports is not None:
+                selector.unregister(key.fd)
+            if reports is not None:
+                self._done(child)
+                log_reports(item, reports)
+                self._check(session)
+
+    @staticmethod
+    def _check(session):
+        if session.shouldfail:
+            raise session.Failed(session.shouldfail)
+        if session.shouldstop:
+            raise session.Interrupted(session.shouldstop)
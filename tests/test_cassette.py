@@ -0,0 +1,131 @@
+import http.client
+import http.server
+import json
+import os
+import threading
+import urllib.request
+
+import pytest
+
+from pytest_doctestplus.cassette import Cassette, CassetteError, cassette_path
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/binary':
+            body = bytes(range(256))
+        else:
+            body = f'data at {self.path}'.encode()
+        if self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in (body[:4], body[4:]):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.upper())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def _fetch(url):
+    results = []
+    for path in ('/data', '/binary', '/chunked', '/data'):
+        with urllib.request.urlopen(url + path) as response:
+            results.append((response.status, response.read()))
+    request = urllib.request.Request(url + '/echo', data=b'some data')
+    with urllib.request.urlopen(request) as response:
+        results.append((response.status, response.read()))
+
+    host, port = url.split('//')[1].split(':')
+    connection = http.client.HTTPConnection(host, int(port))
+    for path in ('/data', '/other'):
+        connection.request('GET', path)
+        results.append(connection.getresponse().read())
+    connection.close()
+    return results
+
+
+def test_record_replay(server, tmp_path):
+    path = str(tmp_path / 'cassette.json')
+    expected = _fetch(server)
+
+    with Cassette(path, 'record') as cassette:
+        assert _fetch(server) == expected
+    cassette.save()
+    with open(path) as f:
+        assert len(json.load(f)['interactions']) == 7
+
+    with Cassette(path, 'replay'):
+        assert _fetch(server) == expected
+        with pytest.raises(CassetteError):
+            _fetch(server.replace('127.0.0.1', 'localhost'))
+
+    # The connections are restored
+    assert _fetch(server) == expected
+
+
+def test_replay_offline(server, tmp_path):
+    path = str(tmp_path / 'cassette.json')
+    with Cassette(path, 'record') as cassette:
+        expected = _fetch(server)
+    cassette.save()
+
+    offline = 'http://127.0.0.1:9'
+    with Cassette(path, 'replay'):
+        with pytest.raises(CassetteError, match='no recorded response to GET'):
+            _fetch(offline)
+
+    with open(path) as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text.replace(server, offline))
+    with Cassette(path, 'replay'):
+        assert _fetch(offline) == expected
+
+
+def test_requests(server, tmp_path):
+    requests = pytest.importorskip('requests')
+    path = str(tmp_path / 'cassette.json')
+
+    with Cassette(path, 'record') as cassette:
+        session = requests.Session()
+        expected = [session.get(server + '/data').text,
+                    session.post(server + '/echo', data=b'abc').text]
+    cassette.save()
+
+    with Cassette(path, 'replay'):
+        session = requests.Session()
+        assert [session.get(server + '/data').text,
+                session.post(server + '/echo', data=b'abc').text] == expected
+        with pytest.raises(CassetteError):
+            session.post(server + '/echo', data=b'other')
+
+
+def test_cassette_path():
+    assert (cassette_path('cassettes', 'docs/data.rst::data.rst')
+            == os.path.join('cassettes', 'docs_data.rst_data.rst.json'))
@@ -0,0 +1,47 @@
+import doctest
+import math
+import pickle
+
+from pytest_doctestplus.checkpoint import CheckpointStore, dump_namespace, examples_digests
+
+
+def test_dump_namespace():
+    data = [1, 2]
+    globs = {'__builtins__': {}, 'math': math, 'data': data, 'alias': data,
+             'gen': (i for i in range(2)), 'f': lambda: 1}
+    pickled, missing = dump_namespace(globs)
+
+    values = pickle.loads(pickled)
+    assert sorted(missing) == ['f', 'gen']
+    assert sorted(values) == ['alias', 'data', 'math']
+    assert values['math'] is math
+    assert values['data'] == [1, 2]
+    assert values['alias'] is values['data']
+
+
+def test_examples_digests():
+    examples = [doctest.Example('x = 1\n', ''), doctest.Example('x\n', '1\n')]
+    digests = examples_digests(examples)
+    assert len(digests) == 3
+
+    # The digests change from the first changed example on
+    examples[1] = doctest.Example('x\n', '2\n')
+    changed = examples_digests(examples)
+    assert changed[:2] == digests[:2]
+    assert changed[2] != digests[2]
+
+    examples[1] = doctest.Example('x\n', '2\n', options={doctest.ELLIPSIS: True})
+    assert examples_digests(examples)[2] != changed[2]
+
+
+def test_checkpoint_store(tmp_path):
+    store = CheckpointStore(tmp_path / 'test')
+    assert store.restore([1, 3], ['a', 'b', 'c', 'd']) is None
+
+    store.save(1, 'b', {'x': 1})
+    store.save(3, 'd', {'x': 2, 'f': lambda: 1})
+    assert store.restore([1, 3], ['a', 'b', 'c', 'd']) == (3, {'x': 2}, ['f'])
+
+    # Checkpoints after a change are removed
+    assert store.restore([1, 3], ['a', 'b', 'c', 'changed']) == (1, {'x': 1}, [])
+    assert sorted(path.name for path in (tmp_path / 'test').iterdir()) == ['1.pickle']
@@ -0,0 +1,37 @@
+from pytest_doctestplus.client import find_socket
+from pytest_doctestplus.daemon import SOCKET_NAME, is_selected, select_files
+
+
+def test_select_files(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    known = {docs / "index.rst", docs / "api.rst", tmp_path / "module.py"}
+
+    assert select_files(known, tmp_path, []) == dict.fromkeys(known)
+    assert select_files(known, docs, ["."]) == {docs / "index.rst": None, docs / "api.rst": None}
+    assert select_files(known, docs, ["new.rst"]) == {docs / "new.rst": None}
+    assert select_files(known, docs, ["../module.py::module.f", "../module.py::module.C"]) == {
+        tmp_path / "module.py": {"module.f", "module.C"}}
+    # A whole file selects all its doctests
+    assert select_files(known, tmp_path, ["module.py::module.f", "module.py"]) == {
+        tmp_path / "module.py": None}
+    assert select_files(known, tmp_path, ["module.py", "module.py::module.f"]) == {
+        tmp_path / "module.py": None}
+
+
+def test_is_selected():
+    class Item:
+        name = "module.C.method"
+
+    assert is_selected(Item, None)
+    assert is_selected(Item, {"module.C"})
+    assert is_selected(Item, {"module.f", "module.C.method"})
+    assert not is_selected(Item, {"module.f", "module.Cl"})
+
+
+def test_find_socket(tmp_path):
+    subdirectory = tmp_path / "docs" / "api"
+    subdirectory.mkdir(parents=True)
+    (tmp_path / SOCKET_NAME).touch()
+    assert find_socket(subdirectory) == tmp_path / SOCKET_NAME
+    assert find_socket(tmp_path) == tmp_path / SOCKET_NAME
@@ -0,0 +1,141 @@
+import os
+import shutil
+import stat
+import subprocess
+
+import pytest
+
+from pytest_doctestplus.diff import (ChangesetSpool, apply_changes, atomic_write,
+                                     process_changesets, read_lines, unified_diff)
+
+
+SOURCE = """\
+def f():
+    '''
+    >>> print(2)
+    4
+    >>> for i in range(4):
+    ...     print(i)
+    1
+    2
+    '''
+    pass
+
+
+x = 1
+y = 2
+z = 3
+
+
+class A:
+    '''
+    >>> print(3)
+    5
+    '''
+"""
+
+
+def _change(test_lineno, example_lineno, source, want, got):
+    return dict(use=True, name='f', filename='', source=source, nindent=0,
+                want=want, got=got, test_lineno=test_lineno,
+                example_lineno=example_lineno)
+
+
+CHANGES = [
+    _change(1, 1, 'print(2)\n', '4\n', '2\n'),
+    _change(1, 3, 'for i in range(4):\n    print(i)\n', '1\n2\n', '0\n1\n2\n3\n'),
+    _change(18, 1, 'print(3)\n', '5\n', '3\n'),
+]
+
+
+def test_apply_changes():
+    lines = SOURCE.splitlines(keepends=True)
+    new_lines, edits, bad_tests = apply_changes(lines, CHANGES)
+
+    assert bad_tests == []
+    assert [edit[:2] for edit in edits] == [(3, 4), (6, 8), (20, 21)]
+    assert ''.join(new_lines) == (SOURCE.replace('    4\n', '    2\n')
+                                  .replace('    1\n    2\n', '    0\n    1\n    2\n    3\n')
+                                  .replace('    5\n', '    3\n'))
+
+
+def test_apply_changes_unknown_lineno():
+    lines = SOURCE.splitlines(keepends=True)
+    new_lines, edits, bad_tests = apply_changes(
+        lines, [_change(None, 1, 'print(2)\n', '4\n', '2\n')])
+    assert bad_tests == ['f']
+    assert new_lines == lines
+    assert edits == []
+
+
+@pytest.mark.skipif(shutil.which('git') is None, reason='requires git')
+@pytest.mark.parametrize('trailing_newline', [True, False])
+def test_unified_diff_matches_git(tmp_path, trailing_newline):
+    source = SOURCE if trailing_newline else SOURCE + "    # end"
+    fname = tmp_path / 'original.py'
+    fname.write_text(source)
+    data, lines = read_lines(str(fname))
+    new_lines, edits, _ = apply_changes(lines, CHANGES)
+
+    modified = tmp_path / 'modified.py'
+    modified.write_text(''.join(new_lines))
+    expected = subprocess.run(
+        ['git', 'diff', '-p', '--no-index', 'original.py', 'modified.py'],
+        cwd=tmp_path, stdout=subprocess.PIPE, encoding='utf-8').stdout
+    expected = expected.replace('modified.py', 'original.py')
+
+    diff = unified_diff('original.py', data, lines, new_lines, edits)
+    assert diff == expected
+    # Comparing the complete files gives the same result
+    assert unified_diff('original.py', data, lines, new_lines) == expected
+
+
+def test_unified_diff_no_changes():
+    lines = SOURCE.splitlines(keepends=True)
+    assert unified_diff('original.py', SOURCE.encode(), lines, lines, []) == ''
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='permission bits are not supported')
+def test_atomic_write_keeps_permissions(tmp_path):
+    fname = tmp_path / 'script.py'
+    fname.write_text('old\n')
+    fname.chmod(0o755)
+
+    atomic_write(str(fname), 'new\n')
+
+    assert fname.read_text() == 'new\n'
+    assert stat.S_IMODE(fname.stat().st_mode) == 0o755
+    assert os.listdir(tmp_path) == ['script.py']
+
+
+def test_process_changesets_overwrite(tmp_path):
+    changesets = []
+    for i in range(10):
+        fname = tmp_path / f'file{i}.py'
+        fname.write_text(SOURCE)
+        changesets.append((str(fname), CHANGES))
+
+    results = list(process_changesets(changesets, overwrite=True))
+
+    assert [result[0] for result in results] == [fname for fname, _ in changesets]
+    expected = ''.join(apply_changes(SOURCE.splitlines(keepends=True), CHANGES)[0])
+    for fname, _ in changesets:
+        with open(fname) as f:
+            assert f.read() == expected
+
+
+def test_changeset_spool(tmp_path):
+    workers = [ChangesetSpool(str(tmp_path), name) for name in ('gw0', 'gw1')]
+    for i, change in enumerate(CHANGES):
+        for fname in ('b.py', 'a.py'):
+            workers[i % 2].append(dict(change, filename=fname))
+    for spool in workers:
+        spool.close()
+
+    changesets = list(ChangesetSpool(str(tmp_path)).changesets())
+
+    assert [fname for fname, _ in changesets] == ['a.py', 'b.py']
+    for fname, changes in changesets:
+        key = sorted((c['test_lineno'], c['example_lineno']) for c in changes)
+        assert key == sorted((c['test_lineno'], c['example_lineno']) for c in CHANGES)
+        assert all(c['filename'] == fname for c in changes)
@@ -1,6 +1,17 @@
+import asyncio
+import functools
+import gc
 import glob
+import http.server
+import io
+import json
+import linecache
 import os
+import pdb
+import signal
+import subprocess
 import sys
+import threading
 from platform import python_version
 from textwrap import dedent
 
@@ -9,7 +20,7 @@ from packaging.version import Version
 import pytest
 
 import doctest
-from pytest_doctestplus.output_checker import OutputChecker, FLOAT_CMP
+from pytest_doctestplus.output_checker import OutputChecker, ARRAY_CMP, FLOAT_CMP
 
 try:
     import pytest_asyncio  # noqa: F401
@@ -374,6 +385,234 @@ class TestFloats:
         )
 
 
+def test_array_cmp(testdir):
+    pytest.importorskip('numpy')
+    testdir.makeini(
+        """
+        [pytest]
+        doctestplus = enabled
+    """
+    )
+    p = testdir.makepyfile(
+        """
+        def f():
+            '''
+            >>> import numpy as np
+            >>> np.linspace(0, 1, 4)  # doctest: +ARRAY_CMP
+            array([0.      , 0.333333, 0.666667, 1.      ])
+            >>> np.ma.masked_array(np.eye(2) / 3, mask=np.eye(2))  # doctest: +ARRAY_CMP
+            masked_array(
+              data=[[--, 0.0],
+                    [0.0, --]],
+              mask=[[ True, False],
+                    [False,  True]],
+              fill_value=1e+20)
+            '''
+        def g():
+            '''
+            >>> import numpy as np
+            >>> np.arange(4)  # doctest: +ARRAY_CMP
+            array([0., 1., 2., 3.])
+            '''
+    """
+    )
+    reprec = testdir.inline_run(p, "--doctest-plus")
+    reprec.assertoutcome(failed=1, passed=1)
+
+
+class TestArrays:
+    def setup_method(self, method):
+        pytest.importorskip('numpy')
+        self.c = OutputChecker()
+
+    def test_parse_array(self):
+        values, mask = self.c.parse_array('[[ 1.e+00 +2.j, nan+nanj],\n [--, 0.j]]')
+        assert values.shape == (2, 2)
+        assert values.dtype.kind == 'c'
+        assert mask.tolist() == [[False, False], [True, False]]
+
+        for text in ('[[1, 2], [3]]', '[[1], [2, 3]]', '[0, 1, ..., 9]',
+                     "['a', 'b']", '[[1, 2]', '1.'):
+            assert self.c.parse_array(text) is None
+
+    def test_compare_arrays(self):
+        want = "(array([[1.      , 0.333333]], dtype=float32), 'x')"
+        assert self.c.check_output(
+            want, "(array([[1.       , 0.3333333]], dtype=float32), 'x')", ARRAY_CMP)
+        assert not self.c.check_output(
+            want, "(array([[1.       , 0.3333333]], dtype=float64), 'x')", ARRAY_CMP)
+        assert not self.c.check_output(
+            want, "(array([[1.       , 0.3333333]], dtype=float32), 'y')", ARRAY_CMP)
+        assert not self.c.check_output(
+            want, "(array([1.       , 0.3333333], dtype=float32), 'x')", ARRAY_CMP)
+        assert not self.c.check_output(
+            want, "(array([[1.       , 0.34]], dtype=float32), 'x')", ARRAY_CMP)
+        assert not self.c.check_output('array([1, 2])', 'array([1., 2.])', ARRAY_CMP)
+        assert self.c.check_output('array([nan, inf])', 'array([nan, inf])', ARRAY_CMP)
+
+    def test_fallback(self):
+        # Summarized and string arrays are compared as with FLOAT_CMP
+        assert self.c.check_output('array([0., 1., ..., 9.])',
+                                   'array([0., 1.0000001, ..., 9.])', ARRAY_CMP)
+        assert self.c.check_output("array(['a', 'b'], dtype='<U1')",
+                                   "array(['a', 'b'], dtype='<U1')", ARRAY_CMP)
+        assert self.c.check_output('[1., 2.]', '[1.0000001, 2.]', ARRAY_CMP)
+
+    def test_large_array(self):
+        import numpy as np
+
+        values = np.random.default_rng(0).random((100, 100))
+        with np.printoptions(threshold=values.size):
+            want, got = repr(values), repr(values * (1 + 1e-9))
+            wrong = repr(np.where(values == values[50, 50], 0.5, values))
+        assert self.c.compare_arrays(want, got, 0)
+        assert not self.c.compare_arrays(want, wrong, 0)
+
+
+class TestCheckerCache:
+    def setup_method(self, method):
+        OutputChecker.cache_clear()
+
+    def test_hits(self):
+        c = OutputChecker()
+        got = ' '.join(str(i / 3) for i in range(100))
+        want = ' '.join(f'{i / 3:.6f}' for i in range(100))
+
+        assert c.check_output(want, got, FLOAT_CMP)
+        assert OutputChecker.cache_info()[:2] == (0, 1)
+        for _ in range(3):
+            assert OutputChecker().check_output(want, got, FLOAT_CMP)
+        assert OutputChecker.cache_info()[:2] == (3, 1)
+
+        # Different flags or tolerances are cached separately
+        assert not c.check_output(want, got, 0)
+        assert OutputChecker.cache_info()[:2] == (3, 2)
+
+    def test_tiny_strings_bypass_cache(self):
+        c = OutputChecker()
+        assert c.check_output('1.0', '1.0000000001', FLOAT_CMP)
+        assert c.check_output('1.0', '1.0000000001', FLOAT_CMP)
+        assert OutputChecker.cache_info()[:2] == (0, 0)
+
+    def test_bounded(self, monkeypatch):
+        monkeypatch.setattr(OutputChecker, 'cache_size', 4)
+        OutputChecker.cache_clear()
+        c = OutputChecker()
+        for i in range(10):
+            c.check_output('x' * 300, str(i) * 300, 0)
+        info = OutputChecker.cache_info()
+        assert info.maxsize == 4
+        assert info.currsize == 4
+
+    def test_output_difference(self):
+        c = OutputChecker()
+        example = doctest.Example('print(x)', 'a\n' * 200)
+        first = c.output_difference(example, 'b\n' * 200, 0)
+        assert c.output_difference(example, 'b\n' * 200, 0) == first
+        assert OutputChecker.cache_info()[:2] == (1, 1)
+
+
+class TestBoundedDifference:
+    def setup_method(self, method):
+        OutputChecker.cache_clear()
+
+    def test_large_output(self):
+        want = ''.join(f'{i} {i / 7}\n' for i in range(200000))
+        got = want.replace('\n123456 ', '\n-123456 ').replace('\n150000 ', '\n-150000 ')
+        example = doctest.Example('print(x)', want)
+
+        report = OutputChecker().output_difference(example, got, doctest.REPORT_UDIFF)
+
+        assert report.startswith('Differences (bounded diff with -expected +actual):')
+        assert 'Expected output: lines 123457-150001 differ (of 200000 lines)' in report
+        assert 'Actual output: lines 123457-150001 differ (of 200000 lines)' in report
+        assert report.count('\n') < OutputChecker.max_diff_lines + 5
+
+    def test_small_difference_is_diffed(self):
+        want = ''.join(f'{i}\n' for i in range(100000))
+        got = want.replace('\n500\n', '\n500\n501.5\n')
+        report = OutputChecker().output_difference(doctest.Example('x', want), got, 0)
+        assert 'Expected output: no lines at line 502 (of 100000 lines)' in report
+        assert 'Actual output: line 502 differs (of 100001 lines)' in report
+        assert '\n    @@ -500,4 +500,5 @@\n' in report
+        assert '\n    +501.5\n' in report
+
+    def test_long_line(self):
+        want = 'a' * 10 ** 6
+        got = 'b' * 10 ** 6
+        report = OutputChecker().output_difference(doctest.Example('x', want), got, 0)
+        assert '\n    -aaaa' in report
+        assert report.count(' more characters)') == 2
+        assert len(report) < 10 * OutputChecker.max_diff_line_length
+
+    def test_fix(self):
+        from pytest_doctestplus.output_checker import FIX
+
+        want = ''.join(f"u'{i}'\n" for i in range(100000))
+        got = want.replace("u'", "'").replace("'500'", "'-500'")
+        report = OutputChecker().output_difference(doctest.Example('x', want), got, FIX)
+        assert 'Expected output: line 501 differs (of 100000 lines)' in report
+
+
+def test_fix_failure_report(testdir):
+    testdir.makeini(
+        """
+        [pytest]
+        doctestplus = enabled
+    """
+    )
+    p = testdir.makefile(
+        '.rst',
+        """
+        >>> print("'a'\\n'c'")
+        u'a'
+        u'b'
+
+        >>> print("'d'")  # doctest: -FIX
+        u'e'
+    """
+    )
+    result = testdir.runpytest_subprocess(p, "--doctest-plus", "--doctest-rst",
+                                          "--doctest-continue-on-failure")
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines([
+        "Expected:",
+        "    'a'",
+        "    'b'",
+        "Got:",
+        "    'a'",
+        "    'c'",
+        "*",
+        "Expected:",
+        "    u'e'",
+        "Got:",
+        "    'd'",
+    ])
+    assert "    u'a'" not in result.stdout.lines
+
+
+def test_checker_cache_summary(testdir):
+    testdir.makeini(
+        """
+        [pytest]
+        doctestplus = enabled
+    """
+    )
+    p = testdir.makepyfile(
+        """
+        def f():
+            '''
+            >>> print('a' * 300)  # doctest: +ELLIPSIS
+            a...
+            >>> print('a' * 300)  # doctest: +ELLIPSIS
+            a...
+            '''
+    """
+    )
+    result = testdir.runpytest(p, "--doctest-plus", "-v")
+    result.stdout.fnmatch_lines(["doctestplus output checker cache: 1 hits, 1 misses*"])
+
+
 def test_requires(testdir):
     testdir.makeini(
         """
@@ -581,6 +820,32 @@ def test_show_warnings_rst(testdir):
     reprec.assertoutcome(failed=1, passed=0)
 
 
+def test_rst_failure_context(testdir):
+    # The text of the file is only read to report the failure.
+    p = testdir.makefile(".rst",
+                         """
+        Some text
+
+            >>> 1 + 1
+            2
+            >>> 2 + 2
+            5
+
+        More text
+        """)
+    result = testdir.runpytest(p, "--doctest-plus", "--doctest-rst")
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines([
+        "*>>> 1 + 1",
+        "*2",
+        "*>>> 2 + 2",
+        "Expected:",
+        "    5",
+        "Got:",
+        "    4",
+    ])
+
+
 def test_doctest_glob(testdir):
     testdir.makefile(
         '.md',
@@ -1116,6 +1381,71 @@ def test_remote_data_ignore_warnings(testdir):
     testdir.inline_run(p, '--doctest-plus', '--doctest-rst').assertoutcome(skipped=1)
 
 
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def test_remote_data_cassette(testdir):
+    data = testdir.mkdir("served")
+    data.join("values.txt").write("1 2 3\n")
+    handler = functools.partial(QuietHandler, directory=str(data))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/values.txt"
+
+    p = testdir.makefile(".rst", remote=f"""
+        >>> from urllib.request import urlopen
+
+        .. doctest-remote-data::
+
+        >>> with urlopen('{url}') as remote:
+        ...     print(remote.read().decode())
+        1 2 3
+        <BLANKLINE>
+
+        >>> print(urlopen('{url}').status)  # doctest: +REMOTE_DATA
+        200
+
+        >>> import threading
+        >>> threading.current_thread().name
+        'MainThread'
+        """)
+    args = (p, "--doctest-plus", "--doctest-rst")
+
+    # Recording runs the remote data examples, which needs --remote-data=any
+    result = testdir.runpytest(*args, "--doctest-plus-cassette=record")
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(["*--doctest-plus-cassette=record requires --remote-data=any*"])
+
+    try:
+        result = testdir.runpytest(*args, "--remote-data=any", "--doctest-plus-cassette=record")
+        result.assert_outcomes(passed=1)
+    finally:
+        server.shutdown()
+        server.server_close()
+    cassette = testdir.tmpdir.join("doctest_cassettes", "remote.rst_remote.rst.json")
+    assert len(json.loads(cassette.read())["interactions"]) == 2
+
+    # Without the network, the remote data examples are skipped, unless the
+    # responses are replayed
+    testdir.runpytest(*args).assert_outcomes(passed=1)
+    result = testdir.runpytest(*args, "--doctest-plus-cassette=replay", "-v")
+    result.assert_outcomes(passed=1)
+    # The cassettes patch http.client while the doctests run, so they do not
+    # run in the threads
+    result = testdir.runpytest(*args, "--doctest-plus-cassette=replay",
+                               "--doctest-plus-threads=2")
+    result.assert_outcomes(passed=1)
+    result = testdir.runpytest(*args, "--remote-data=any")
+    result.assert_outcomes(failed=1)
+
+    cassette.remove()
+    result = testdir.runpytest(*args, "--doctest-plus-cassette=replay")
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(["*CassetteError: no recorded response to GET*"])
+
+
 def test_skiptest(testdir):
     testdir.makeini(
         """
@@ -1540,6 +1870,220 @@ def test_generate_diff_multiline(testdir, capsys):
     assert result == original_fixed
 
 
+def test_generate_diff_xdist(testdir):
+    pytest.importorskip("xdist")
+    files = []
+    for name in ("first", "second", "third"):
+        files.append(testdir.makepyfile(**{name: """
+            def f():
+                '''
+                >>> print(2)
+                4
+                '''
+                pass
+            """}))
+    originals = [p.read_text("utf-8") for p in files]
+
+    result = testdir.runpytest_subprocess(*files, "-n", "2",
+                                          "--doctest-plus-generate-diff")
+    for p in files:
+        name = str(p).replace(os.sep, "/").lstrip("/")
+        result.stdout.fnmatch_lines([f"diff --git a/{name} b/{name}"])
+    result.stdout.fnmatch_lines(["-    4", "+    2"])
+
+    result = testdir.runpytest_subprocess(*files, "-n", "2",
+                                          "--doctest-plus-generate-diff=overwrite")
+    result.stdout.fnmatch_lines(["Applied fix to the following files:"])
+    for p, original in zip(files, originals):
+        assert p.read_text("utf-8") == original.replace("4", "2")
+
+
+def test_schedule_xdist(testdir):
+    pytest.importorskip("xdist")
+    for name, seconds in (("quick", 0), ("slow", 0.2)):
+        testdir.makefile(".rst", **{name: f"""
+            >>> import time
+            >>> time.sleep({seconds})
+            """})
+    testdir.makepyfile(module="""
+        def f():
+            '''
+            >>> 1 + 1
+            2
+            '''
+
+        def h():
+            '''
+            >>> 2 + 2
+            4
+            '''
+        """)
+
+    def recorded_durations():
+        path = testdir.tmpdir.join(".pytest_cache", "v", "doctestplus", "durations")
+        return json.loads(path.read())
+
+    # Without history, the items are dispatched by the size of their files
+    result = testdir.runpytest_subprocess("-n", "2", "--doctest-plus", "--doctest-rst",
+                                          "--doctest-plus-schedule")
+    result.assert_outcomes(passed=4)
+    durations = recorded_durations()
+    assert sorted(durations) == ["module.py::module.f", "module.py::module.h",
+                                 "quick.rst::quick.rst", "slow.rst::slow.rst"]
+    assert durations["slow.rst::slow.rst"] >= 0.2
+
+    # Partial runs keep the durations of the other items
+    result = testdir.runpytest_subprocess("-n", "2", "--doctest-plus", "--doctest-rst",
+                                          "--doctest-plus-schedule", "module.py")
+    result.assert_outcomes(passed=2)
+    assert sorted(recorded_durations()) == sorted(durations)
+    # Including those of the tests of a file that were not selected
+    for args, passed in ((["module.py::module.f"], 1), (["-k", "quick or module.f"], 2)):
+        result = testdir.runpytest_subprocess("-n", "2", "--doctest-plus", "--doctest-rst",
+                                              "--doctest-plus-schedule", *args)
+        result.assert_outcomes(passed=passed)
+        assert sorted(recorded_durations()) == sorted(durations)
+
+    # The durations of the tests that were renamed or deleted are dropped
+    testdir.makepyfile(module="""
+        def g():
+            '''
+            >>> 1 + 1
+            2
+            '''
+        """)
+    testdir.tmpdir.join("quick.rst").remove()
+    result = testdir.runpytest_subprocess("-n", "2", "--doctest-plus", "--doctest-rst",
+                                          "--doctest-plus-schedule", "module.py")
+    result.assert_outcomes(passed=1)
+    assert sorted(recorded_durations()) == ["module.py::module.g", "slow.rst::slow.rst"]
+
+
+def test_failed_first(testdir):
+    testdir.makefile(".rst", a_passing="""
+        >>> 1 + 1
+        2
+        """)
+    tutorial = testdir.makefile(".rst", b_tutorial="""
+        >>> x = 1
+        >>> with open('ran.txt', 'a') as f:
+        ...     _ = f.write('unrelated\\n')
+        >>> x += 1
+        >>> x
+        3
+        """)
+    ran = testdir.tmpdir.join("ran.txt")
+    args = ("--doctest-plus", "--doctest-rst", "--doctest-plus-failed-first", "-v")
+
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(passed=1, failed=1)
+    assert ran.read() == "unrelated\n"
+
+    # The failed test runs first, and only replays the examples the failed
+    # one depends on
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(["*b_tutorial.rst*FAILED*", "*a_passing.rst*PASSED*"])
+    result.stdout.fnmatch_lines(["Expected:", "    3", "Got:", "    2"])
+    assert ran.read() == "unrelated\n"
+
+    # Once the failed example is fixed, the test runs in full
+    tutorial.write(tutorial.read().replace("3", "2"))
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(["*b_tutorial.rst*PASSED*", "*a_passing.rst*PASSED*"])
+    assert ran.read() == "unrelated\n" * 2
+
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(["*a_passing.rst*PASSED*", "*b_tutorial.rst*PASSED*"])
+
+
+def test_failed_first_module_state(testdir):
+    # The replay does not change the objects of the module for the whole
+    # test that runs after it
+    module = testdir.makepyfile(module="""
+        _items = []
+
+        def f():
+            '''
+            >>> _items.append(1)
+            >>> _items
+            [1]
+            >>> len(_items)
+            2
+            '''
+        """)
+    args = ("--doctest-plus", "--doctest-plus-failed-first", "module.py")
+    testdir.runpytest(*args).assert_outcomes(failed=1)
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(["Expected:", "    2", "Got:", "    1"])
+
+    module.write(module.read().replace("2", "1"))
+    testdir.runpytest(*args).assert_outcomes(passed=1)
+
+@pytest.mark.parametrize("mode", ["marked", "sections"])
+def test_checkpoint(testdir, mode):
+    tutorial = testdir.makefile(".rst", tutorial="""
+        Setup
+        =====
+
+        >>> import math
+        >>> def log(message):
+        ...     with open('log.txt', 'a') as f:
+        ...         _ = f.write(message + '\\n')
+        >>> log('setup')
+        >>> data = [math.sqrt(i) for i in range(4)]
+        >>> squares = (i ** 2 for i in range(4))
+
+        .. doctest-checkpoint::
+
+        Usage
+        =====
+
+        >>> log('usage')
+        >>> round(sum(data), 3)
+        4.146
+        >>> next(squares)
+        0
+        """)
+    log = testdir.tmpdir.join("log.txt")
+    args = ("--doctest-plus", "--doctest-rst", f"--doctest-plus-checkpoint={mode}")
+
+    testdir.runpytest(*args).assert_outcomes(passed=1)
+    assert log.read() == "setup\nusage\n"
+
+    # The test resumes from the checkpoint, defining again the values that
+    # could not be saved
+    testdir.runpytest(*args).assert_outcomes(passed=1)
+    assert log.read() == "setup\nusage\n" + "usage\n"
+
+    result = testdir.runpytest(*args, "-p", "no:cacheprovider")
+    result.assert_outcomes(passed=1)
+    assert log.read() == "setup\nusage\n" + "usage\n" + "setup\nusage\n"
+
+    # Changing an example before the checkpoint invalidates it
+    log.remove()
+    tutorial.write(tutorial.read().replace("range(4)]", "range(5)]"))
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(["Expected:", "    4.146", "Got:", "    6.146"])
+    assert log.read() == "setup\nusage\n"
+
+    # The new checkpoint was saved, as the examples before it passed
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(failed=1)
+    assert log.read() == "setup\nusage\n" + "usage\n"
+
+    # But checkpoints are not saved after a failure
+    log.remove()
+    tutorial.write(tutorial.read().replace(">>> log('setup')", ">>> log('setup'); 1"))
+    for _ in range(2):
+        testdir.runpytest(*args).assert_outcomes(failed=1)
+    assert log.read() == "setup\n" * 2
+
+
 def test_skip_module_variable(testdir):
     p = testdir.makepyfile("""
         __doctest_skip__ = ["f"]
@@ -1614,3 +2158,1065 @@ def test_requires_module_variable(testdir):
             pass
         """)
     testdir.inline_run(p, '--doctest-plus').assertoutcome(passed=2, skipped=3)
+
+
+def test_disabled_plugin_imports(testdir, monkeypatch):
+    # Without --doctest-plus, neither the implementation of the plugin nor its
+    # heavy dependencies should be imported.
+    monkeypatch.setenv("PYTEST_DISABLE_PLUGIN_AUTOLOAD", "1")
+    testdir.makepyfile(
+        """
+        import sys
+
+        def test_modules():
+            for module in ('doctest', 'numpy', 'packaging', 'pytest_doctestplus.core',
+                           'pytest_doctestplus.diff', 'pytest_doctestplus.output_checker'):
+                assert module not in sys.modules, module
+        """
+    )
+    result = testdir.runpytest_subprocess("-p", "pytest_doctestplus.plugin")
+    result.assert_outcomes(passed=1)
+
+
+def test_plugin_import_time():
+    # The plugin is imported by every run of pytest, so it should only add a
+    # few milliseconds to its startup.
+    budget_us = 5000
+    code = "import pytest, _pytest.doctest; import pytest_doctestplus.plugin"
+    timings = []
+    for _ in range(5):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                stderr=subprocess.PIPE, encoding="utf-8", check=True)
+        for line in result.stderr.splitlines():
+            _, cumulative, name = line.split("|")
+            if name.strip() == "pytest_doctestplus.plugin":
+                timings.append(int(cumulative))
+    assert min(timings) < budget_us
+
+
+def test_optionflags_without_doctestplus(testdir, monkeypatch):
+    # The option flags are still registered when pytest runs doctests itself.
+    monkeypatch.setenv("PYTEST_DISABLE_PLUGIN_AUTOLOAD", "1")
+    testdir.makepyfile(
+        """
+        def f():
+            '''
+            >>> 1.5  # doctest: +FLOAT_CMP
+            1.5
+            '''
+        """
+    )
+    testdir.maketxtfile(test_example="""
+        >>> 2.5  # doctest: +FLOAT_CMP
+        2.5
+        """)
+    result = testdir.runpytest_subprocess("-p", "pytest_doctestplus.plugin", "--doctest-modules")
+    result.assert_outcomes(passed=2)
+    result = testdir.runpytest_subprocess("-p", "pytest_doctestplus.plugin")
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_report(testdir, workers):
+    if workers:
+        pytest.importorskip("xdist")
+    testdir.makepyfile(module="""
+        __doctest_skip__ = ['skipped']
+        __doctest_requires__ = {'required': ['nonexistentmodule']}
+
+        def passing():
+            '''
+            >>> 1 + 1
+            2
+            >>> 2 + 2  # doctest: +IGNORE_WARNINGS
+            4
+            '''
+
+        def skipped():
+            '''
+            >>> 1 + 1
+            2
+            '''
+
+        def required():
+            '''
+            >>> 1 + 1
+            2
+            '''
+        """)
+    testdir.makefile(".rst", failing="""
+        Title
+        =====
+
+        >>> 1 + 1
+        3
+        """)
+    testdir.makefile(".rst", skip_all="""
+        .. doctest-skip-all
+
+        >>> 1 + 1
+        2
+        """)
+    testdir.makefile(".rst", requires="""
+        .. doctest-requires:: nonexistentmodule
+
+        >>> 1 + 1
+        2
+        """)
+    testdir.makefile(".rst", remote="""
+        .. doctest-remote-data::
+
+        >>> 1 + 1
+        2
+        """)
+    args = ["--doctest-plus", "--doctest-rst", "--doctest-plus-report=out/report.json"]
+    if workers:
+        args += ["-n", str(workers)]
+    result = testdir.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=1, failed=1, skipped=5)
+
+    records = json.loads(testdir.tmpdir.join("out", "report.json").read())["doctests"]
+    by_id = {record["nodeid"]: record for record in records}
+    assert sorted(by_id) == [
+        "failing.rst::failing.rst", "module.py::module.passing",
+        "module.py::module.required", "module.py::module.skipped",
+        "remote.rst::remote.rst", "requires.rst::requires.rst", "skip_all.rst::skip_all.rst"]
+
+    passing = by_id["module.py::module.passing"]
+    assert passing["file"] == "module.py"
+    assert passing["line"] == 5
+    assert passing["examples"] == 2
+    assert passing["outcome"] == "passed"
+    assert passing["skip_reason"] is None
+    assert sorted(passing["collection"]) == ["find", "import"]
+    assert passing["duration"] > 0
+
+    failing = by_id["failing.rst::failing.rst"]
+    assert (failing["file"], failing["line"], failing["examples"]) == ("failing.rst", 1, 1)
+    assert failing["outcome"] == "failed"
+    assert sorted(failing["collection"]) == ["parse"]
+
+    assert {nodeid: record["skip_reason"] for nodeid, record in by_id.items()
+            if record["outcome"] == "skipped"} == {
+        "module.py::module.required": "requirement",
+        "module.py::module.skipped": "__doctest_skip__",
+        "remote.rst::remote.rst": "remote data",
+        "requires.rst::requires.rst": "requirement",
+        "skip_all.rst::skip_all.rst": "directive",
+    }
+
+    # The doctests that do not run are reported too
+    result = testdir.runpytest_subprocess(*args, "-k", "failing or passing", "-x")
+    assert result.parseoutcomes()["failed"] == 1
+    records = json.loads(testdir.tmpdir.join("out", "report.json").read())["doctests"]
+    by_id = {record["nodeid"]: record for record in records}
+    assert len(by_id) == 7
+    assert by_id["failing.rst::failing.rst"]["outcome"] == "failed"
+    assert by_id["remote.rst::remote.rst"]["outcome"] == "deselected"
+    assert by_id["remote.rst::remote.rst"]["examples"] == 1
+    if not workers:
+        # Not run, after -x stopped the session
+        assert by_id["module.py::module.passing"]["outcome"] is None
+
+
+def test_timing_hooks(testdir):
+    testdir.makeconftest("""
+        import json
+
+        def record(name, info):
+            assert info["wall"] >= 0 and info["cpu"] >= 0 and info["start"] > 0
+            with open("hooks.jsonl", "a") as f:
+                f.write(json.dumps(dict(
+                    {key: value for key, value in info.items()
+                     if isinstance(value, (str, int, type(None)))},
+                    hook=name, path=str(info.get("path", "")),
+                    count=len(info.get("tests", info.get("examples", []))))) + "\\n")
+
+        def pytest_doctestplus_import(info):
+            assert info["module"].__name__ == "module"
+            record("import", info)
+
+        def pytest_doctestplus_find(info):
+            record("find", info)
+
+        def pytest_doctestplus_parse(info):
+            record("parse", info)
+
+        def pytest_doctestplus_example(info):
+            record("example", info)
+        """)
+    testdir.makepyfile(module="""
+        def f():
+            '''
+            >>> 1 + 1
+            2
+            >>> raise ValueError()
+            '''
+        """)
+    testdir.makefile(".rst", text="""
+        >>> 1 + 1
+        3
+        >>> 1 + 1  # doctest: +SKIP
+        3
+        >>> import pytest; pytest.skip()
+        """)
+    result = testdir.runpytest("module.py", "text.rst", "--doctest-plus", "--doctest-rst",
+                               "--doctest-continue-on-failure")
+    result.assert_outcomes(failed=1, skipped=1)
+
+    calls = [json.loads(line) for line in testdir.tmpdir.join("hooks.jsonl").readlines()]
+    assert [(call["hook"], call["count"]) for call in calls
+            if call["hook"] != "example"] == [("import", 0), ("find", 1), ("parse", 3)]
+    assert calls[0]["path"] == str(testdir.tmpdir.join("module.py"))
+    examples = [(call["filename"].split(os.sep)[-1], call["example_lineno"], call["source"],
+                 call["outcome"]) for call in calls if call["hook"] == "example"]
+    assert examples == [
+        ("module.py", 1, "1 + 1\n", "passed"),
+        ("module.py", 3, "raise ValueError()\n", "error"),
+        ("text.rst", 0, "1 + 1\n", "failed"),
+        ("text.rst", 4, "import pytest; pytest.skip()\n", "skipped"),
+    ]
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_trace(testdir, workers):
+    if workers:
+        pytest.importorskip("xdist")
+    testdir.makepyfile(module="""
+        def f():
+            '''
+            >>> 1 + 1
+            2
+            '''
+        """)
+    testdir.makefile(".rst", text="""
+        .. doctest-requires:: nonexistentmodule
+
+        >>> 1 + 1
+        2
+
+        >>> x = 1
+        >>> x + 1
+        3
+        """)
+    args = ["--doctest-plus", "--doctest-rst", "--doctest-plus-trace=out/trace.json"]
+    if workers:
+        args += ["-n", str(workers)]
+    result = testdir.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=1, failed=1)
+
+    trace = json.loads(testdir.tmpdir.join("out", "trace.json").read())
+    spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert all(span["ts"] >= 0 and span["dur"] >= 0 for span in spans)
+    assert {span["name"] for span in spans if span["cat"] == "collect"} == {
+        "import_path", "find", "parse", "requirement"}
+    # Each pytest-xdist worker collects all the files
+    for span in spans:
+        if span["name"] == "requirement":
+            assert span["args"] == {"requirement": "nonexistentmodule", "available": False,
+                                    "cpu": span["args"]["cpu"]}
+
+    items = {span["name"]: span for span in spans if span["cat"] == "item"}
+    assert {name: span["args"]["outcome"] for name, span in items.items()} == {
+        "module.py::module.f": "passed", "text.rst::text.rst": "failed"}
+    examples = [(span["name"], span["args"]["outcome"],
+                 os.path.basename(span["args"]["location"]))
+                for span in spans if span["cat"] == "example"]
+    assert sorted(examples) == [("1 + 1", "passed", "module.py:3"),
+                                ("x + 1", "failed", "text.rst:7"),
+                                ("x = 1", "passed", "text.rst:6")]
+
+    # The spans of the examples are within the spans of their items
+    item = items["text.rst::text.rst"]
+    for span in spans:
+        if span["cat"] == "example" and "text.rst" in span["args"]["location"]:
+            assert span["tid"] == item["tid"]
+            assert item["ts"] <= span["ts"] <= item["ts"] + item["dur"]
+
+    tracks = {event["tid"]: event["args"]["name"] for event in trace["traceEvents"]
+              if event["name"] == "thread_name"}
+    if workers:
+        assert set(tracks.values()) <= {"gw0", "gw1"}
+        assert tracks[item["tid"]].startswith("gw")
+    else:
+        assert tracks == {0: "main"}
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_profile(testdir, workers):
+    if workers:
+        pytest.importorskip("xdist")
+    testdir.makefile(".rst", tutorial="""
+        >>> def work(n):
+        ...     return sum(i * i for i in range(n))
+        >>> x = work(100000)
+        """)
+    testdir.makefile(".rst", other="""
+        >>> 1 + 1
+        2
+        """)
+    args = ["--doctest-plus", "--doctest-rst", "--doctest-plus-profile=tutorial.rst::*"]
+    if workers:
+        args += ["-n", str(workers)]
+    result = testdir.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+    if not workers:
+        result.stdout.fnmatch_lines(["doctestplus profiles written to *doctest_profiles*"])
+
+    directory = testdir.tmpdir.join("doctest_profiles")
+    assert sorted(path.basename for path in directory.listdir()) == [
+        "doctests.collapsed", "tutorial.rst_tutorial.rst.pstats"]
+    stacks = dict(line.rsplit(" ", 1)
+                  for line in directory.join("doctests.collapsed").read().splitlines())
+    path = testdir.tmpdir.join("tutorial.rst")
+    assert (f"tutorial.rst::tutorial.rst;<module> ({path}:3);work ({path}:1);"
+            f"<built-in method builtins.sum>;<genexpr> ({path}:2)") in stacks
+    assert all(stack.startswith("tutorial.rst::tutorial.rst") for stack in stacks)
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_importtime(testdir, workers):
+    if workers:
+        pytest.importorskip("xdist")
+    package = testdir.mkpydir("slowpackage")
+    package.join("slow.py").write("import time\ntime.sleep(0.05)\nimport slowpackage.slower\n")
+    package.join("slower.py").write("import time\ntime.sleep(0.1)\n")
+    testdir.makepyfile(module="""
+        '''
+        >>> 1 + 1
+        2
+        '''
+        import slowpackage.slow
+        """)
+    testdir.makefile(".rst", text="""
+        .. doctest-requires:: fractions
+
+        >>> 1 + 1
+        2
+        """)
+    args = ["module.py", "text.rst", "--doctest-plus", "--doctest-rst",
+            "--doctest-plus-importtime=out/imports.json"]
+    if workers:
+        args += ["-n", str(workers)]
+    result = testdir.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines([
+        "*doctestplus import times*",
+        "*self*cumul.*module (collector)",
+        "*slowpackage.slower (module.py)",
+        "*slowpackage.slow (module.py)",
+    ])
+
+    collectors = json.loads(testdir.tmpdir.join("out", "imports.json").read())["collectors"]
+    trees = {collector["nodeid"]: collector["imports"] for collector in collectors}
+    module, = trees["module.py"]
+    assert module["module"] == "module"
+    imports = {node["module"]: node for node in module["imports"]}
+    assert sorted(imports) == ["slowpackage", "slowpackage.slow"]
+    slow = imports["slowpackage.slow"]
+    slower, = slow["imports"]
+    assert slower["module"] == "slowpackage.slower"
+    assert slower["self"] == slower["cumulative"] >= 0.1
+    assert 0.05 <= slow["self"] < 0.1
+    assert slow["cumulative"] == pytest.approx(slow["self"] + slower["cumulative"])
+    assert "fractions" in [node["module"] for node in trees["text.rst"]]
+
+
+def test_gc_strategies(testdir):
+    testdir.makefile(".rst", cycles="""
+        >>> import gc
+        >>> class Node:
+        ...     def __init__(self):
+        ...         self.ref = self
+        >>> for i in range(20000):
+        ...     _ = Node()
+        >>> gc.get_freeze_count() > 0
+        FROZEN
+        >>> gc.isenabled()
+        ENABLED
+        """)
+    thresholds = gc.get_threshold()
+
+    def run(strategies, frozen, enabled):
+        path = testdir.tmpdir.join("cycles.rst")
+        path.write(path.read().replace("FROZEN", str(frozen)).replace("ENABLED", str(enabled)))
+        result = testdir.runpytest("--doctest-plus", "--doctest-rst", "-p", "cacheprovider",
+                                   "-o", f"doctest_plus_gc={strategies}")
+        path.write(path.read().replace(str(frozen), "FROZEN").replace(str(enabled), "ENABLED"))
+        result.assert_outcomes(passed=1)
+        # The state of the garbage collector is restored
+        assert gc.get_freeze_count() == 0
+        assert gc.isenabled()
+        assert gc.get_threshold() == thresholds
+        return result
+
+    result = run("none", False, True)
+    result.stdout.fnmatch_lines(["*doctestplus garbage collection*", "* none *"])
+    recorded = json.loads(testdir.tmpdir.join(
+        ".pytest_cache", "v", "doctestplus", "gc").read())
+    assert recorded["none"]["collections"] > 0
+
+    result = run("freeze items", True, False)
+    result.stdout.fnmatch_lines(["GC time saved by 'freeze items' compared to 'none': *"])
+    recorded = json.loads(testdir.tmpdir.join(
+        ".pytest_cache", "v", "doctestplus", "gc").read())
+    assert sorted(recorded) == ["freeze items", "none"]
+
+    result = testdir.runpytest("--doctest-plus", "--doctest-rst", "-o", "doctest_plus_gc=fast")
+    result.stderr.fnmatch_lines(["*invalid doctest_plus_gc strategy: 'fast'*"])
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+@pytest.mark.parametrize("processes", [1, 2])
+def test_fork(testdir, processes):
+    testdir.makeini("""
+        [pytest]
+        doctest_plus_preload = fractions
+        """)
+    testdir.makefile(".rst", leak="""
+        >>> import sys
+        >>> 'fractions' in sys.modules
+        True
+        >>> sys.doctestplus_leak = 1
+        """)
+    testdir.makefile(".rst", isolated="""
+        >>> import sys
+        >>> hasattr(sys, 'doctestplus_leak')
+        False
+        >>> print('output')
+        wrong
+        """)
+    testdir.makefile(".rst", crash="""
+        >>> import os, signal
+        >>> os.kill(os.getpid(), signal.SIGKILL)
+        """)
+    testdir.makepyfile(test_module="""
+        import os
+        import sys
+
+        PID = os.getpid()
+
+        def test_in_process():
+            assert os.getpid() == PID
+            assert not hasattr(sys, 'doctestplus_leak')
+        """)
+    result = testdir.runpytest_subprocess("--doctest-plus", "--doctest-rst", "-p", "no:faulthandler",
+                                          f"--doctest-plus-fork={processes}")
+    result.assert_outcomes(passed=2, failed=2)
+    # The children may finish in any order
+    result.stdout.fnmatch_lines([
+        "the process running the test was killed by SIGKILL, while running "
+        "the example at *crash.rst:2",
+    ])
+    result.stdout.fnmatch_lines(["FAILED crash.rst::crash.rst*"])
+    result.stdout.fnmatch_lines(["FAILED isolated.rst::isolated.rst*"])
+    result.stdout.fnmatch_lines(["Expected:", "    wrong", "Got:", "    output"])
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+@pytest.mark.parametrize(("options", "processes"), [
+    (["doctest_plus_fork_max_items=2"], 2),
+    (["doctest_plus_fork_max_items=0", "doctest_plus_fork_max_memory=1K"], 3),
+    (["doctest_plus_fork_max_items=0"], 1),
+])
+def test_fork_pool(testdir, options, processes):
+    for i in range(3):
+        testdir.makefile(".rst", **{f"pid{i}": """
+            >>> import os
+            >>> with open('pids.txt', 'a') as f:
+            ...     _ = f.write(f'{os.getpid()}\\n')
+            """})
+    args = ["--doctest-plus", "--doctest-rst", "--doctest-plus-fork"]
+    for option in options:
+        args += ["-o", option]
+    result = testdir.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=3)
+    pids = testdir.tmpdir.join("pids.txt").read().split()
+    assert len(pids) == 3
+    assert len(set(pids)) == processes
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_fork_plugins(testdir):
+    # What the plugins record in the children is merged in the pytest process
+    testdir.makefile(".rst", tutorial="""
+        >>> def work(n):
+        ...     return sum(i * i for i in range(n))
+        >>> x = work(100000)
+        """)
+    testdir.makefile(".rst", collect="""
+        >>> import gc
+        >>> for i in range(50):
+        ...     _ = gc.collect()
+        """)
+    result = testdir.runpytest_subprocess("--doctest-plus", "--doctest-rst", "-p", "cacheprovider",
+                                          "--doctest-plus-fork=2",
+                                          "--doctest-plus-trace=trace.json",
+                                          "--doctest-plus-profile", "-o", "doctest_plus_gc=none")
+    result.assert_outcomes(passed=2)
+
+    trace = json.loads(testdir.tmpdir.join("trace.json").read())
+    examples = sorted(span["name"] for span in trace["traceEvents"]
+                      if span["ph"] == "X" and span["cat"] == "example")
+    assert examples == ["def work(n):", "for i in range(50):", "import gc",
+                        "x = work(100000)"]
+
+    stacks = testdir.tmpdir.join("doctest_profiles", "doctests.collapsed").read()
+    assert {line.split(";", 1)[0].split()[0] for line in stacks.splitlines()} == {
+        "collect.rst::collect.rst", "tutorial.rst::tutorial.rst"}
+
+    recorded = json.loads(testdir.tmpdir.join(
+        ".pytest_cache", "v", "doctestplus", "gc").read())
+    assert recorded["none"]["collections"] >= 50
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_fork_limits(testdir):
+    testdir.makeini("""
+        [pytest]
+        doctest_plus_cpu_limit = 1
+        doctest_plus_memory_limit = 4G
+        doctest_plus_fork_max_items = 0
+        """)
+    testdir.makefile(".rst", cpu="""
+        >>> x = 0
+        >>> while True:
+        ...     x += 1
+        """)
+    testdir.makefile(".rst", memory="""
+        >>> data = bytearray(8 << 30)
+        """)
+    testdir.makefile(".rst", passing="""
+        >>> 1 + 1
+        2
+        """)
+    result = testdir.runpytest_subprocess("--doctest-plus", "--doctest-rst", "--doctest-plus-fork")
+    result.assert_outcomes(passed=1, failed=2)
+    result.stdout.fnmatch_lines([
+        "the process running the test exceeded its CPU time limit, while running "
+        "the example at *cpu.rst:2",
+    ])
+    result.stdout.fnmatch_lines(["*UNEXPECTED EXCEPTION: MemoryError()*"])
+
+    result = testdir.runpytest_subprocess("--doctest-plus", "--doctest-rst", "--doctest-plus-fork",
+                                          "-o", "doctest_plus_cpu_limit=soon")
+    result.stderr.fnmatch_lines(["*invalid doctest_plus_cpu_limit: 'soon'*"])
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_fork_limits_plugins(testdir):
+    # What the children recorded before one of them exceeded its limits is
+    # not lost
+    testdir.makeini("""
+        [pytest]
+        doctest_plus_cpu_limit = 1
+        doctest_plus_memory_limit = 4G
+        doctest_plus_fork_max_items = 0
+        """)
+    testdir.makefile(".rst", cpu="""
+        >>> x = 0
+        >>> while True:
+        ...     x += 1
+        """)
+    testdir.makefile(".rst", memory="""
+        >>> data = bytearray(8 << 30)
+        """)
+    testdir.makefile(".rst", passing="""
+        >>> 1 + 1
+        2
+        """)
+    result = testdir.runpytest_subprocess("--doctest-plus", "--doctest-rst", "--doctest-plus-fork",
+                                          "--doctest-plus-trace=trace.json",
+                                          "--doctest-plus-profile")
+    result.assert_outcomes(passed=1, failed=2)
+    result.stdout.fnmatch_lines([
+        "the process running the test exceeded its CPU time limit, while running "
+        "the example at *cpu.rst:2",
+    ])
+
+    trace = json.loads(testdir.tmpdir.join("trace.json").read())
+    spans = [span for span in trace["traceEvents"] if span["ph"] == "X"]
+    items = {span["name"]: span["args"]["outcome"] for span in spans if span["cat"] == "item"}
+    assert items == {"cpu.rst::cpu.rst": "failed", "memory.rst::memory.rst": "failed",
+                     "passing.rst::passing.rst": "passed"}
+    examples = sorted((span["name"], os.path.basename(span["args"]["location"]))
+                      for span in spans if span["cat"] == "example")
+    assert examples == [("1 + 1", "passing.rst:1"),
+                        ("data = bytearray(8 << 30)", "memory.rst:1"),
+                        ("x = 0", "cpu.rst:1")]
+
+    stacks = testdir.tmpdir.join("doctest_profiles", "doctests.collapsed").read()
+    assert {line.split(";", 1)[0].split()[0] for line in stacks.splitlines()} == {
+        "memory.rst::memory.rst", "passing.rst::passing.rst"}
+
+def test_threads(testdir):
+    for i in range(4):
+        testdir.makefile(".rst", **{f"file{i}": f"""
+            >>> import threading, time
+            >>> for j in range(3):
+            ...     print("file {i}, line", j)
+            ...     time.sleep(0.05)
+            file {i}, line 0
+            file {i}, line 1
+            file {i}, line 2
+            >>> threading.current_thread().name.startswith("doctestplus-")
+            True
+            """})
+    testdir.makefile(".rst", failing="""
+        >>> print("output")
+        wrong
+        """)
+    testdir.makepyfile(module="""
+        __doctest_serial__ = True
+
+        def f():
+            '''
+            >>> import threading
+            >>> threading.current_thread().name
+            'MainThread'
+            '''
+        """)
+    testdir.makefile(".rst", marked="""
+        >>> import threading
+        >>> threading.current_thread().name
+        'MainThread'
+        """)
+    testdir.makeconftest("""
+        import pytest
+
+        def pytest_collection_modifyitems(items):
+            for item in items:
+                if item.name == "marked.rst":
+                    item.add_marker(pytest.mark.doctest_serial)
+        """)
+    testdir.makepyfile(test_module="""
+        def test_capture(capsys):
+            print("captured")
+            assert capsys.readouterr().out == "captured\\n"
+        """)
+    result = testdir.runpytest("--doctest-plus", "--doctest-rst", "--doctest-plus-threads=3")
+    result.assert_outcomes(passed=7, failed=1)
+    result.stdout.fnmatch_lines(["doctestplus: running the doctests in 3 threads (GIL *)"])
+    result.stdout.fnmatch_lines(["Expected:", "    wrong", "Got:", "    output"])
+    # The output is restored after the threads
+    assert type(sys.stdout).__name__ != "ThreadStdout"
+
+    result = testdir.runpytest("--doctest-plus", "--doctest-plus-threads=2", "--doctest-plus-fork")
+    result.stderr.fnmatch_lines(["*--doctest-plus-threads cannot be used with --doctest-plus-fork*"])
+
+
+def test_threads_session_fixture(testdir):
+    # The session fixtures are torn down once all the threads are done
+    testdir.makeconftest("""
+        import threading
+
+        import pytest
+
+        state = {}
+        barrier = threading.Barrier(2, timeout=10)
+
+        @pytest.fixture(scope="session", autouse=True)
+        def resource():
+            state["open"] = True
+            yield
+            state["open"] = False
+            with open("teardowns.txt", "a") as f:
+                f.write("resource\\n")
+        """)
+    testdir.makefile(".rst", slow="""
+        >>> import time, conftest
+        >>> _ = conftest.barrier.wait()
+        >>> time.sleep(0.3)
+        >>> conftest.state["open"]
+        True
+        """)
+    testdir.makefile(".rst", fast="""
+        >>> import conftest
+        >>> _ = conftest.barrier.wait()
+        >>> conftest.state["open"]
+        True
+        """)
+    result = testdir.runpytest("--doctest-plus", "--doctest-rst", "--doctest-plus-threads=2")
+    result.assert_outcomes(passed=2)
+    assert testdir.tmpdir.join("teardowns.txt").read() == "resource\n"
+
+
+def test_threads_runner_hooks(testdir):
+    # The functions swapped by the doctest runners are those of the doctest
+    # of each thread while they run concurrently, and are restored after:
+    # the doctest that started last still has its functions once the other
+    # one is done
+    testdir.syspathinsert()
+    testdir.makepyfile(threadsync="""
+        import threading
+
+        barrier = threading.Barrier(2, timeout=10)
+        started = []
+        """)
+    for name in ("first", "second"):
+        testdir.makefile(".rst", **{name: f"""
+            >>> import inspect, time
+            >>> from threadsync import barrier, started
+            >>> started.append("{name}")
+            >>> def f():
+            ...     return "{name}"
+            >>> _ = barrier.wait()
+            >>> sys_displayhook = __import__("sys").displayhook
+            >>> sys_displayhook(f())
+            '{name}'
+            >>> time.sleep(0.2 if started[-1] == "{name}" else 0)
+            >>> print(inspect.getsource(f))
+            def f():
+                return "{name}"
+            <BLANKLINE>
+            """})
+    set_trace, getlines, displayhook = pdb.set_trace, linecache.getlines, sys.displayhook
+    result = testdir.runpytest("--doctest-plus", "--doctest-rst", "--doctest-plus-threads=2")
+    result.assert_outcomes(passed=2)
+    assert pdb.set_trace is set_trace
+    assert linecache.getlines is getlines
+    assert sys.displayhook is displayhook
+
+def test_top_level_await(testdir, monkeypatch):
+    testdir.makefile(".rst", text="""
+        >>> import asyncio
+        >>> async def double(x):
+        ...     await asyncio.sleep(0)
+        ...     return 2 * x
+        >>> await double(21)
+        42
+        >>> print(await double("a"))
+        aa
+
+        The examples share an event loop, with its tasks
+
+        >>> loop = (await asyncio.sleep(0)) or asyncio.get_running_loop()
+        >>> queue = asyncio.Queue()
+        >>> task = asyncio.ensure_future(queue.get())
+        >>> await queue.put(1)
+        >>> await task
+        1
+        >>> (await asyncio.sleep(0)) or asyncio.get_running_loop() is loop
+        True
+        >>> pending = asyncio.ensure_future(asyncio.sleep(100))
+        >>> await double(None)
+        Traceback (most recent call last):
+        ...
+        TypeError: unsupported operand type(s) for *: 'int' and 'NoneType'
+        """)
+    testdir.makepyfile(module="""
+        def f():
+            '''
+            >>> import asyncio
+            >>> await asyncio.sleep(0, result=1)
+            2
+            '''
+        """)
+    # Closing the event loop does not need the current event loop, which
+    # `asyncio.run` unsets
+    testdir.makefile(".rst", unset="""
+        >>> import asyncio
+        >>> await asyncio.sleep(0)
+        >>> asyncio.run(asyncio.sleep(0))
+        """)
+    testdir.makefile(".rst", error="""
+        >>> import asyncio
+        >>> await asyncio.sleep(0)
+        >>> 1 / 0
+        """)
+
+    # The event loop of the thread, and the `exec` of `doctest`, are restored
+    def exec_previous(*args):
+        return exec(*args)
+
+    monkeypatch.setattr(doctest, "exec", exec_previous, raising=False)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        result = testdir.runpytest("--doctest-plus", "--doctest-rst", "-W", "error")
+        assert asyncio.get_event_loop() is loop
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    assert doctest.exec is exec_previous
+    result.assert_outcomes(passed=2, failed=2)
+    result.stdout.fnmatch_lines(["Expected:", "    2", "Got:", "    1"])
+    # The tracebacks of the examples do not show how they are run
+    result.stdout.fnmatch_lines(["UNEXPECTED EXCEPTION: ZeroDivisionError*",
+                                 "Traceback (most recent call last):",
+                                 "*doctest.py*",
+                                 "*exec*",
+                                 '  File "<doctest error.rst[2]>", line 1, in <module>',
+                                 "ZeroDivisionError: division by zero"])
+    assert "exec_example" not in result.stdout.str()
+
+
+def test_sphinx_manifest(testdir):
+    build_main = pytest.importorskip("sphinx.cmd.build").build_main
+    docs = testdir.mkdir("docs")
+    docs.join("conf.py").write(dedent("""
+        extensions = ['pytest_doctestplus.sphinx.doctestplus']
+        doctestplus_manifest = 'doctests.json'
+        exclude_patterns = ['_build']
+        """))
+    docs.join("index.rst").write(dedent("""
+        Index
+        =====
+
+        .. toctree::
+
+           other
+
+        >>> 1 + 1
+        2
+
+        .. doctest-skip::
+
+            >>> 1 / 0
+            3
+        """))
+    docs.join("other.rst").write(dedent("""
+        Other
+        =====
+
+        .. doctest-requires:: nonexistingmodule
+
+            >>> import nonexistingmodule
+
+        >>> print(0.1 + 0.2)  # doctest: +FLOAT_CMP
+        0.3
+        """))
+    assert build_main(["-q", "-j", "2", str(docs), str(docs.join("_build"))]) == 0
+    manifest = docs.join("_build", "doctests.json")
+    data = json.loads(manifest.read())
+    assert sorted(data["files"]) == ["../index.rst", "../other.rst"]
+
+    args = ["--doctest-plus", "--doctest-rst", "-o",
+            "doctest_plus_manifest=docs/_build/doctests.json", "docs/index.rst", "docs/other.rst"]
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(passed=2)
+
+    # The unchanged files are collected from the manifest
+    entries = data["files"]["../index.rst"]["entries"]
+    example, = [entry for entry in entries if entry.get("source") == "1 + 1\n"]
+    example["want"] = "3\n"
+    manifest.write(json.dumps(data))
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(["Expected:", "    3", "Got:", "    2"])
+
+    docs.join("index.rst").write("\n", mode="a")
+    result = testdir.runpytest(*args)
+    result.assert_outcomes(passed=2)
+
+
+def test_sphinx_builder(testdir):
+    build_main = pytest.importorskip("sphinx.cmd.build").build_main
+    docs = testdir.mkdir("docs")
+    docs.join("conf.py").write(dedent("""
+        extensions = ['pytest_doctestplus.sphinx.doctestplus']
+        exclude_patterns = ['_build']
+        """))
+    docs.join("index.rst").write(dedent("""
+        Index
+        =====
+
+        .. toctree::
+
+           other
+
+        >>> print(0.1 + 0.2)  # doctest: +FLOAT_CMP
+        0.3
+
+        .. doctest-remote-data::
+
+            >>> 1 / 0
+            3
+        """))
+    docs.join("other.rst").write(dedent("""
+        Other
+        =====
+
+        >>> print('output')
+        wrong
+        """))
+    outdir = docs.join("_build", "doctestplus")
+    assert build_main(["-q", "-b", "doctestplus", "-j", "2", str(docs), str(outdir)]) == 1
+    junit = outdir.join("doctestplus-junit.xml").read()
+    assert 'tests="2"' in junit
+    assert 'failures="1"' in junit
+    assert '<testcase classname="other.rst" name="other.rst"' in junit
+
+    # The doctests can also run after another builder
+    docs.join("other.rst").write(docs.join("other.rst").read().replace("wrong", "output"))
+    outdir = docs.join("_build", "html")
+    assert build_main(["-q", "-b", "html", "-D", "doctestplus_run=1", str(docs),
+                       str(outdir)]) == 0
+    junit = outdir.join("doctestplus-junit.xml").read()
+    assert 'tests="2"' in junit
+    assert 'failures="0"' in junit
+    assert outdir.join("index.html").check()
+
+
+def test_sphinx_builder_warnings(testdir):
+    build_main = pytest.importorskip("sphinx.cmd.build").build_main
+    docs = testdir.mkdir("docs")
+    docs.join("conf.py").write(dedent("""
+        extensions = ['pytest_doctestplus.sphinx.doctestplus']
+        exclude_patterns = ['_build']
+        """))
+    docs.join("index.rst").write(dedent("""
+        Index
+        =====
+
+        >>> import warnings
+        >>> warnings.warn("deprecated")
+        """))
+    outdir = docs.join("_build", "doctestplus")
+    assert build_main(["-q", "-b", "doctestplus", str(docs), str(outdir)]) == 0
+    assert 'failures="0"' in outdir.join("doctestplus-junit.xml").read()
+
+    # With -W, the warnings of the doctests are errors too
+    assert build_main(["-q", "-W", "-b", "doctestplus", str(docs), str(outdir)]) == 1
+    assert 'failures="1"' in outdir.join("doctestplus-junit.xml").read()
+
+
+def test_watch(testdir):
+    testdir.makepyfile(heavy="""
+        with open("imports.log", "a") as f:
+            f.write("heavy\\n")
+        """)
+    testdir.makepyfile(module='''
+        import heavy
+
+        def double(x):
+            """
+            >>> double(2)
+            4
+            """
+            return 2 * x
+        ''')
+    testdir.makefile(".rst", doc="""
+        >>> import module
+        >>> module.double(3)
+        6
+        """)
+    process = testdir.popen(
+        [sys.executable, "-m", "pytest", "--doctest-plus", "--doctest-rst",
+         "--doctest-modules", "--doctest-plus-watch", "-p", "no:cacheprovider",
+         "module.py", "doc.rst"],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    lines = []
+    reader = threading.Thread(target=lambda: lines.extend(
+        line.decode() for line in process.stdout), daemon=True)
+    reader.start()
+
+    def wait_for(text, count):
+        for _ in range(200):
+            if sum(text in line for line in lines) >= count:
+                return
+            assert process.poll() is None, "".join(lines)
+            threading.Event().wait(0.05)
+        pytest.fail(f"{text!r} not found in:\n{''.join(lines)}")
+
+    try:
+        wait_for("watching 2 files for changes", 1)
+        assert any("2 passed" in line for line in lines)
+
+        # The changed module is imported again, but not the modules it imports
+        testdir.tmpdir.join("module.py").write(dedent('''
+            import heavy
+
+            def double(x):
+                """
+                >>> double(2)
+                4
+                """
+                return 2 * x + 1
+            '''))
+        wait_for("watching 2 files for changes", 2)
+        output = "".join(lines)
+        assert "changed: module.py" in output
+        assert "1 failed" in output
+        assert "FAILED module.py::module.double" in output
+        assert testdir.tmpdir.join("imports.log").read() == "heavy\n"
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=10)
+        reader.join(timeout=10)
+        process.stdout.close()
+    assert "Interrupted: stopped watching for changes" in "".join(lines)
+
+
+def test_serve(testdir):
+    from pytest_doctestplus.client import main, run
+
+    testdir.makepyfile(heavy="""
+        with open("imports.log", "a") as f:
+            f.write("heavy\\n")
+        """)
+    testdir.makepyfile(module='''
+        import heavy
+
+        def double(x):
+            """
+            >>> double(2)
+            4
+            """
+            return 2 * x
+
+        def fails():
+            """
+            >>> fails()
+            1
+            """
+        ''')
+    docs = testdir.mkdir("docs")
+    docs.join("leak.rst").write(dedent("""
+        >>> import sys
+        >>> hasattr(sys, 'doctestplus_leak')
+        False
+        >>> sys.doctestplus_leak = 1
+        """))
+    process = testdir.popen(
+        [sys.executable, "-m", "pytest", "--doctest-plus", "--doctest-rst",
+         "--doctest-modules", "--doctest-plus-serve", "-p", "no:cacheprovider",
+         "module.py", "docs"],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    path = testdir.tmpdir.join(".doctestplus.sock")
+    try:
+        for _ in range(200):
+            if path.exists():
+                break
+            assert process.poll() is None, process.stdout.read().decode()
+            threading.Event().wait(0.05)
+
+        def request(*args, cwd=testdir.tmpdir):
+            out = io.StringIO()
+            return run(str(path), args, cwd=str(cwd), out=out), out.getvalue()
+
+        # The state of a run does not leak into the next ones
+        for _ in range(2):
+            status, output = request("docs")
+            assert status == 0, output
+            assert "1 passed" in output
+
+        status, output = request("module.py::module.double")
+        assert status == 0, output
+        assert "1 passed" in output
+        status, output = request("leak.rst", "../module.py", cwd=docs)
+        assert status == 1, output
+        assert "1 failed, 2 passed" in output
+        assert "FAILED module.py::module.fails" in output
+        assert testdir.tmpdir.join("imports.log").read() == "heavy\n"
+
+        # The client finds the socket in the parent directories
+        with docs.as_cwd():
+            assert main(["leak.rst"]) == 0
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=10)
+        with process.stdout:
+            output = process.stdout.read().decode()
+    assert "Interrupted: stopped serving" in output
+    assert not path.exists()
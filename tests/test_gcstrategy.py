@@ -0,0 +1,23 @@
+import pytest
+
+from pytest_doctestplus.gcstrategy import DEFAULT_THRESHOLDS, GCStats, parse_strategies
+
+
+def test_parse_strategies():
+    assert parse_strategies(["none"]) == (["none"], None)
+    assert parse_strategies(["freeze", "thresholds"]) == (["freeze", "thresholds"],
+                                                          DEFAULT_THRESHOLDS)
+    assert parse_strategies(["thresholds=1000,5"]) == (["thresholds"], (1000, 5))
+    for value in ("fast", "freeze=1", "thresholds=a"):
+        with pytest.raises(pytest.UsageError, match="invalid doctest_plus_gc strategy"):
+            parse_strategies([value])
+
+
+def test_gc_stats():
+    stats = GCStats()
+    stats.callback("stop", {})
+    assert stats.collections == 0
+    stats.callback("start", {})
+    stats.callback("stop", {})
+    assert stats.collections == 1
+    assert stats.time >= 0
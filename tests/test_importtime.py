@@ -0,0 +1,35 @@
+import sys
+
+from pytest_doctestplus.importtime import ImportTimes, _TimingFinder, with_self_times
+
+
+def test_import_times(tmp_path, monkeypatch):
+    (tmp_path / 'timed_outer.py').write_text('import timed_inner\nimport timed_missing_ok\n')
+    (tmp_path / 'timed_inner.py').write_text('VALUE = 1\n')
+    (tmp_path / 'timed_missing_ok.py').write_text(
+        'try:\n    import timed_missing\nexcept ImportError:\n    pass\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ('timed_outer', 'timed_inner', 'timed_missing_ok'):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+
+    times = ImportTimes()
+    times.collector = 'test.rst'
+    finder = _TimingFinder(times)
+    sys.meta_path.insert(0, finder)
+    try:
+        import timed_outer
+    finally:
+        sys.meta_path.remove(finder)
+
+    # The modules only see their original loader
+    assert type(timed_outer.__loader__).__name__ == 'SourceFileLoader'
+    assert timed_outer.__spec__.loader is timed_outer.__loader__
+    assert sys.modules['timed_inner'].VALUE == 1
+
+    outer, = with_self_times(times.roots['test.rst'])
+    assert outer['module'] == 'timed_outer'
+    inner, missing_ok = outer['imports']
+    assert inner['module'] == 'timed_inner'
+    assert [node['module'] for node in missing_ok['imports']] == ['timed_missing']
+    assert outer['self'] == outer['cumulative'] - inner['cumulative'] - missing_ok['cumulative']
+    assert inner['self'] == inner['cumulative']
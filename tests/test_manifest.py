@@ -0,0 +1,70 @@
+import doctest
+import json
+
+from pytest_doctestplus.manifest import (MANIFEST_VERSION, Manifest, entry_from_json,
+                                         entry_to_json, parse_entries, text_digest,
+                                         write_manifest)
+from pytest_doctestplus.output_checker import FLOAT_CMP
+from pytest_doctestplus.parser import IncrementalDocTestParser, TextChunk
+
+TEXT = """\
+Title
+=====
+
+.. doctest-skip::
+
+    >>> 1 / 0
+    3
+
+>>> print(0.1 + 0.2)  # doctest: +FLOAT_CMP
+0.3
+"""
+
+
+def test_parse_entries():
+    entries = parse_entries(TEXT, 'text.rst')
+    text, skipped, chunk, example = [entry_from_json(entry) for entry in entries]
+
+    assert isinstance(text, TextChunk)
+    assert text.section and not text.blank
+    assert text.directive_lines == ['.. doctest-skip::']
+    assert text.last_lines == ['', '.. doctest-skip::']
+    assert (skipped.source, skipped.want, skipped.lineno, skipped.indent) == (
+        '1 / 0\n', '3\n', 5, 4)
+    assert isinstance(chunk, TextChunk) and chunk.blank
+    assert example.options == {FLOAT_CMP: True}
+    assert example.lineno == 8
+
+    # The entries are the same as those of the parser
+    parser = IncrementalDocTestParser()
+    lines = TEXT.splitlines(keepends=True)
+    parsed = [entry for entry in parser.iter_parse(lines, 'text.rst', parser.min_indent(lines))
+              if not isinstance(entry, TextChunk) or not entry.empty]
+    assert [entry_to_json(entry) for entry in parsed] == entries
+    assert json.loads(json.dumps(entries)) == entries
+
+
+def test_manifest(tmp_path):
+    path = tmp_path / 'docs' / 'text.rst'
+    path.parent.mkdir()
+    path.write_text(TEXT)
+    manifest_path = tmp_path / 'build' / 'doctests.json'
+    write_manifest(str(manifest_path), {str(path): {
+        'sha256': text_digest([TEXT]), 'entries': parse_entries(TEXT, 'text.rst')}})
+    data = json.loads(manifest_path.read_text())
+    assert data['version'] == MANIFEST_VERSION
+    assert list(data['files']) == ['../docs/text.rst']
+
+    manifest = Manifest.load(str(manifest_path))
+    entries = manifest.entries(str(path))
+    assert [entry.source for entry in entries if isinstance(entry, doctest.Example)] == [
+        '1 / 0\n', 'print(0.1 + 0.2)  # doctest: +FLOAT_CMP\n']
+    assert manifest.entries(str(tmp_path / 'other.rst')) is None
+
+    # The changed files are not collected from the manifest
+    path.write_text(TEXT + '\n')
+    assert manifest.entries(str(path)) is None
+
+    manifest_path.write_text(json.dumps(dict(data, version=MANIFEST_VERSION + 1)))
+    assert Manifest.load(str(manifest_path)) is None
+    assert Manifest.load(str(tmp_path / 'missing.json')) is None
@@ -0,0 +1,129 @@
+import doctest
+import io
+import tracemalloc
+
+import pytest
+
+from pytest_doctestplus.parser import FileDocTest, IncrementalDocTestParser, TextChunk
+
+
+TEXTS = [
+    "",
+    ">>> 1 + 1\n2",
+    """\
+Some text
+
+.. doctest-skip::
+
+    >>> 1 + 1
+    3
+    >>> for i in range(2):
+    ...     print(i)
+    0
+    1
+
+  .. doctest-requires:: numpy  \n\n\n>>> raise ValueError('x')
+Traceback (most recent call last):
+ValueError: x
+>>> # just a comment
+text after a comment
+>>> print('a\\n\\nb')
+a
+<BLANKLINE>
+b
+""",
+    # Indented text, with tabs and form feeds
+    "    text\n\t>>> 1\n\t1\n\n    \x0c .. doctest-skip-all\n  \n    >>> 2  # doctest: +SKIP\n",
+    "\n\n   \n",
+    "  .. doctest-requires-all:: a, b  \n",
+]
+
+
+def _reference(text):
+    result = []
+    for entry in doctest.DocTestParser().parse(text, 'test'):
+        if isinstance(entry, str):
+            lines = entry.strip().splitlines()
+            result.append((not entry, not lines, [line for line in lines if 'doctest-' in line],
+                           lines[-2:]))
+        else:
+            result.append(entry)
+    return result
+
+
+def _parse(text):
+    parser = IncrementalDocTestParser()
+    min_indent = parser.min_indent(io.StringIO(text, newline='\n'))
+    result = []
+    for entry in parser.iter_parse(io.StringIO(text, newline='\n'), 'test', min_indent):
+        if isinstance(entry, TextChunk):
+            result.append((entry.empty, entry.blank, entry.directive_lines, entry.last_lines))
+        else:
+            result.append(entry)
+    return result
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_iter_parse(text):
+    assert _parse(text) == _reference(text)
+
+
+def test_iter_parse_errors():
+    for text in ('>>>1\n', '  >>> 1\n  ...2\n', '  >>> 1\n 1\n'):
+        with pytest.raises(ValueError) as reference:
+            doctest.DocTestParser().parse(text, 'test')
+        with pytest.raises(ValueError) as error:
+            _parse(text)
+        assert str(error.value) == str(reference.value)
+
+
+def test_iter_parse_memory(tmp_path):
+    path = tmp_path / 'large.rst'
+    with open(path, 'w') as f:
+        for i in range(100000):
+            f.write(f'Line {i} of some long narrative documentation text.\n')
+            if i % 1000 == 0:
+                f.write(f'\n    >>> {i} + 1\n    {i + 1}\n\n')
+
+    parser = IncrementalDocTestParser()
+    tracemalloc.start()
+    try:
+        with open(path) as f:
+            examples = [entry for entry in parser.iter_parse(f, 'large.rst')
+                        if isinstance(entry, doctest.Example)]
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(examples) == 100
+    assert examples[1].source == '1000 + 1\n'
+    assert examples[1].lineno == 1006
+    assert peak < path.stat().st_size / 10
+
+
+def test_file_doctest(tmp_path):
+    path = tmp_path / 'example.rst'
+    path.write_text('Text\n\n>>> 1\n1\n', encoding='utf-8')
+    with open(path, encoding='utf-8') as f:
+        examples = [entry for entry in IncrementalDocTestParser().iter_parse(f)
+                    if isinstance(entry, doctest.Example)]
+
+    test = FileDocTest(examples, {}, 'example.rst', str(path), 0, 'utf-8')
+
+    assert test._docstring is None
+    assert test.docstring == 'Text\n\n>>> 1\n1\n'
+    assert hash(test) == hash(FileDocTest(examples, {}, 'example.rst', str(path), 0))
+
+
+@pytest.mark.parametrize(('text', 'section'), [
+    ('Title\n=====\n\n', True),
+    ('Some text\n\n----\n\nMore text\n', False),
+    ('# Heading\n\nText\n', True),
+    ('#comment\n', False),
+    ('  Indented\n  ~~~~~~~~\n', True),
+    ('Text\n..\n', False),
+])
+def test_section(text, section):
+    chunks = [entry for entry in IncrementalDocTestParser().iter_parse(io.StringIO(text))
+              if isinstance(entry, TextChunk)]
+    assert chunks[0].section is section
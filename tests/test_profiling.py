@@ -0,0 +1,82 @@
+import doctest
+
+from pytest_doctestplus.profiling import collapsed_stacks, example_locations
+
+
+def test_example_locations():
+    examples = [doctest.Example('x = 1\n', '', lineno=2),
+                doctest.Example('x\n', '1\n', lineno=5)]
+    dtest = doctest.DocTest(examples, {}, 'module.f', 'module.py', 10, '')
+    assert example_locations(dtest) == {'<doctest module.f[0]>': ('module.py', 12),
+                                        '<doctest module.f[1]>': ('module.py', 15)}
+
+
+def test_collapsed_stacks():
+    run = ('doctest.py', 1, 'run')
+    example = ('<doctest test[0]>', 1, '<module>')
+    f = ('module.py', 10, 'f')
+    g = ('module.py', 20, 'g')
+    builtin = ('~', 0, '<built-in method builtins.len>')
+    # g is called once from the example and once from f, and recursively
+    stats = {
+        run: (1, 1, 1.0, 8.0, {}),
+        example: (1, 1, 1.0, 7.0, {run: (1, 1, 1.0, 7.0)}),
+        f: (1, 1, 2.0, 4.0, {example: (1, 1, 2.0, 4.0)}),
+        g: (3, 2, 3.0, 4.0, {example: (1, 1, 1.5, 2.0), f: (1, 1, 1.5, 2.0),
+                             g: (1, 1, 0.0, 0.0)}),
+        builtin: (1, 1, 1.0, 1.0, {g: (1, 1, 1.0, 1.0)}),
+    }
+    stacks = collapsed_stacks(stats, {'<doctest test[0]>': ('test.rst', 4)})
+    example, f, g, builtin = ('<module> (test.rst:5)', 'f (module.py:10)',
+                              'g (module.py:20)', '<built-in method builtins.len>')
+    assert stacks == {
+        (): 1.0,
+        (example,): 1.0,
+        (example, f): 2.0,
+        (example, f, g): 1.5,
+        (example, g): 1.5,
+        # The time of the builtin is split between the stacks of g
+        (example, f, g, builtin): 0.5,
+        (example, g, builtin): 0.5,
+    }
+    assert sum(stacks.values()) == stats[run][3]
+
+
+def test_collapsed_stacks_deep():
+    # A chain of calls deeper than the recursion limit
+    example = ('<doctest test[0]>', 1, '<module>')
+    funcs = [example] + [('module.py', i, f'f{i}') for i in range(5000)]
+    stats = {example: (1, 1, 1.0, 5001.0, {})}
+    for i, func in enumerate(funcs[1:], 1):
+        time = 5001.0 - i
+        stats[func] = (1, 1, 1.0, time, {funcs[i - 1]: (1, 1, 1.0, time)})
+
+    stacks = collapsed_stacks(stats, {'<doctest test[0]>': ('test.rst', 4)}, max_depth=100)
+    # The time of the frames below the cut is counted in the last one
+    assert len(stacks) == 100
+    assert max(len(stack) for stack in stacks) == 100
+    assert stacks[max(stacks, key=len)] == 4902.0
+    assert sum(stacks.values()) == 5001.0
+
+
+def test_collapsed_stacks_diamonds():
+    # 30 layers of two functions, each calling both functions of the next
+    # layer: 2 ** 30 paths
+    example = ('<doctest test[0]>', 1, '<module>')
+    layers = [[example]] + [[('module.py', i, f'a{i}'), ('module.py', i, f'b{i}')]
+                            for i in range(30)]
+    stats = {example: (1, 1, 0.0, 2.0 ** 30, {})}
+    time = 2.0 ** 29
+    for depth, layer in enumerate(layers[1:], 1):
+        self_time = time if depth == 30 else 0.0
+        for func in layer:
+            callers = {caller: (1, 1, self_time / len(layers[depth - 1]),
+                                time / len(layers[depth - 1]))
+                       for caller in layers[depth - 1]}
+            stats[func] = (1, 1, self_time, time, callers)
+
+    stacks = collapsed_stacks(stats, {'<doctest test[0]>': ('test.rst', 4)},
+                              min_time=0, max_stacks=1000)
+    # The walked stacks, and the branches left to walk at the cut
+    assert len(stacks) <= 1000 + 30 * 2
+    assert sum(stacks.values()) == stats[example][3]
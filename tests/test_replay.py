@@ -0,0 +1,67 @@
+import doctest
+
+import pytest
+
+from pytest_doctestplus.replay import example_key, example_names, replay_examples
+
+
+@pytest.mark.parametrize(('source', 'defined', 'used'), [
+    ('x = 1\n', {'x'}, set()),
+    ('y = x + 1\n', {'y'}, {'x'}),
+    ('import numpy as np\nimport os.path\n', {'np', 'os'}, set()),
+    ('def f(a):\n    return a + b\n', {'f'}, {'a', 'b'}),
+    ('a.b[0] = c\n', {'a'}, {'a', 'c'}),
+    ('np.random.seed(0)\n', {'np'}, {'np'}),
+    ('shuffle(a, key=k)\n', {'a', 'k'}, {'shuffle', 'a', 'k'}),
+    ('for i in range(2):\n    del d[i]\n', {'i', 'd'}, {'range', 'i', 'd'}),
+])
+def test_example_names(source, defined, used):
+    assert example_names(source) == (defined, used)
+
+
+@pytest.mark.parametrize('source', ['from os import *\n', '%timeit 1\n'])
+def test_example_names_unknown(source):
+    assert example_names(source) is None
+
+
+def _examples(*sources):
+    return [doctest.Example(source, '', lineno=i) for i, source in enumerate(sources)]
+
+
+def _replay(examples, *failed):
+    replay = replay_examples(examples, [example_key(examples[i]) for i in failed])
+    return None if replay is None else [examples.index(example) for example in replay]
+
+
+def test_replay_examples():
+    examples = _examples(
+        'import math\n',
+        'x = 1\n',
+        'y = 2\n',
+        'x += 1\n',
+        'z = math.sqrt(x)\n',
+        'print(y)\n',
+        'z\n',
+        'w = 1\n',
+    )
+    assert _replay(examples, 6) == [0, 1, 3, 4, 6]
+    assert _replay(examples, 5, 6) == [0, 1, 2, 3, 4, 5, 6]
+    assert _replay(examples, 7) == [7]
+
+    # Examples that can not be analyzed depend on all the previous ones
+    examples.insert(4, doctest.Example('from os import *\n', '', lineno=4))
+    assert _replay(examples, 7) == [0, 1, 2, 3, 4, 5, 7]
+
+
+def test_replay_examples_moved():
+    examples = _examples('x = 1\n', 'x\n', 'y = 1\n', 'x\n')
+    key = example_key(examples[3])
+
+    # The example with the same source closest to the line is replayed
+    key[0] = 2
+    assert replay_examples(examples, [key]) == examples[:2]
+    key[0] = 3
+    assert replay_examples(examples, [key]) == [examples[0], examples[3]]
+
+    key[1] = 'changed'
+    assert replay_examples(examples, [key]) is None
@@ -0,0 +1,66 @@
+import doctest
+import json
+from types import SimpleNamespace
+
+from pytest_doctestplus.report import DoctestReport, skip_reason
+
+
+def test_skip_reason():
+    example = doctest.Example('1 + 1\n', '2\n', options={doctest.SKIP: True})
+    dtest = doctest.DocTest([example], {}, 'test', 'test.rst', 0, '')
+    message = 'Skipped: all tests skipped by +SKIP option'
+
+    assert skip_reason(dtest, message) == 'directive'
+    example._doctestplus_skip_reason = 'remote data'
+    assert skip_reason(dtest, message) == 'remote data'
+    assert skip_reason(dtest, 'Skipped: listed in `__doctest_skip__`') == '__doctest_skip__'
+    assert skip_reason(dtest, 'Skipped: could not import numpy') == 'requirement'
+    assert skip_reason(dtest, 'Skipped: unconditional skip') == 'other'
+
+    # The examples inserted by doctestplus are not those of the doctest
+    helper = doctest.Example('pass\n', '')
+    helper._doctestplus_helper = True
+    dtest.examples.insert(0, helper)
+    assert skip_reason(dtest, message) == 'remote data'
+
+
+def _report(when, outcome, duration, **kwargs):
+    return SimpleNamespace(nodeid='test.rst::test.rst', when=when, duration=duration,
+                           passed=outcome == 'passed', failed=outcome == 'failed',
+                           skipped=outcome == 'skipped', **kwargs)
+
+
+def test_doctest_report(tmp_path):
+    report = DoctestReport()
+    report.add(_report('setup', 'passed', 0.5, doctestplus_record={'nodeid': 'test.rst::test.rst'}))
+    report.add(_report('call', 'passed', 1))
+    report.add(_report('teardown', 'failed', 0.5))
+    # Reports of other tests are ignored
+    report.add(SimpleNamespace(nodeid='test_a.py::test'))
+
+    path = tmp_path / 'report' / 'report.json'
+    report.write(str(path))
+    assert json.loads(path.read_text()) == {'doctests': [
+        {'nodeid': 'test.rst::test.rst', 'duration': 2.0, 'outcome': 'failed',
+         'skip_reason': None}]}
+
+    report.add(_report('setup', 'passed', 0, doctestplus_record={'nodeid': 'test.rst::test.rst'}))
+    report.add(_report('call', 'skipped', 0, doctestplus_skip_reason='requirement'))
+    assert report.records['test.rst::test.rst']['outcome'] == 'skipped'
+    assert report.records['test.rst::test.rst']['skip_reason'] == 'requirement'
+
+
+def test_doctest_report_collected():
+    report = DoctestReport()
+    report.collect({'nodeid': 'test.rst::test.rst'})
+    report.collect({'nodeid': 'other.rst::other.rst'})
+    report.deselect('other.rst::other.rst')
+    report.add(_report('call', 'passed', 1))
+    # Collected again, e.g. by another pytest-xdist worker
+    report.collect({'nodeid': 'test.rst::test.rst'})
+
+    assert report.records == {
+        'test.rst::test.rst': {'nodeid': 'test.rst::test.rst', 'duration': 1.0,
+                               'outcome': 'passed', 'skip_reason': None},
+        'other.rst::other.rst': {'nodeid': 'other.rst::other.rst', 'duration': 0.0,
+                                 'outcome': 'deselected', 'skip_reason': None}}
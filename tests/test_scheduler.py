@@ -0,0 +1,128 @@
+import heapq
+
+import pytest
+
+pytest.importorskip('xdist')
+
+from xdist.scheduler import LoadScheduling  # noqa: E402
+
+from pytest_doctestplus.core import DURATIONS_KEY  # noqa: E402
+from pytest_doctestplus.scheduler import DurationScheduling, estimate_costs  # noqa: E402
+
+
+class FakeCache:
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, key, default):
+        return self.values.get(key, default)
+
+
+class FakeConfig:
+    def __init__(self, numnodes, rootpath, durations):
+        self.numnodes = numnodes
+        self.rootpath = rootpath
+        self.cache = FakeCache({DURATIONS_KEY: durations})
+
+    def getvalue(self, name):
+        assert name == 'tx'
+        return [f'{self.numnodes}*popen']
+
+    def getoption(self, name):
+        assert name == 'maxschedchunk'
+        return None
+
+
+class FakeGateway:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeNode:
+    def __init__(self, id):
+        self.gateway = FakeGateway(id)
+        self.shutting_down = False
+        self.queue = []
+
+    def send_runtest_some(self, indices):
+        self.queue.extend(indices)
+
+    def shutdown(self):
+        self.shutting_down = True
+
+
+def run(scheduler_cls, collection, durations, numnodes, tmp_path):
+    """Simulate running the collection and return its makespan."""
+    sched = scheduler_cls(FakeConfig(numnodes, tmp_path, durations))
+    nodes = [FakeNode(f'gw{i}') for i in range(numnodes)]
+    for node in nodes:
+        sched.add_node(node)
+    for node in nodes:
+        sched.add_node_collection(node, collection)
+    sched.schedule()
+
+    now = 0
+    running = []
+    ran = set()
+    idle = set(nodes)
+
+    def start(time):
+        # Like pytest-xdist workers, the nodes only run an item once they know
+        # the next one, or that there is none.
+        for node in list(idle):
+            if len(node.queue) > 1 or node.queue and node.shutting_down:
+                index = node.queue.pop(0)
+                heapq.heappush(running, (time + durations[collection[index]],
+                                         node.gateway.id, index, node))
+                idle.remove(node)
+
+    start(0)
+    while running:
+        now, _, index, node = heapq.heappop(running)
+        ran.add(index)
+        idle.add(node)
+        sched.mark_test_complete(node, index, durations[collection[index]])
+        start(now)
+
+    assert ran == set(range(len(collection)))
+    assert all(node.shutting_down for node in nodes) or not collection
+    return now
+
+
+def test_estimate_costs(tmp_path):
+    (tmp_path / 'small.rst').write_text('x' * 100)
+    (tmp_path / 'large.rst').write_text('x' * 1000)
+    (tmp_path / 'module.py').write_text('x' * 1000)
+    collection = ['small.rst::small.rst', 'large.rst::large.rst',
+                  'module.py::module.a', 'module.py::module.b', 'missing.rst::missing.rst']
+
+    # Without history, the costs follow the sizes of the files
+    costs = estimate_costs(collection, {}, str(tmp_path))
+    assert costs[0] < costs[2] == costs[3] < costs[1]
+    assert costs[4] == 0
+
+    # Recorded durations are used as they are, and set the rate of the others
+    costs = estimate_costs(collection, {'small.rst::small.rst': 2.0}, str(tmp_path))
+    assert costs == [2.0, 20.0, 10.0, 10.0, 0]
+
+
+@pytest.mark.parametrize('numnodes', [2, 4, 32])
+def test_makespan(tmp_path, numnodes):
+    # Many quick tests, with a few long tutorials at the end
+    collection = [f'test_{i}.py::test' for i in range(400)]
+    collection += [f'docs/tutorial_{i}.rst::tutorial_{i}.rst' for i in range(3)]
+    durations = {nodeid: 0.02 for nodeid in collection}
+    for i in range(3):
+        durations[f'docs/tutorial_{i}.rst::tutorial_{i}.rst'] = 3.0
+
+    makespan = run(DurationScheduling, collection, durations, numnodes, tmp_path)
+    lower_bound = max(max(durations.values()), sum(durations.values()) / numnodes)
+    assert makespan <= lower_bound + 0.2
+    assert makespan < run(LoadScheduling, collection, durations, numnodes, tmp_path)
+
+
+def test_few_items(tmp_path):
+    collection = ['a.rst::a.rst', 'b.rst::b.rst']
+    durations = {'a.rst::a.rst': 1.0, 'b.rst::b.rst': 2.0}
+    assert run(DurationScheduling, collection, durations, 4, tmp_path) == 2.0
+    assert run(DurationScheduling, [], {}, 2, tmp_path) == 0
@@ -0,0 +1,42 @@
+import sys
+
+import pytest
+
+from pytest_doctestplus.watch import InotifyWatcher, PollingWatcher, make_watcher
+
+WATCHERS = [PollingWatcher,
+            pytest.param(InotifyWatcher, marks=pytest.mark.skipif(
+                not sys.platform.startswith("linux"), reason="inotify is only on Linux"))]
+
+
+@pytest.mark.parametrize("watcher_class", WATCHERS)
+def test_watcher(tmp_path, watcher_class):
+    watched = tmp_path / "watched.rst"
+    other = tmp_path / "other.rst"
+    watched.write_text(">>> 1\n1\n")
+    other.write_text("")
+    kwargs = {"interval": 0.01} if watcher_class is PollingWatcher else {}
+    watcher = watcher_class([watched], **kwargs)
+    try:
+        assert watcher.wait(timeout=0.05) == set()
+        other.write_text("changed\n")
+        assert watcher.wait(timeout=0.05) == set()
+        watched.write_text(">>> 2\n2\n")
+        assert watcher.wait(timeout=5) == {watched}
+
+        # Saved by writing a new file and renaming it over the watched one
+        new = tmp_path / "new.rst"
+        new.write_text(">>> 3\n3\n")
+        new.replace(watched)
+        assert watcher.wait(timeout=5) == {watched}
+    finally:
+        watcher.close()
+
+
+def test_make_watcher(tmp_path):
+    watcher = make_watcher([tmp_path / "file.rst"])
+    try:
+        expected = InotifyWatcher if sys.platform.startswith("linux") else PollingWatcher
+        assert isinstance(watcher, expected)
+    finally:
+        watcher.close()